@@ -1,61 +1,99 @@
+import time
 from datetime import datetime
-import sqlite3
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
-from engine.redis_engine import get_user_profile_scores
-from utils.collections import send_to_kafka
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, only needed for binary batch uploads
+    msgpack = None
+
+from db.catalog import ensure_catalog_schema
+from db.search_index import build_match_query, ensure_search_index
+from engine.redis_engine import get_recommendations, get_user_profile_scores
+from engine.similar_products import SimilarProductsIndex
+from utils.catalog_cache import CatalogCache
+from utils.collections import get_kafka_stats, send_batch_to_kafka, send_to_kafka
+from utils.db_client import execute_db, get_db_connection, query_db
+from utils.events import EventValidationError, format_timestamp, validate_event
+from utils.metrics import HTTP_LATENCY, KAFKA_PIPELINE, render_metrics
+from utils.pagination import get_next_cursor, keyset_condition, parse_page_args
 from utils.redis_client import get_redis_connection
+from utils.swr_cache import StaleWhileRevalidateCache
 
 app = Flask(__name__)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:3001"}})
 redis_conn = get_redis_connection()
 
+with get_db_connection() as conn:
+    ensure_catalog_schema(conn)
+    ensure_search_index(conn)
+
+# Total counts only change with the catalog, so they are cached per filter
+count_cache = CatalogCache()
+# Category listings back the home page and sidebar, serve them from memory
+category_cache = CatalogCache(ttl=300)
+# Built offline by build_similar_products.py, memory mapped and shared by all workers
+similar_products_index = SimilarProductsIndex().load()
+similar_products_cache = CatalogCache(ttl=300)
 
-# Utility functions
-def get_db_connection():
-    conn = sqlite3.connect("db/ecommerce.db")
-    conn.row_factory = sqlite3.Row  # Enables column access by name
-    return conn
 
+# Request latency, labelled by route pattern so path parameters don't explode cardinality
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-def query_db(query, args=(), one=False):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, args)
-    result = cur.fetchall()
-    conn.close()
-    return (result[0] if result else None) if one else result
 
+@app.after_request
+def record_request_latency(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_LATENCY.labels(request.method, endpoint, response.status_code).observe(
+            time.perf_counter() - started
+        )
+    return response
 
+
+# Utility functions
 def insert_and_get_id(query, args=()):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute(query, args)
-    conn.commit()
-    last_id = cur.lastrowid
-    conn.close()
-    return last_id
+    return execute_db(query, args)
+
+
+def get_cached_count(count_query, args=()):
+    return count_cache.get(
+        (count_query, tuple(args)),
+        lambda: query_db(count_query, args, one=True)["count"],
+    )
 
 
 # Category Endpoints
 @app.route("/api/categories", methods=["GET"])
 def get_categories():
-    categories = query_db(
-        "SELECT id, category_name FROM categories ORDER BY popularity DESC"
+    categories = category_cache.get(
+        "categories",
+        lambda: [
+            dict(row)
+            for row in query_db(
+                "SELECT id, category_name FROM categories ORDER BY popularity DESC"
+            )
+        ],
     )
-    return jsonify([dict(row) for row in categories])
+    return jsonify(categories)
 
 
 # Product Endpoints
 @app.route("/api/products", methods=["GET"])
 def get_products():
-    params = get_product_query_params(request)
+    try:
+        params = get_product_query_params(request)
+    except ValueError as error:
+        # A malformed limit, skip or cursor
+        return jsonify({"error": str(error)}), 400
+
     products = query_db(params["query"], tuple(params["args"]))
-    total_count = query_db(
-        params["count_query"], tuple(params["count_args"]), one=True
-    )["count"]
+    total_count = get_cached_count(params["count_query"], params["count_args"])
 
     return jsonify(
         {
@@ -63,28 +101,39 @@ def get_products():
             "total": total_count,
             "skip": params["skip"],
             "limit": params["limit"],
+            "next_cursor": get_next_cursor(
+                products, params["limit"], sort_key=params["sort_by"]
+            ),
         }
     )
 
 
 def get_product_query_params(request):
     # Helper function to generate query parameters for /api/products
-    limit = int(request.args.get("limit", 10))
-    skip = int(request.args.get("skip", 0))
+    limit, skip = parse_page_args(request.args)
     sort_by = request.args.get("sortBy", "id")
     order = request.args.get("order", "asc").lower()
     select_fields = request.args.get("select", "*")
     category_id = request.args.get("category", None)
     search_query = request.args.get("search", None)
     ids = request.args.get("ids", None)
+    # Passing a cursor (empty for the first page) switches to keyset pagination
+    cursor = request.args.get("cursor", None)
+
+    if cursor is not None and select_fields != "*":
+        # The next cursor is built from the sort column and id of the last row
+        select_fields = f"{select_fields}, id, {sort_by}"
 
     base_query = f"SELECT {select_fields} FROM products"
     count_query = "SELECT COUNT(*) as count FROM products"
     conditions, args = [], []
 
-    if search_query:
-        conditions.append("(title LIKE ?)")
-        args.append(f"%{search_query}%")
+    match_query = build_match_query(search_query)
+    if match_query:
+        conditions.append(
+            "id IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)"
+        )
+        args.append(match_query)
     if category_id:
         conditions.append("category_id = ?")
         args.append(category_id)
@@ -94,67 +143,139 @@ def get_product_query_params(request):
         conditions.append(f"id IN ({placeholders})")
         args.extend(ids_list)  # Add each id as a separate argument
 
+    count_where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+    count_args = list(args)
+
+    if cursor:
+        condition, cursor_args = keyset_condition(sort_by, order, cursor)
+        conditions.append(condition)
+        args.extend(cursor_args)
+
     where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
-    query = f"{base_query}{where_clause} ORDER BY {sort_by} {order.upper()} LIMIT ? OFFSET ?"
-    args.extend([limit, skip])
+    order_clause = f" ORDER BY {sort_by} {order.upper()}"
+    if sort_by != "id":
+        order_clause += f", id {order.upper()}"  # Tie-breaker for stable pages
+
+    if cursor is not None:
+        query = f"{base_query}{where_clause}{order_clause} LIMIT ?"
+        args.append(limit)
+        skip = 0
+    else:
+        query = f"{base_query}{where_clause}{order_clause} LIMIT ? OFFSET ?"
+        args.extend([limit, skip])
 
     return {
         "query": query,
-        "count_query": f"{count_query}{where_clause}",
+        "count_query": f"{count_query}{count_where_clause}",
         "args": args,
-        "count_args": args[:-2],
+        "count_args": count_args,
         "limit": limit,
         "skip": skip,
+        "sort_by": sort_by,
     }
 
 
 @app.route("/api/products/search", methods=["GET"])
 def search_products():
     search_query = request.args.get("q", "")
-    limit = int(request.args.get("limit", 10))
-    skip = int(request.args.get("skip", 0))
+    try:
+        limit, skip = parse_page_args(request.args)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    cursor = request.args.get("cursor", None)
+    match_query = build_match_query(search_query)
+
+    if not match_query:
+        return jsonify(
+            {"products": [], "total": 0, "skip": skip, "limit": limit, "next_cursor": None}
+        )
 
-    query = """
-    SELECT * FROM products
-    WHERE title LIKE ? OR description LIKE ?
-    LIMIT ? OFFSET ?
+    # Results are ranked by BM25, weighting title matches above description ones
+    conditions, args = ["products_fts MATCH ?"], [match_query]
+    if cursor:
+        try:
+            condition, cursor_args = keyset_condition(
+                "products_fts.rank", "asc", cursor, id_column="p.id"
+            )
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        conditions.append(condition)
+        args.extend(cursor_args)
+
+    query = f"""
+    SELECT p.*, products_fts.rank AS search_rank FROM products_fts
+    JOIN products p ON p.id = products_fts.rowid
+    WHERE {" AND ".join(conditions)}
+    ORDER BY products_fts.rank, p.id
     """
-    search_results = query_db(
-        query, (f"%{search_query}%", f"%{search_query}%", limit, skip)
+    if cursor is not None:
+        query += "LIMIT ?"
+        args.append(limit)
+        skip = 0
+    else:
+        query += "LIMIT ? OFFSET ?"
+        args.extend([limit, skip])
+
+    search_results = query_db(query, tuple(args))
+    total_count = get_cached_count(
+        "SELECT COUNT(*) as count FROM products_fts WHERE products_fts MATCH ?",
+        (match_query,),
     )
 
     return jsonify(
         {
             "products": [dict(row) for row in search_results],
-            "total": len(search_results),
+            "total": total_count,
             "skip": skip,
             "limit": limit,
+            "next_cursor": get_next_cursor(
+                search_results, limit, sort_key="search_rank"
+            ),
         }
     )
 
 
 @app.route("/api/products/category/<category_slug>", methods=["GET"])
 def get_products_by_category(category_slug):
-    limit = int(request.args.get("limit", 10))
-    skip = int(request.args.get("skip", 0))
-
-    query = """
+    try:
+        limit, skip = parse_page_args(request.args)
+    except ValueError as error:
+        return jsonify({"error": str(error)}), 400
+    cursor = request.args.get("cursor", None)
+
+    conditions, args = ["c.slug = ?"], [category_slug]
+    if cursor:
+        try:
+            condition, cursor_args = keyset_condition("p.id", "asc", cursor, id_column="p.id")
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        conditions.append(condition)
+        args.extend(cursor_args)
+
+    query = f"""
     SELECT p.* FROM products p
     JOIN categories c ON p.category_id = c.id
-    WHERE c.slug = ?
-    LIMIT ? OFFSET ?
+    WHERE {" AND ".join(conditions)}
+    ORDER BY p.id
     """
-    products = query_db(query, (category_slug, limit, skip))
+    if cursor is not None:
+        query += "LIMIT ?"
+        args.append(limit)
+        skip = 0
+    else:
+        query += "LIMIT ? OFFSET ?"
+        args.extend([limit, skip])
+
+    products = query_db(query, tuple(args))
 
-    total_count = query_db(
+    total_count = get_cached_count(
         """
         SELECT COUNT(*) as count FROM products p
         JOIN categories c ON p.category_id = c.id
         WHERE c.slug = ?
         """,
         (category_slug,),
-        one=True,
-    )["count"]
+    )
 
     return jsonify(
         {
@@ -162,6 +283,7 @@ def get_products_by_category(category_slug):
             "total": total_count,
             "skip": skip,
             "limit": limit,
+            "next_cursor": get_next_cursor(products, limit),
         }
     )
 
@@ -174,6 +296,35 @@ def get_product(product_id):
     return jsonify({"error": "Product not found"}), 404
 
 
+@app.route("/api/products/<int:product_id>/similar", methods=["GET"])
+def get_similar_products(product_id):
+    limit = request.args.get("limit", 10, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    # One snapshot for the cache key and the lookup, even if a reload swaps it meanwhile
+    snapshot = similar_products_index.maybe_refresh().snapshot
+    products, source = similar_products_cache.get(
+        (snapshot.path, product_id, limit),
+        lambda: load_similar_products(snapshot, product_id, limit),
+    )
+    if source is None and not query_db(
+        "SELECT 1 FROM products WHERE id = ?", (product_id,), one=True
+    ):
+        return jsonify({"error": "Product not found"}), 404
+    return jsonify({"product_id": product_id, "source": source, "products": products})
+
+
+def load_similar_products(snapshot, product_id, limit):
+    similar, source = snapshot.get_similar(product_id, limit)
+    if not similar:
+        return [], None
+    scores = dict(similar)
+    products = get_product_cards([similar_id for similar_id, _ in similar])
+    for product in products:
+        product["similarity"] = round(scores[product["id"]], 4)
+    return products, source
+
+
 # Cart Endpoints
 @app.route("/api/cart", methods=["GET"])
 def get_cart():
@@ -233,41 +384,90 @@ def update_or_insert_cart_item(cart_id, product_id, quantity):
         (cart_id, product_id),
         one=True,
     )
-    conn = get_db_connection()
-    cur = conn.cursor()
-    if existing_item:
-        cur.execute(
-            "UPDATE cart_items SET quantity = ? WHERE cart_id = ? AND product_id = ?",
-            (existing_item["quantity"] + quantity, cart_id, product_id),
-        )
-    else:
-        cur.execute(
-            "INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (?, ?, ?)",
-            (cart_id, product_id, quantity),
-        )
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn, conn:
+        if existing_item:
+            conn.execute(
+                "UPDATE cart_items SET quantity = ? WHERE cart_id = ? AND product_id = ?",
+                (existing_item["quantity"] + quantity, cart_id, product_id),
+            )
+        else:
+            conn.execute(
+                "INSERT INTO cart_items (cart_id, product_id, quantity) VALUES (?, ?, ?)",
+                (cart_id, product_id, quantity),
+            )
 
 
 # Tracking and Profile Endpoints
+MAX_TRACK_BATCH_SIZE = 500
+
+
 @app.route("/api/track", methods=["POST"])
 def track_event():
-    data = request.get_json()
-    if data.get("event_type") not in {
-        "view_product",
-        "click_category",
-        "search",
-        "add_to_cart",
-        "purchase",
-    }:
-        return jsonify({"error": "Invalid event type"}), 400
-
-    data["timestamp"] = data.get(
-        "timestamp", datetime.utcnow().isoformat()
-    )
-    send_to_kafka("user_interactions", data)
+    try:
+        event = validate_event(
+            request.get_json(silent=True), format_timestamp(datetime.utcnow())
+        )
+    except EventValidationError as error:
+        return jsonify({"error": str(error)}), 400
+
+    if not send_to_kafka("user_interactions", event):
+        return jsonify({"error": "Tracking queue is full, retry later"}), 503
+
+    return jsonify({"status": "success", "session_id": event.session_id}), 200
 
-    return jsonify({"status": "success", "session_id": data["session_id"]}), 200
+
+@app.route("/api/track/batch", methods=["POST"])
+def track_events_batch():
+    # Accepts a JSON (or msgpack) array of events, or an object with an "events" array
+    if request.mimetype in ("application/msgpack", "application/x-msgpack"):
+        if msgpack is None:
+            return jsonify({"error": "msgpack is not supported by this server"}), 415
+        try:
+            data = msgpack.unpackb(request.get_data(), raw=False)
+        except (ValueError, msgpack.UnpackException):
+            return jsonify({"error": "Invalid msgpack payload"}), 400
+    else:
+        data = request.get_json(silent=True)
+
+    events = data.get("events") if isinstance(data, dict) else data
+    if not isinstance(events, list):
+        return jsonify({"error": "Expected an array of events"}), 400
+    if len(events) > MAX_TRACK_BATCH_SIZE:
+        return (
+            jsonify({"error": f"At most {MAX_TRACK_BATCH_SIZE} events per batch"}),
+            413,
+        )
+
+    results, accepted_indexes, accepted_events = [], [], []
+    default_timestamp = format_timestamp(datetime.utcnow())
+    for index, data in enumerate(events):
+        try:
+            event = validate_event(data, default_timestamp)
+        except EventValidationError as error:
+            results.append({"index": index, "status": "rejected", "error": str(error)})
+            continue
+        results.append({"index": index, "status": "accepted"})
+        accepted_indexes.append(index)
+        accepted_events.append(event)
+
+    for index, sent in zip(
+        accepted_indexes, send_batch_to_kafka("user_interactions", accepted_events)
+    ):
+        if not sent:
+            results[index] = {"index": index, "status": "dropped", "error": "Tracking queue is full"}
+
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return (
+        jsonify(
+            {
+                "status": "success" if accepted == len(events) else "partial",
+                "accepted": accepted,
+                "rejected": len(events) - accepted,
+                "results": results,
+            }
+        ),
+        200,
+    )
 
 
 @app.route("/api/user_profile", methods=["GET"])
@@ -276,7 +476,10 @@ def get_user_profile():
     if not session_id:
         return jsonify({"error": "session_id is required"}), 400
 
-    profile_data = get_user_profile_scores(session_id)
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit < 1:
+        return jsonify({"error": "limit must be at least 1"}), 400
+    profile_data = get_user_profile_scores(session_id, top_k=limit)
     if not profile_data:
         return jsonify({"error": "User profile not found"}), 404
 
@@ -286,38 +489,124 @@ def get_user_profile():
 # Recommendations Endpoint
 @app.route("/api/categories/top_products", methods=["GET"])
 def get_top_categories_with_top_products():
-    categories = query_db(
+    return jsonify(
+        category_cache.get("top_products", load_top_categories_with_top_products)
+    )
+
+
+def load_top_categories_with_top_products(category_limit=5, product_limit=5):
+    # Ranks products within each of the top categories in a single query
+    rows = query_db(
         """
-        SELECT id, category_name
-        FROM categories
-        ORDER BY popularity DESC
-        LIMIT 5
-    """
+        WITH top_categories AS (
+            SELECT id, category_name, popularity
+            FROM categories
+            ORDER BY popularity DESC
+            LIMIT ?
+        ),
+        ranked_products AS (
+            SELECT p.id, p.title, p.imgUrl, p.price, p.stars, p.category_id,
+                ROW_NUMBER() OVER (
+                    PARTITION BY p.category_id ORDER BY p.stars DESC
+                ) AS position
+            FROM products p
+            JOIN top_categories c ON p.category_id = c.id
+        )
+        SELECT c.id AS category_id, c.category_name,
+            r.id, r.title, r.imgUrl, r.price, r.stars
+        FROM top_categories c
+        LEFT JOIN ranked_products r ON r.category_id = c.id AND r.position <= ?
+        ORDER BY c.popularity DESC, c.id, r.position
+        """,
+        (category_limit, product_limit),
     )
 
-    categories_with_top_products = [
-        {
-            "id": category["id"],
-            "category_name": category["category_name"],
-            "products": [
+    categories = {}
+    for row in rows:
+        category = categories.setdefault(
+            row["category_id"],
+            {
+                "id": row["category_id"],
+                "category_name": row["category_name"],
+                "products": [],
+            },
+        )
+        if row["id"] is not None:
+            category["products"].append(
                 {
-                    "id": product["id"],
-                    "title": product["title"],
-                    "imgUrl": product["imgUrl"],
-                    "price": product["price"],
-                    "stars": product["stars"],
-
+                    "id": row["id"],
+                    "title": row["title"],
+                    "imgUrl": row["imgUrl"],
+                    "price": row["price"],
+                    "stars": row["stars"],
                 }
-                for product in query_db(
-                    "SELECT id, title, imgUrl, price, stars FROM products WHERE category_id = ? ORDER BY stars DESC LIMIT 5",
-                    (category["id"],),
-                )
-            ],
-        }
-        for category in categories
+            )
+
+    return list(categories.values())
+
+
+def get_product_cards(product_ids):
+    """Fetches the fields needed to render product cards, keeping the given order."""
+    if not product_ids:
+        return []
+    placeholders = ", ".join(["?"] * len(product_ids))
+    rows = query_db(
+        f"SELECT id, title, imgUrl, price, stars FROM products WHERE id IN ({placeholders})",
+        tuple(product_ids),
+    )
+    products = {row["id"]: dict(row) for row in rows}
+    return [products[int(product_id)] for product_id in product_ids if int(product_id) in products]
+
+
+def load_popular_products(limit=20):
+    return [
+        dict(row)
+        for row in query_db(
+            "SELECT id, title, imgUrl, price, stars FROM products ORDER BY stars DESC, reviews DESC LIMIT ?",
+            (limit,),
+        )
     ]
 
-    return jsonify(categories_with_top_products)
+
+def load_session_recommendations(session_id):
+    return get_product_cards(get_recommendations(session_id))
+
+
+# Recommendations written by the CB consumer, served from memory and refreshed from
+# Redis in the background once they are a few seconds old
+recommendation_cache = StaleWhileRevalidateCache(
+    load_session_recommendations, max_entries=10000, fresh_ttl=5, stale_ttl=300
+)
+
+
+@app.route("/api/recommendations", methods=["GET"])
+def get_session_recommendations():
+    session_id = request.args.get("session_id")
+    if not session_id:
+        return jsonify({"error": "session_id is required"}), 400
+    try:
+        limit = int(request.args.get("limit", 10))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        # A negative slice would silently drop products from the end
+        return jsonify({"error": "limit must be at least 1"}), 400
+
+    products, source = recommendation_cache.get(session_id), "personalized"
+    if not products:
+        # Unknown or brand new sessions get the most popular products instead
+        products = category_cache.get("popular_products", load_popular_products)
+        source = "popular"
+
+    return jsonify({"session_id": session_id, "source": source, "products": products[:limit]})
+
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    for state, count in get_kafka_stats().items():
+        KAFKA_PIPELINE.labels(state).set(count)
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 
 # Run the Flask app
@@ -0,0 +1,89 @@
+import random
+import sqlite3
+
+WORDS = (
+    "wireless bluetooth headphones charger cable usb fast portable speaker smart watch "
+    "phone case leather wallet running shoes men women kids kitchen knife set steel "
+    "coffee maker espresso grinder desk lamp led office chair gaming mouse keyboard "
+    "mechanical monitor stand backpack travel water bottle yoga mat cotton shirt"
+).split()
+
+SCHEMA = """
+CREATE TABLE categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    category_name TEXT NOT NULL UNIQUE,
+    slug TEXT,
+    popularity REAL DEFAULT 0
+);
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    asin TEXT UNIQUE NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    imgUrl TEXT,
+    productURL TEXT,
+    stars REAL,
+    reviews INTEGER,
+    price REAL,
+    listPrice REAL,
+    category_id INTEGER,
+    isBestSeller BOOLEAN,
+    FOREIGN KEY (category_id) REFERENCES categories(id)
+);
+CREATE TABLE cart (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT UNIQUE NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE cart_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cart_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    quantity INTEGER DEFAULT 1,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (cart_id) REFERENCES cart(id) ON DELETE CASCADE,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE CASCADE
+);
+"""
+
+
+def generate_catalog(db_path, products=5000, categories=50, seed=0):
+    """
+    Writes a synthetic catalog with the populate.py schema, deterministic for a
+    given seed so results stay comparable across commits.
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.executescript(SCHEMA)
+        conn.executemany(
+            "INSERT INTO categories (category_name, slug, popularity) VALUES (?, ?, ?)",
+            [
+                (f"Category {index}", f"category-{index}", round(rng.random() * 5, 2))
+                for index in range(1, categories + 1)
+            ],
+        )
+        conn.executemany(
+            """
+            INSERT INTO products (asin, title, description, imgUrl, productURL, stars,
+                                  reviews, price, listPrice, category_id, isBestSeller)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (
+                    f"B{index:09d}",
+                    " ".join(rng.choices(WORDS, k=6)),
+                    " ".join(rng.choices(WORDS, k=30)),
+                    f"https://example.com/{index}.jpg",
+                    f"https://example.com/dp/{index}",
+                    round(rng.uniform(1, 5), 1),
+                    rng.randint(0, 5000),
+                    round(rng.uniform(5, 500), 2),
+                    0,
+                    rng.randint(1, categories),
+                    rng.random() < 0.05,
+                )
+                for index in range(products)
+            ],
+        )
+    conn.close()
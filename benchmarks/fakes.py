@@ -0,0 +1,95 @@
+"""
+In-process stand-ins for the services the app talks to, so the benchmarks run
+without Redis, Kafka or Cassandra. install_fakes() must run before any module
+that opens a connection at import time (app, engine.redis_engine,
+utils.collections) is imported.
+"""
+
+import fakeredis
+import kafka
+import redis
+
+
+class FakeSendFuture:
+    """Completed kafka-python send future: callbacks run as soon as they are added."""
+
+    def add_callback(self, callback, *args, **kwargs):
+        callback(*args, None, **kwargs)
+        return self
+
+    def add_errback(self, errback, *args, **kwargs):
+        return self
+
+
+class FakeKafkaProducer:
+    """Serializes values like KafkaProducer, then discards them."""
+
+    def __init__(self, *args, value_serializer=None, **config):
+        self.value_serializer = value_serializer
+        self.sent = 0
+        self.sent_bytes = 0
+
+    def send(self, topic, value=None, key=None):
+        if self.value_serializer is not None:
+            value = self.value_serializer(value)
+        self.sent += 1
+        self.sent_bytes += len(value or b"")
+        return FakeSendFuture()
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class FakeMessage:
+    """The parts of a kafka-python ConsumerRecord the consumers read."""
+
+    def __init__(self, value, offset=0, partition=0):
+        self.value = value
+        self.offset = offset
+        self.partition = partition
+
+
+class FakeResponseFuture:
+    """Completed ResponseFuture with an empty result, enough for ResultSet."""
+
+    has_more_pages = False
+    _col_names = None
+    _col_types = None
+    _continuous_paging_session = None
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), **kwargs):
+        callback([], *callback_args)
+
+    def clear_callbacks(self):
+        pass
+
+
+class FakeCassandraSession:
+    """Acknowledges every statement immediately, for cassandra.concurrent helpers."""
+
+    def __init__(self):
+        self.executed = 0
+
+    def execute_async(self, statement, parameters=None, *args, **kwargs):
+        self.executed += 1
+        return FakeResponseFuture()
+
+
+_server = None
+
+
+def install_fakes():
+    """Routes redis.Redis and kafka.KafkaProducer to the in-process fakes."""
+    global _server
+    if _server is not None:
+        return
+    _server = fakeredis.FakeServer()
+
+    def fake_redis(*args, decode_responses=False, **kwargs):
+        return fakeredis.FakeRedis(server=_server, decode_responses=decode_responses)
+
+    redis.Redis = fake_redis
+    kafka.KafkaProducer = FakeKafkaProducer
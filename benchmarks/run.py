@@ -0,0 +1,423 @@
+# benchmarks/run.py
+"""
+Times the hot paths against a generated catalog and the fakes in benchmarks.fakes.
+Correctness is covered by the pytest suite in tests/, which shares those fakes.
+This runner only measures, so it stays a standalone script rather than a
+pytest-benchmark plugin: it writes one results file per commit to
+benchmarks/results and --compare diffs two of them without running the tests.
+"""
+
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from benchmarks.catalog import generate_catalog  # noqa: E402
+from benchmarks.fakes import FakeCassandraSession, FakeMessage, install_fakes  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# (group, name, factory). A factory receives the Context and returns the callable
+# to time, so per benchmark setup stays out of the measurement.
+BENCHMARKS = []
+
+
+def benchmark(group):
+    def register(factory):
+        BENCHMARKS.append((group, factory.__name__, factory))
+        return factory
+
+    return register
+
+
+class Context:
+    """Modules and fixtures shared by the benchmarks, imported once the fakes are in place."""
+
+    def __init__(self):
+        import app
+        import kafka_cb_process_events
+        import kafka_consumer
+        from engine import redis_engine
+        from engine.cb_engine import RecommendationEngine
+        from utils import events
+
+        self.app = app
+        self.client = app.app.test_client()
+        self.redis_engine = redis_engine
+        self.events = events
+        self.kafka_cb_process_events = kafka_cb_process_events
+        self.kafka_consumer = kafka_consumer
+        self.engine = RecommendationEngine(checkpoint_interval=0)
+        rows = app.query_db("SELECT id, category_id FROM products ORDER BY id")
+        self.products = [(row["id"], row["category_id"]) for row in rows]
+        self._clock = itertools.count()
+        self._start = datetime(2024, 1, 1)
+
+    def next_timestamp(self):
+        """Strictly increasing timestamps, so Redis dedup never drops benchmark events."""
+        return self.events.format_timestamp(
+            self._start + timedelta(microseconds=next(self._clock))
+        )
+
+    def make_event(self, session_id, index=0, event_type="view_product"):
+        product_id, category_id = self.products[index % len(self.products)]
+        return {
+            "session_id": session_id,
+            "event_type": event_type,
+            "product_id": product_id,
+            "category_id": category_id,
+            "timestamp": self.next_timestamp(),
+            "additional_context": {"device_type": "mobile"},
+        }
+
+
+# Flask endpoints
+@benchmark("api")
+def products_page(ctx):
+    url = "/api/products?skip=100&limit=20"
+    ids = [product["id"] for product in ctx.client.get(url).json["products"]]
+    assert ids == [product_id for product_id, _ in ctx.products[100:120]], "Not the sixth page"
+    return lambda: ctx.client.get(url)
+
+
+@benchmark("api")
+def products_cursor_page(ctx):
+    first = ctx.client.get("/api/products?cursor=&limit=20&sortBy=price").json
+    url = f"/api/products?cursor={first['next_cursor']}&limit=20&sortBy=price"
+    products = first["products"] + ctx.client.get(url).json["products"]
+    keys = [(product["price"], product["id"]) for product in products]
+    assert len(keys) == 40 and keys == sorted(keys), "Pages not in price order"
+    return lambda: ctx.client.get(url)
+
+
+@benchmark("api")
+def products_search(ctx):
+    return lambda: ctx.client.get("/api/products/search?q=wireless head&limit=20")
+
+
+@benchmark("api")
+def categories(ctx):
+    return lambda: ctx.client.get("/api/categories")
+
+
+@benchmark("api")
+def top_products(ctx):
+    return lambda: ctx.client.get("/api/categories/top_products")
+
+
+@benchmark("api")
+def track_event(ctx):
+    event = ctx.make_event("api-session")
+    del event["timestamp"]
+    return lambda: ctx.client.post("/api/track", json=event)
+
+
+@benchmark("api")
+def track_batch_100(ctx):
+    events = [ctx.make_event("api-session", index) for index in range(100)]
+    return lambda: ctx.client.post("/api/track/batch", json=events)
+
+
+@benchmark("api")
+def recommendations(ctx):
+    ctx.redis_engine.cache_recommendations(
+        "api-session", [product_id for product_id, _ in ctx.products[:10]]
+    )
+    return lambda: ctx.client.get("/api/recommendations?session_id=api-session")
+
+
+@benchmark("api")
+def user_profile(ctx):
+    scores = {product_id: 1.0 / (index + 1) for index, (product_id, _) in enumerate(ctx.products[:50])}
+    ctx.redis_engine.cache_user_profile("api-session", scores)
+    return lambda: ctx.client.get("/api/user_profile?session_id=api-session&limit=10")
+
+
+# Recommendation engine
+@benchmark("engine")
+def process_event_batch_10(ctx):
+    events = [ctx.make_event("engine-session", index) for index in range(10)]
+    return lambda: ctx.engine.process_event_batch(events)
+
+
+@benchmark("engine")
+def score_window_100x50(ctx):
+    # Scoring alone, for windows and candidate lists larger than the defaults
+    from engine.batch_scorer import score_window, top_k
+
+    rng = random.Random(0)
+    product_ids = [product_id for product_id, _ in ctx.products]
+    action_lists = [rng.sample(product_ids, 50) for _ in range(100)]
+    pmfs = [[1 / 50] * 50 for _ in action_lists]
+    rewards = [0.1] * len(action_lists)
+    profile_data = {str(product_id): 0.5 for product_id in product_ids[:200]}
+
+    def run():
+        actions, scores = score_window(action_lists, pmfs, rewards, 0.9, profile_data)
+        return actions[top_k(scores, 10)]
+
+    return run
+
+
+@benchmark("engine")
+def process_session_event(ctx):
+    # Each call slides the window by one event, the consumer's steady state
+    window = [ctx.make_event("engine-session", index) for index in range(10)]
+    counter = itertools.count(10)
+
+    def run():
+        window.insert(0, ctx.make_event("engine-session", next(counter)))
+        del window[10:]
+        ctx.engine.process_session_event("engine-session", window)
+
+    return run
+
+
+@benchmark("engine")
+def process_feedback(ctx):
+    event = ctx.make_event("engine-session")
+    event["feedback"] = "positive"
+    # Feedback is only learned from sessions with a profile
+    profile_data = {str(product_id): 0.5 for product_id, _ in ctx.products[:20]}
+    return lambda: ctx.engine.process_feedback(event, profile_data)
+
+
+# Redis helpers
+@benchmark("redis")
+def record_interactions_batch_100(ctx):
+    sessions = [f"redis-session-{index}" for index in range(20)]
+
+    def run():
+        events = [
+            ctx.events.as_event(ctx.make_event(sessions[index % 20], index)) for index in range(100)
+        ]
+        ctx.redis_engine.record_interactions_batch(
+            [(event.session_id, event, True) for event in events]
+        )
+
+    return run
+
+
+@benchmark("redis")
+def cache_user_profiles_100(ctx):
+    profiles = {
+        f"redis-session-{index}": {
+            product_id: 0.5 for product_id, _ in ctx.products[index : index + 20]
+        }
+        for index in range(100)
+    }
+    recommendations = {session_id: list(scores)[:10] for session_id, scores in profiles.items()}
+    return lambda: ctx.redis_engine.cache_user_profiles(profiles, recommendations)
+
+
+@benchmark("redis")
+def get_user_profile_scores_top10(ctx):
+    ctx.redis_engine.cache_user_profile(
+        "redis-profile", {product_id: float(product_id) for product_id, _ in ctx.products[:100]}
+    )
+    return lambda: ctx.redis_engine.get_user_profile_scores("redis-profile", top_k=10)
+
+
+# Consumer loops
+@benchmark("consumers")
+def cb_process_events_100(ctx):
+    sessions = [f"consumer-session-{index}" for index in range(20)]
+
+    def run():
+        raw = [
+            json.dumps(ctx.make_event(sessions[index % 20], index)).encode("utf-8")
+            for index in range(100)
+        ]
+        ctx.kafka_cb_process_events.process_events(
+            ctx.engine, [ctx.events.decode_event(value) for value in raw]
+        )
+
+    return run
+
+
+@benchmark("consumers")
+def archive_write_rows_500(ctx):
+    from cassandra.query import SimpleStatement
+
+    insert_query = SimpleStatement(
+        """
+        INSERT INTO user_events (session_id, event_type, product_id, category_id, search_query, timestamp, additional_context, feedback)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        """
+    )
+    session = FakeCassandraSession()
+    # 50 sessions, so rows are grouped into multi-row batches like in production
+    session_ids = [f"00000000-0000-0000-0000-{index:012d}" for index in range(50)]
+    messages = [
+        FakeMessage(
+            json.dumps(ctx.make_event(session_ids[index % 50], index)).encode("utf-8"),
+            offset=index,
+        )
+        for index in range(500)
+    ]
+
+    def run():
+        rows = [
+            ctx.kafka_consumer.build_event_row(ctx.events.decode_event(message.value))
+            for message in messages
+        ]
+        ctx.kafka_consumer.write_rows(session, insert_query, rows)
+
+    return run
+
+
+def measure(fn, min_time=0.5, rounds=5):
+    """
+    Times fn in rounds of a calibrated number of calls and returns seconds per
+    call statistics over the rounds.
+    """
+    fn()  # Warm up caches and lazy initialization
+    iterations = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time / rounds or iterations >= 1 << 20:
+            break
+        iterations *= 2
+
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - started) / iterations)
+
+    median = statistics.median(timings)
+    return {
+        "rounds": rounds,
+        "iterations": iterations,
+        "min": min(timings),
+        "median": median,
+        "mean": statistics.fmean(timings),
+        "stdev": statistics.stdev(timings) if rounds > 1 else 0.0,
+        "ops_per_sec": 1 / median if median else None,
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare_results(results, baseline_path, threshold):
+    """Prints median changes against a baseline file, returning the regressed benchmarks."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    print(f"\nCompared with {baseline['commit']} ({baseline_path}):")
+    regressions = []
+    for name, stats in results.items():
+        previous = baseline["results"].get(name)
+        if previous is None:
+            continue
+        ratio = stats["median"] / previous["median"]
+        flag = ""
+        if ratio > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:<45} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def run_benchmarks(selected=None, products=5000, categories=50, min_time=0.5, rounds=5):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmarks-") as workdir:
+        # The app and engine use paths relative to the working directory
+        os.makedirs(os.path.join(workdir, "db"))
+        generate_catalog(os.path.join(workdir, "db", "ecommerce.db"), products, categories)
+        install_fakes()
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                ctx = Context()
+            for group, name, factory in BENCHMARKS:
+                full_name = f"{group}.{name}"
+                if selected and not any(pattern in full_name for pattern in selected):
+                    continue
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    stats = measure(factory(ctx), min_time, rounds)
+                results[full_name] = stats
+                print(
+                    f"{full_name:<45} {stats['median'] * 1e6:12.1f} us/op "
+                    f"{stats['ops_per_sec']:12.1f} ops/s"
+                )
+        finally:
+            os.chdir(previous_cwd)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the offline benchmarks against a generated catalog and in-process fakes."
+    )
+    parser.add_argument(
+        "-k", dest="selected", action="append", help="Only run benchmarks whose name contains this"
+    )
+    parser.add_argument("--products", type=int, default=5000, help="Products in the generated catalog")
+    parser.add_argument("--categories", type=int, default=50, help="Categories in the generated catalog")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Seconds spent timing each benchmark")
+    parser.add_argument("--rounds", type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument("--output", help="Results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="Results file to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Median slowdown ratio reported as a regression",
+    )
+    args = parser.parse_args()
+
+    commit = get_commit()
+    results = run_benchmarks(args.selected, args.products, args.categories, args.min_time, args.rounds)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as output_file:
+        json.dump(
+            {
+                "commit": commit,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": {
+                    "products": args.products,
+                    "categories": args.categories,
+                    "min_time": args.min_time,
+                    "rounds": args.rounds,
+                },
+                "results": results,
+            },
+            output_file,
+            indent=2,
+        )
+    print(f"Results written to {output}")
+
+    if args.compare and compare_results(results, args.compare, args.threshold):
+        sys.exit(1)
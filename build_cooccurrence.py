@@ -0,0 +1,119 @@
+# build_cooccurrence.py
+import argparse
+import time
+
+from engine import snapshots
+from engine.cooccurrence import (
+    COOCCURRENCE_DIR,
+    MAX_SESSION_ITEMS,
+    SNAPSHOT_PREFIX,
+    TOP_K,
+    CooccurrenceBuilder,
+)
+from utils.event_sources import add_source_arguments, decode, open_source
+from utils.events import EventValidationError
+
+PROGRESS_INTERVAL = 5
+
+
+def build_cooccurrence(
+    source,
+    directory=COOCCURRENCE_DIR,
+    incremental=False,
+    decay=1.0,
+    grouped=False,
+    top_k=TOP_K,
+    min_weight=1.0,
+    max_session_items=MAX_SESSION_ITEMS,
+):
+    """
+    Counts product co-occurrences per session over the source's events and writes
+    a new neighbour index snapshot. Incremental builds start from the counts of the
+    latest snapshot, so only new events have to be read. A session split across
+    two builds is counted as two sessions.
+    """
+    previous = snapshots.list_snapshots(directory, SNAPSHOT_PREFIX)
+    if incremental and previous:
+        builder = CooccurrenceBuilder.from_snapshot(
+            previous[-1], decay, max_session_items=max_session_items
+        )
+        print(f"Continuing from {previous[-1]} ({builder.sessions} sessions)")
+    else:
+        builder = CooccurrenceBuilder(max_session_items=max_session_items)
+
+    started = last_report = time.monotonic()
+    read = invalid = 0
+    current_session = None
+    for item in source:
+        read += 1
+        try:
+            event = decode(item)
+        except EventValidationError:
+            invalid += 1
+            continue
+        # Grouped input finishes a session as soon as the next one starts
+        if grouped and event.session_id != current_session:
+            if current_session is not None:
+                builder.finish_session(current_session)
+            current_session = event.session_id
+        builder.add_event(event.session_id, event.get("event_type"), event.get("product_id"))
+
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            print(f"Read {read} events, {read / (last_report - started):.0f} events/s")
+
+    path = builder.save(directory, top_k, min_weight)
+    print(
+        f"Built co-occurrences of {builder.sessions} sessions ({len(builder.pair_keys)} pairs) "
+        f"from {read} events, {invalid} invalid, in {time.monotonic() - started:.1f}s: {path}"
+    )
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the item-item co-occurrence index used for candidate retrieval."
+    )
+    add_source_arguments(parser)
+    parser.add_argument("--output", default=COOCCURRENCE_DIR, help="Snapshot directory")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Add the events to the counts of the latest snapshot instead of starting over",
+    )
+    parser.add_argument(
+        "--decay",
+        type=float,
+        default=1.0,
+        help="Factor applied to the previous counts of an incremental build",
+    )
+    parser.add_argument(
+        "--grouped",
+        action="store_true",
+        help="Events of a session are contiguous, keeps memory bounded "
+        "(implied for Cassandra)",
+    )
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Neighbours kept per product")
+    parser.add_argument(
+        "--min-weight", type=float, default=1.0, help="Minimum co-occurrence weight of a pair"
+    )
+    parser.add_argument(
+        "--max-session-items",
+        type=int,
+        default=MAX_SESSION_ITEMS,
+        help="Most recent distinct products paired per session",
+    )
+    args = parser.parse_args()
+
+    events = open_source(parser, args)
+
+    build_cooccurrence(
+        events,
+        directory=args.output,
+        incremental=args.incremental,
+        decay=args.decay,
+        grouped=args.grouped or args.source == "cassandra",
+        top_k=args.top_k,
+        min_weight=args.min_weight,
+        max_session_items=args.max_session_items,
+    )
@@ -0,0 +1,55 @@
+# build_similar_products.py
+import argparse
+
+import numpy as np
+
+from engine import snapshots
+from engine.cooccurrence import COOCCURRENCE_DIR, SNAPSHOT_PREFIX as COOCCURRENCE_PREFIX
+from engine.similar_products import SIMILAR_PRODUCTS_DIR, TOP_K, build_similar_products
+from utils.db_client import DB_PATH, get_db_connection
+
+
+def get_most_viewed_products(conn, limit, cooccurrence_dir=COOCCURRENCE_DIR):
+    """
+    Product ids with the most interactions according to the latest co-occurrence
+    snapshot, or with the most reviews when none has been built yet.
+    """
+    paths = snapshots.list_snapshots(cooccurrence_dir, COOCCURRENCE_PREFIX)
+    if paths:
+        arrays, _ = snapshots.load_snapshot(paths[-1], ("item_weights",))
+        item_weights = arrays["item_weights"]
+        most_viewed = np.argsort(-item_weights, kind="stable")[:limit]
+        return most_viewed[item_weights[most_viewed] > 0].tolist()
+    return [
+        row["id"]
+        for row in conn.execute("SELECT id FROM products ORDER BY reviews DESC, id LIMIT ?", (limit,))
+    ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the content similarity index behind /api/products/<id>/similar."
+    )
+    parser.add_argument("--db", default=DB_PATH, help="Catalog database")
+    parser.add_argument("--output", default=SIMILAR_PRODUCTS_DIR, help="Snapshot directory")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="Neighbours precomputed per product")
+    parser.add_argument(
+        "--precompute",
+        type=int,
+        default=10000,
+        help="Most viewed products whose neighbours are precomputed",
+    )
+    parser.add_argument(
+        "--cooccurrence-dir",
+        default=COOCCURRENCE_DIR,
+        help="Co-occurrence snapshots used to find the most viewed products",
+    )
+    args = parser.parse_args()
+
+    with get_db_connection(args.db) as conn:
+        products = [
+            (row["id"], row["title"], row["category_id"])
+            for row in conn.execute("SELECT id, title, category_id FROM products")
+        ]
+        popular_ids = get_most_viewed_products(conn, args.precompute, args.cooccurrence_dir)
+    build_similar_products(products, popular_ids, args.output, args.top_k)
@@ -0,0 +1,179 @@
+import csv
+import time
+from itertools import islice
+
+from db.catalog import CATALOG_INDEXES, VERSIONED_TABLES, ensure_catalog_schema
+from db.search_index import create_search_index, search_index_exists
+
+# Rows per executemany call and transaction
+CHUNK_SIZE = 10000
+PROGRESS_INTERVAL = 5
+
+PRODUCT_COLUMNS = (
+    "asin",
+    "title",
+    "imgUrl",
+    "productURL",
+    "stars",
+    "reviews",
+    "price",
+    "listPrice",
+    "category_id",
+    "isBestSeller",
+)
+
+# Rows are matched by asin, and unchanged rows are left alone so incremental loads
+# don't rewrite (and re-index) the whole catalog
+UPSERT_PRODUCT = f"""
+    INSERT INTO products ({", ".join(PRODUCT_COLUMNS)})
+    VALUES ({", ".join(["?"] * len(PRODUCT_COLUMNS))})
+    ON CONFLICT(asin) DO UPDATE SET
+        {", ".join(f"{column} = excluded.{column}" for column in PRODUCT_COLUMNS[1:])}
+    WHERE {" OR ".join(f"{column} IS NOT excluded.{column}" for column in PRODUCT_COLUMNS[1:])}
+"""
+
+UPSERT_CATEGORY = """
+    INSERT INTO categories (id, category_name) VALUES (?, ?)
+    ON CONFLICT(id) DO UPDATE SET category_name = excluded.category_name
+    WHERE category_name IS NOT excluded.category_name
+"""
+
+
+def parse_product_row(row):
+    """Converts a row of amazon_products.csv to the values of UPSERT_PRODUCT."""
+    return (
+        row["asin"],
+        row["title"],
+        row["imgUrl"],
+        row["productURL"],
+        float(row["stars"]) if row["stars"] else 0,
+        int(row["reviews"]) if row["reviews"] else 0,
+        float(row["price"]) if row["price"] else 0,
+        float(row["listPrice"]) if row["listPrice"] else 0,
+        row["category_id"],
+        row["isBestSeller"].lower() == "true",
+    )
+
+
+def apply_load_pragmas(conn, fresh):
+    """
+    Trades durability for speed while loading. A fresh catalog can simply be
+    reloaded after a crash, so it runs without a rollback journal at all.
+    """
+    conn.execute(f"PRAGMA journal_mode={'OFF' if fresh else 'WAL'}")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA cache_size=-262144")  # 256MB page cache
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def restore_pragmas(conn):
+    # Same settings the application's connection pool uses
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+
+
+def drop_load_time_objects(conn, defer_indexes):
+    """
+    Drops the per-row catalog version triggers and, when deferring index builds,
+    the secondary indexes and full-text search triggers. finish_load recreates them.
+    """
+    placeholders = ", ".join(["?"] * len(VERSIONED_TABLES))
+    triggers = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name IN ({placeholders})",
+            VERSIONED_TABLES,
+        )
+    ]
+    for trigger in triggers:
+        if trigger.startswith("catalog_version_") or (
+            defer_indexes and trigger.startswith("products_fts_")
+        ):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    if defer_indexes:
+        for name in CATALOG_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+    conn.commit()
+
+
+def finish_load(conn, defer_indexes):
+    """Rebuilds what drop_load_time_objects removed and bumps the catalog version once."""
+    started = time.monotonic()
+    ensure_catalog_schema(conn)
+    if defer_indexes or not search_index_exists(conn):
+        create_search_index(conn)
+    conn.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+    conn.execute("ANALYZE")
+    conn.commit()
+    print(f"Rebuilt indexes in {time.monotonic() - started:.1f}s")
+
+
+def load_categories(conn, path):
+    with open(path, newline="") as csvfile:
+        rows = [(row["id"], row["category_name"]) for row in csv.DictReader(csvfile)]
+    with conn:
+        conn.executemany(UPSERT_CATEGORY, rows)
+    return len(rows)
+
+
+def load_products(conn, path, chunk_size=CHUNK_SIZE):
+    """Streams the products CSV into the catalog chunk by chunk, reporting throughput."""
+    started = last_report = time.monotonic()
+    loaded = 0
+    with open(path, newline="") as csvfile:
+        rows = map(parse_product_row, csv.DictReader(csvfile))
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            with conn:
+                conn.executemany(UPSERT_PRODUCT, chunk)
+            loaded += len(chunk)
+
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                print(f"Loaded {loaded} products, {loaded / (last_report - started):.0f} rows/s")
+
+    elapsed = time.monotonic() - started
+    print(
+        f"Loaded {loaded} products in {elapsed:.1f}s "
+        f"({loaded / elapsed if elapsed else 0:.0f} rows/s)"
+    )
+    return loaded
+
+
+def update_category_popularity(conn):
+    """Sets every category's popularity to the average rating of its rated products."""
+    with conn:
+        conn.execute("UPDATE categories SET popularity = 0")
+        conn.execute(
+            """
+            UPDATE categories SET popularity = ratings.popularity
+            FROM (
+                SELECT category_id, AVG(stars) AS popularity
+                FROM products
+                WHERE stars > 0
+                GROUP BY category_id
+            ) AS ratings
+            WHERE categories.id = ratings.category_id
+            """
+        )
+
+
+def load_catalog(conn, categories_path, products_path, chunk_size=CHUNK_SIZE):
+    """
+    Loads or refreshes the catalog from the category and product CSV exports.
+    Into an empty catalog, indexes and search triggers are built once at the end
+    instead of being maintained row by row; refreshes upsert by asin and keep them.
+    """
+    fresh = conn.execute("SELECT NOT EXISTS (SELECT 1 FROM products)").fetchone()[0]
+    apply_load_pragmas(conn, fresh)
+    drop_load_time_objects(conn, defer_indexes=fresh)
+    try:
+        categories = load_categories(conn, categories_path)
+        products = load_products(conn, products_path, chunk_size)
+        update_category_popularity(conn)
+    finally:
+        finish_load(conn, defer_indexes=fresh)
+        restore_pragmas(conn)
+    return {"categories": categories, "products": products}
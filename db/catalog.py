@@ -0,0 +1,68 @@
+import sqlite3
+
+# Indexes backing the sort orders and filters used by the product listing endpoints.
+# Each one ends with id so keyset pagination can seek straight to the next page. id
+# is the rowid, which SQLite appends to every index anyway, so catalogs indexed
+# before it was spelled out use the same key order.
+CATALOG_INDEXES = {
+    "idx_products_category_id": "products(category_id, id)",
+    "idx_products_category_stars": "products(category_id, stars, id)",
+    "idx_products_stars": "products(stars, id)",
+    "idx_products_price": "products(price, id)",
+}
+
+# Tables whose writes count as a catalog change
+VERSIONED_TABLES = ("products", "categories")
+
+
+def create_catalog_indexes(conn):
+    for name, definition in CATALOG_INDEXES.items():
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {definition}")
+    conn.commit()
+
+
+def create_catalog_version(conn):
+    """
+    Creates a single-row version counter bumped by triggers on every catalog write,
+    so in-process caches can tell whether their entries are still valid.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+        """
+    )
+    conn.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    for table in VERSIONED_TABLES:
+        for operation in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(
+                f"""
+                CREATE TRIGGER IF NOT EXISTS catalog_version_{table}_{operation.lower()}
+                AFTER {operation} ON {table} BEGIN
+                    UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                END
+                """
+            )
+    conn.commit()
+
+
+def ensure_catalog_schema(conn):
+    """Adds the catalog indexes and version tracking to an existing catalog."""
+    tables = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    }
+    if not set(VERSIONED_TABLES) <= tables:
+        return False
+    create_catalog_indexes(conn)
+    create_catalog_version(conn)
+    return True
+
+
+def get_catalog_version(conn):
+    try:
+        row = conn.execute("SELECT version FROM catalog_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return 0  # Catalog predates version tracking
+    return row[0] if row else 0
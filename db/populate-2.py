@@ -1,8 +1,14 @@
+import os
 import re
 import sqlite3
 import json
+import sys
 from datetime import datetime
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.search_index import ensure_search_index  # noqa: E402
+
 # Connect to SQLite database
 conn = sqlite3.connect("ecommerce.db")
 cursor = conn.cursor()
@@ -91,8 +97,11 @@ for product in new_products:
         (title, description, category_id, price, created_at, updated_at, thumbnail),
     )
 
-# Commit all changes and close the connection
+# Commit all changes, new products are indexed by the search triggers
 conn.commit()
+
+# Index the catalog if it was loaded before the search index existed
+ensure_search_index(conn)
 conn.close()
 
 print("Data imported successfully into the existing tables.")
@@ -0,0 +1,88 @@
+import re
+
+# Column weights used for BM25 ranking, title matches count more than description ones
+COLUMN_WEIGHTS = {"title": 10.0, "description": 1.0}
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def get_indexed_columns(conn):
+    """Returns the searchable product columns present in this database."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(products)")}
+    return [column for column in COLUMN_WEIGHTS if column in columns]
+
+
+def search_index_exists(conn):
+    return (
+        conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'"
+        ).fetchone()
+        is not None
+    )
+
+
+def create_search_index(conn, rebuild=True):
+    """
+    Creates the FTS5 index over products and the triggers that keep it in sync
+    with every insert, update and delete on the products table.
+    """
+    columns = get_indexed_columns(conn)
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+
+    conn.executescript(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            {column_list},
+            content='products',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        );
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, {column_list})
+            VALUES ('delete', old.id, {old_values});
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF {column_list} ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, {column_list})
+            VALUES ('delete', old.id, {old_values});
+            INSERT INTO products_fts(rowid, {column_list}) VALUES (new.id, {new_values});
+        END;
+        """
+    )
+    # Persist the column weights so queries can simply ORDER BY rank
+    weights = ", ".join(str(COLUMN_WEIGHTS[column]) for column in columns)
+    conn.execute(
+        "INSERT INTO products_fts(products_fts, rank) VALUES ('rank', ?)",
+        (f"bm25({weights})",),
+    )
+    if rebuild:
+        conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def ensure_search_index(conn):
+    """Builds the search index if the catalog exists but has not been indexed yet."""
+    if not get_indexed_columns(conn):
+        return False
+    if not search_index_exists(conn):
+        create_search_index(conn)
+    return True
+
+
+def build_match_query(search_query):
+    """
+    Turns free text into an FTS5 MATCH expression. Every word is quoted so user
+    input can't inject FTS syntax, and every word is matched as a prefix so
+    results show up while the user is still typing.
+    """
+    tokens = TOKEN_PATTERN.findall(search_query or "")
+    return " ".join(f'"{token}"*' for token in tokens)
+
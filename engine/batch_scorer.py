@@ -0,0 +1,71 @@
+from itertools import chain
+
+import numpy as np
+
+
+def build_probability_matrix(action_lists, pmfs):
+    """
+    Lays out the pmfs of a window as a sparse events x actions matrix. Returns
+    (actions, rows, columns, probs): one (row, column, prob) entry per candidate,
+    with columns numbered in the order actions first appear so ties rank like
+    the insertion ordered dict process_event_batch used to build.
+    """
+    lengths = list(map(len, action_lists))
+    pairs = sum(lengths)
+    flat_actions = np.fromiter(chain.from_iterable(action_lists), dtype=np.int64, count=pairs)
+    probs = np.fromiter(chain.from_iterable(pmfs), dtype=np.float64, count=pairs)
+    rows = np.repeat(np.arange(len(action_lists)), np.asarray(lengths, dtype=np.int64))
+
+    unique, first_index, inverse = np.unique(flat_actions, return_index=True, return_inverse=True)
+    order = np.argsort(first_index)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], rows, rank[inverse.ravel()], probs
+
+
+def get_profile_scores(profile_data, actions):
+    """Looks up the profile score of each action, 0 for actions without one."""
+    # Once per distinct action, where the dict loop did it once per candidate
+    return np.fromiter(
+        (profile_data.get(str(action), 0) for action in actions.tolist()),
+        dtype=np.float64,
+        count=len(actions),
+    )
+
+
+def score_window(action_lists, pmfs, rewards, weight_decay, profile_data=None):
+    """
+    Vectorized scores of a window of events, oldest first: each event's pmf scaled
+    by its reward and a decay weight (1 for the oldest event), plus the profile
+    score of an action once per time it was a candidate, normalized by the total
+    weight. Returns (actions, scores) arrays.
+    """
+    actions, rows, columns, probs = build_probability_matrix(action_lists, pmfs)
+    if not len(actions):
+        return actions, np.zeros(0)
+    weights = weight_decay ** np.arange(len(action_lists), dtype=np.float64)
+    event_weights = np.asarray(rewards, dtype=np.float64) * weights
+    scores = np.bincount(columns, weights=event_weights[rows] * probs, minlength=len(actions))
+    if profile_data and len(actions):
+        counts = np.bincount(columns, minlength=len(actions))
+        scores += get_profile_scores(profile_data, actions) * counts
+    if len(weights):
+        scores /= weights.sum()
+    return actions, scores
+
+
+def top_k(scores, k):
+    """
+    Indices of the k highest scores, best first. Ties keep index order, matching a
+    stable sort of the whole array, but only the candidates found by argpartition
+    are sorted.
+    """
+    if k <= 0 or not len(scores):
+        return np.zeros(0, dtype=np.int64)
+    if len(scores) > k:
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        # Everything tied with the k-th score competes for the last places by index
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.lexsort((candidates, -scores[candidates]))][:k]
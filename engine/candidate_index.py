@@ -0,0 +1,175 @@
+import signal
+import time
+from array import array
+
+import numpy as np
+
+from db.catalog import get_catalog_version
+from utils.db_client import DB_PATH, get_db_connection
+
+MISSING_CATEGORY = -1
+
+
+class CandidateSnapshot:
+    """
+    Immutable view of the catalog used for candidate generation. features_path is
+    the feature snapshot it was built from, None when it was read from SQLite.
+    """
+
+    def __init__(
+        self, product_categories, category_products, popular_products, version, features_path=None
+    ):
+        self.product_categories = product_categories
+        self.category_products = category_products
+        self.popular_products = popular_products
+        self.version = version
+        self.features_path = features_path
+
+
+class CandidateIndex:
+    """
+    In-memory candidate lists loaded from the catalog in one pass:
+    product id -> category id (array indexed by id), the best rated products of
+    each category and the globally best rated products. Lookups never touch SQLite.
+    Reloads swap in a whole new snapshot so readers always see a consistent one.
+
+    When a ProductFeatures snapshot of the current catalog version is available the
+    index is built from it instead, and id -> category lookups read its memory
+    mapped column, shared by every process, rather than a per-process array.
+    """
+
+    def __init__(
+        self, db_path=DB_PATH, per_category=50, popular=100, refresh_interval=300, features=None
+    ):
+        self.db_path = db_path
+        self.per_category = per_category
+        self.popular = popular
+        self.refresh_interval = refresh_interval
+        self.features = features
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._refresh_requested = False
+
+    def load(self):
+        """(Re)builds the index from the catalog."""
+        with get_db_connection(self.db_path) as conn:
+            version = get_catalog_version(conn)
+            features = self._get_feature_snapshot(version)
+            if features is not None:
+                self._snapshot = self._build_from_features(features, version)
+                self._checked_at = time.monotonic()
+                self._refresh_requested = False
+                return self
+            rows = conn.execute(
+                "SELECT id, category_id FROM products ORDER BY stars DESC, id"
+            ).fetchall()
+
+        max_id = max((row["id"] for row in rows), default=0)
+        product_categories = array("l", [MISSING_CATEGORY]) * (max_id + 1)
+        category_products = {}
+        popular_products = []
+
+        # Rows arrive best rated first, so every list below is already ranked
+        for row in rows:
+            product_id, category_id = row["id"], row["category_id"]
+            if len(popular_products) < self.popular:
+                popular_products.append(product_id)
+            if category_id is None:
+                continue
+            product_categories[product_id] = category_id
+            products = category_products.setdefault(category_id, [])
+            if len(products) < self.per_category:
+                products.append(product_id)
+
+        self._snapshot = CandidateSnapshot(
+            product_categories,
+            {category_id: tuple(products) for category_id, products in category_products.items()},
+            tuple(popular_products),
+            version,
+        )
+        self._checked_at = time.monotonic()
+        self._refresh_requested = False
+        return self
+
+    def _get_feature_snapshot(self, version):
+        if self.features is None:
+            return None
+        snapshot = self.features.load().snapshot
+        return snapshot if snapshot is not None and snapshot.version == version else None
+
+    def _has_new_features(self, version):
+        features = self._get_feature_snapshot(version)
+        return features is not None and features.path != self._snapshot.features_path
+
+    def _build_from_features(self, features, version):
+        ids = np.flatnonzero(features.present)
+        stars = features.column("stars")[ids]
+        # Best rated first, ties by id, like the ORDER BY of the SQLite path
+        ranked = ids[np.lexsort((ids, -stars))]
+        popular_products = tuple(ranked[: self.popular].tolist())
+
+        categories = features.column("category_id")[ranked]
+        known = categories != MISSING_CATEGORY
+        ranked, categories = ranked[known], categories[known]
+        # A stable sort by category keeps each category's products in rating order
+        order = np.argsort(categories, kind="stable")
+        ranked, categories = ranked[order], categories[order]
+        category_ids, starts, counts = np.unique(
+            categories, return_index=True, return_counts=True
+        )
+        category_products = {
+            int(category_id): tuple(ranked[start : start + min(count, self.per_category)].tolist())
+            for category_id, start, count in zip(category_ids, starts, counts)
+        }
+        return CandidateSnapshot(
+            features.column("category_id"),
+            category_products,
+            popular_products,
+            version,
+            features.path,
+        )
+
+    def maybe_refresh(self):
+        """
+        Reloads if a refresh was signalled, the catalog changed since the last check,
+        or a feature snapshot of the current catalog version appeared, e.g. exported
+        after load() fell back to SQLite.
+        """
+        if self._refresh_requested or self._snapshot is None:
+            return self.load()
+        if time.monotonic() - self._checked_at < self.refresh_interval:
+            return self
+        with get_db_connection(self.db_path) as conn:
+            version = get_catalog_version(conn)
+        if version != self._snapshot.version or self._has_new_features(version):
+            return self.load()
+        self._checked_at = time.monotonic()
+        return self
+
+    def request_refresh(self, *args):
+        """Marks the index for reload on next use, safe to call from a signal handler."""
+        self._refresh_requested = True
+
+    def install_refresh_signal(self, signum=signal.SIGHUP):
+        signal.signal(signum, self.request_refresh)
+
+    def get_category_id(self, product_id):
+        product_categories = self._snapshot.product_categories
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None
+        if not 0 <= product_id < len(product_categories):
+            return None
+        category_id = int(product_categories[product_id])
+        return None if category_id == MISSING_CATEGORY else category_id
+
+    def get_category_products(self, category_id, limit):
+        try:
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            return []
+        return list(self._snapshot.category_products.get(category_id, ())[:limit])
+
+    def get_popular_products(self, limit):
+        return list(self._snapshot.popular_products[:limit])
@@ -1,37 +1,138 @@
 import random
-import sqlite3
-from datetime import datetime
+import time
+from collections import OrderedDict
 
 from vowpalwabbit import pyvw
 
+from engine.batch_scorer import score_window, top_k
+from engine.candidate_index import CandidateIndex
+from engine.cooccurrence import CooccurrenceIndex
+from engine.feature_store import ProductFeatures
+from engine.model_store import ModelStore, ModelWatcher
+from engine.session_scorer import DecayedSessionScorer
+from utils.db_client import DB_PATH, get_db_connection, query_db
+from utils.events import as_event
+from utils.metrics import CANDIDATE_LATENCY, PREDICT_LATENCY
+
+
+VW_ARGS = "--cb_explore_adf --epsilon 0.2 -q UA --quiet"
+
+# Number of recent events scored per session, and the weight decay between them
+WINDOW_SIZE = 10
+WEIGHT_DECAY = 0.9
+
 
 class RecommendationEngine:
-    def __init__(self, db_path="./db/ecommerce.db"):
+    def __init__(
+        self,
+        db_path=DB_PATH,
+        window=WINDOW_SIZE,
+        weight_decay=WEIGHT_DECAY,
+        model_store=None,
+        checkpoint_interval=300,
+        reload_interval=None,
+        product_features=None,
+        cooccurrence_index=None,
+    ):
+        """
+        Warm starts from the newest model snapshot. A learning engine snapshots its
+        model every checkpoint_interval seconds; a predicting engine sets
+        reload_interval to pick up newer snapshots without restarting.
+        """
         self.db_path = db_path
-        self.vw = pyvw.Workspace("--cb_explore_adf --epsilon 0.2 -q UA --quiet")
+        self.model_store = model_store or ModelStore()
+        self.model_path = self.model_store.latest()
+        self.vw = self.load_workspace(self.model_path)
+        self.checkpoint_interval = checkpoint_interval
+        self.updates_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+        self.model_watcher = (
+            ModelWatcher(
+                self.model_store, self.load_workspace, reload_interval, self.model_path
+            ).start()
+            if reload_interval
+            else None
+        )
+        self.product_features = product_features or ProductFeatures()
+        self.candidate_index = CandidateIndex(db_path, features=self.product_features).load()
+        self.cooccurrence_index = cooccurrence_index or CooccurrenceIndex().load()
+        self.reset_example_cache()
+        self.session_scorer = DecayedSessionScorer(self, window, weight_decay)
+
+    # Model Lifecycle
+    def load_workspace(self, model_path=None):
+        """Creates a VW workspace, warm started from a snapshot if one is given."""
+        if model_path is None:
+            return pyvw.Workspace(VW_ARGS)
+        return pyvw.Workspace(f"{VW_ARGS} --initial_regressor {model_path}")
+
+    def checkpoint(self):
+        """Writes a snapshot of the current model and returns its path."""
+        path = self.model_store.save(self.vw)
+        if self.model_watcher:
+            self.model_watcher.ignore(path)
+        self.model_path = path
+        self.updates_since_checkpoint = 0
+        self.last_checkpoint = time.monotonic()
+        return path
+
+    def maybe_checkpoint(self):
+        """Snapshots the model if it learned anything since the last checkpoint interval."""
+        if (
+            self.checkpoint_interval
+            and self.updates_since_checkpoint
+            and time.monotonic() - self.last_checkpoint >= self.checkpoint_interval
+        ):
+            return self.checkpoint()
+        return None
+
+    def maybe_swap_model(self):
+        """Switches to a snapshot loaded in the background, if a newer one is ready."""
+        if not self.model_watcher:
+            return False
+        loaded = self.model_watcher.take()
+        if loaded is None:
+            return False
+        self.model_path, self.vw = loaded
+        self.reset_example_cache()  # Cached examples belong to the old workspace
+        print(f"Switched to model snapshot {self.model_path}")
+        return True
 
     # Database Utilities
     def get_db_connection(self):
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_db_connection(self.db_path)
 
     def query_db(self, query, args=(), one=False):
-        conn = self.get_db_connection()
-        cur = conn.cursor()
-        cur.execute(query, args)
-        result = cur.fetchall()
-        conn.close()
-        return (result[0] if result else None) if one else result
+        return query_db(query, args, one=one, db_path=self.db_path)
 
     def process_feedback(self, feedback_event, profile_data=None):
         """
         Incorporates feedback into the model by adjusting based on the feedback type.
         Takes into account the user's current profile for enhanced personalization.
         """
+        vw_example = self.build_feedback_example(feedback_event, profile_data)
+        if vw_example is None:
+            return False
+
+        try:
+            self.vw.learn(vw_example)
+        except RuntimeError as error:
+            # A bad example must not take down the consumer processing the batch
+            print(f"Failed to learn from feedback of session {feedback_event['session_id']}: {error}")
+            return False
+        self.updates_since_checkpoint += 1
+        print(
+            f"Feedback processed with profile data, model updated for session {feedback_event['session_id']}"
+        )
+        return True
 
+    def build_feedback_example(self, feedback_event, profile_data=None):
+        """
+        Formats a feedback event as a labelled VW example, or returns None when
+        there is no profile to learn from.
+        """
         if not profile_data:
-            return
+            return None
 
         # Prepare context with additional profile data
         context = self.get_context(feedback_event, profile_data)
@@ -43,13 +144,9 @@ class RecommendationEngine:
         if feedback_type == "positive" and profile_data:
             reward += self.calculate_additional_reward(profile_data, feedback_event)
 
-        # Format feedback event for VW and learn
+        # Format feedback event for VW
         chosen_action = feedback_event["product_id"]
-        vw_example = self.format_vw_example(context, actions, chosen_action, reward)
-        self.vw.learn(vw_example)
-        print(
-            f"Feedback processed with profile data, model updated for session {feedback_event['session_id']}"
-        )
+        return self.format_vw_example(context, actions, chosen_action, reward)
 
     def calculate_additional_reward(self, profile_data, feedback_event):
         """
@@ -59,38 +156,45 @@ class RecommendationEngine:
             return 0.2  # 20% reward for high-affinity items
         return 0.0
 
-    def process_event_batch(self, events, profile_data=None):
+    def process_event_batch(self, events, profile_data=None, weight_decay=WEIGHT_DECAY):
         """
         Processes a batch of events and combines them with profile data to compute recommendations.
         """
-        score_data = {}
-        total_weight = 0
-        weight = 1.0
-        weight_decay = 0.9
-
-        for event in reversed(events):
-            context = self.get_context(event, profile_data)
-            actions = self.get_possible_actions(event, profile_data)
-            reward = self.get_reward(event["event_type"])
-
-            for action, prob in zip(
-                actions, self.vw.predict(self.format_vw_example(context, actions))
-            ):
-                # Adjusting score using profile data if available
-                profile_score = profile_data.get(str(action), 0) if profile_data else 0
-                # Calculate final score with a balance between bandit probability and profile relevance
-                score_data[action] = (
-                    score_data.get(action, 0) + (reward * prob * weight) + profile_score
-                )
+        actions, scores = self.score_event_batch(events, profile_data, weight_decay)
+        score_data = dict(zip(actions.tolist(), scores.tolist()))
+        recommendations = actions[top_k(scores, 10)].tolist()
 
-            total_weight += weight
-            weight *= weight_decay
+        return score_data, recommendations  # Return top 10 recommendations
 
-        # Normalize scores to get a ranking
-        score_data = {k: v / total_weight for k, v in score_data.items()}
-        recommendations = sorted(score_data, key=score_data.get, reverse=True)
+    def score_event_batch(self, events, profile_data=None, weight_decay=WEIGHT_DECAY):
+        """
+        Array form of process_event_batch: returns (actions, scores) with actions in
+        order of first appearance, oldest event first.
+        """
+        events = list(reversed(events))
+        candidates = [
+            (
+                self.get_context(event, profile_data),
+                self.get_possible_actions(event, profile_data),
+            )
+            for event in events
+        ]
+        # Calculate final scores with a balance between bandit probability and profile relevance
+        return score_window(
+            [actions for _, actions in candidates],
+            self.predict_batch(candidates),
+            [self.get_reward(event["event_type"]) for event in events],
+            weight_decay,
+            profile_data,
+        )
 
-        return score_data, recommendations[:10]  # Return top 10 recommendations
+    def process_session_event(self, session_id, recent_events, profile_data=None):
+        """
+        Incremental equivalent of process_event_batch for a session's window, newest
+        event first. Only the newest event is predicted when the session's score
+        state is up to date, otherwise the state is rebuilt from the window.
+        """
+        return self.session_scorer.score(session_id, recent_events, profile_data)
 
     def get_context(self, event, profile_data=None):
         """
@@ -98,9 +202,7 @@ class RecommendationEngine:
         """
         context = {
             "session_id": event["session_id"],
-            "time_of_day": datetime.strptime(
-                event.get("timestamp").replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f"
-            ).hour,
+            "time_of_day": as_event(event).time.hour,
             "device": event.get("additional_context", {}).get("device_type", "unknown"),
         }
         # Optionally add profile data as part of context if needed
@@ -113,40 +215,53 @@ class RecommendationEngine:
     def get_possible_actions(self, event, profile_data=None, limit=10):
         """
         Fetches product IDs as possible actions, balancing recency, popularity, and profile affinity.
+        Candidates are distinct: category and popular products overlap, so each source
+        skips products already taken and the next one fills the remaining slots.
         """
-        category_id = self.get_event_category_id(event)
-        category_products = self.query_db(
-            """
-            SELECT p.id FROM products p
-            JOIN categories c ON p.category_id = c.id
-            WHERE c.id = ?
-            LIMIT ?
-            """,
-            (category_id, int(limit / 2)),
-        )
+        with CANDIDATE_LATENCY.time():
+            self.candidate_index.maybe_refresh()
+            # Products often interacted with in the same sessions as this one come first
+            candidates = dict.fromkeys(self.get_session_candidates([event], int(limit / 2)))
+            category_id = self.get_event_category_id(event)
+            category_limit = len(candidates) + int((limit - len(candidates)) / 2)
+            for product_id in self.candidate_index.get_category_products(category_id, limit):
+                if len(candidates) >= category_limit:
+                    break
+                candidates.setdefault(product_id)
+            for product_id in self.candidate_index.get_popular_products(limit + len(candidates)):
+                if len(candidates) >= limit:
+                    break
+                candidates.setdefault(product_id)
 
-        popular_products = self.query_db(
-            "SELECT id FROM products ORDER BY stars DESC LIMIT ?",
-            (limit - len(category_products),),
-        )
+            # Filter or prioritize based on profile data if available
+            all_products = list(candidates)
 
-        # Filter or prioritize based on profile data if available
-        all_products = [product["id"] for product in category_products] + [
-            product["id"] for product in popular_products
-        ]
-
-        if profile_data:
-            # Sorting by profile relevance for actions
-            all_products = sorted(
-                all_products,
-                key=lambda pid: profile_data.get(str(pid), 0),
-                reverse=True,
-            )
+            if profile_data:
+                # Sorting by profile relevance for actions
+                all_products = sorted(
+                    all_products,
+                    key=lambda pid: profile_data.get(str(pid), 0),
+                    reverse=True,
+                )
 
-        random.shuffle(all_products)
+            random.shuffle(all_products)
 
         return all_products[:limit]
 
+    def get_session_candidates(self, recent_events, limit=10):
+        """
+        Products that co-occur with the products of a session's recent events, newest
+        event first, ranked by the co-occurrence index. Empty until an index is built.
+        """
+        product_ids = []
+        for event in recent_events:
+            try:
+                product_ids.append(int(event.get("product_id")))
+            except (TypeError, ValueError):
+                continue
+        self.cooccurrence_index.maybe_refresh()
+        return self.cooccurrence_index.get_candidates(product_ids, limit)
+
     def get_event_category_id(self, event):
         """
         Determines the category ID based on event type.
@@ -154,30 +269,118 @@ class RecommendationEngine:
         return (
             event["category_id"]
             if event["event_type"] == "click_category"
-            else self.query_db(
-                "SELECT category_id FROM products WHERE id = ?",
-                (event["product_id"],),
-                one=True,
-            )["category_id"]
+            else self.candidate_index.get_category_id(event["product_id"])
         )
 
     # Vowpal Wabbit Integration
     def get_action(self, context, actions):
-        vw_format = self.format_vw_example(context, actions)
-        pmf = self.vw.predict(vw_format)
+        pmf = self.predict_actions(context, actions)
         chosen_action_index, prob = self.sample_pmf(pmf)
         return actions[chosen_action_index], prob
 
+    def reset_example_cache(self, max_actions=100000, max_shared=10000):
+        """
+        Drops the cached VW examples. They belong to the current workspace, so
+        this must be called whenever self.vw is replaced.
+        """
+        self.max_cached_actions = max_actions
+        self.max_cached_shared = max_shared
+        self._action_examples = OrderedDict()
+        self._shared_examples = OrderedDict()
+        self._user_namespace = self.vw.hash_space("User")
+        self._action_namespace = self.vw.hash_space("Action")
+
+    def _cache_example(self, cache, key, example, max_size):
+        cache[key] = example
+        if len(cache) > max_size:
+            cache.popitem(last=False)
+        return example
+
+    def _new_action_example(self, action):
+        example = pyvw.Example(self.vw)
+        example.push_features(
+            "A", [self.vw.hash_feature(f"product={action}", self._action_namespace)]
+        )
+        example.setup_example()
+        return example
+
+    def get_shared_example(self, context):
+        """Returns the pre-hashed shared (User) example for a context, equivalent to its text form."""
+        key = (context["session_id"], context["time_of_day"], context["device"])
+        example = self._shared_examples.get(key)
+        if example is not None:
+            self._shared_examples.move_to_end(key)
+            return example
+
+        example = pyvw.Example(self.vw)
+        example.set_label_string("shared")
+        example.push_features(
+            "U",
+            [
+                self.vw.hash_feature(feature, self._user_namespace)
+                for feature in (
+                    f"session_id={context['session_id']}",
+                    f"time_of_day={context['time_of_day']}",
+                    f"device={context['device']}",
+                )
+            ],
+        )
+        example.setup_example()
+        return self._cache_example(
+            self._shared_examples, key, example, self.max_cached_shared
+        )
+
+    def get_action_examples(self, actions):
+        """
+        Returns pre-hashed action examples, reused across predictions. VW can't take
+        the same example object twice in one multi-example, so repeats get a fresh copy.
+        """
+        examples, seen = [], set()
+        for action in actions:
+            if action in seen:
+                examples.append(self._new_action_example(action))
+                continue
+            seen.add(action)
+            example = self._action_examples.get(action)
+            if example is None:
+                example = self._cache_example(
+                    self._action_examples,
+                    action,
+                    self._new_action_example(action),
+                    self.max_cached_actions,
+                )
+            else:
+                self._action_examples.move_to_end(action)
+            examples.append(example)
+        return examples
+
+    def predict_actions(self, context, actions):
+        """Scores actions for a context without formatting or parsing a text example."""
+        with PREDICT_LATENCY.time():
+            return self.vw.predict(
+                [self.get_shared_example(context)] + self.get_action_examples(actions)
+            )
+
+    def predict_batch(self, candidates):
+        """
+        Scores many (context, actions) pairs, e.g. every event of a session window or
+        the windows of several sessions, returning one pmf per pair.
+        """
+        return [self.predict_actions(context, actions) for context, actions in candidates]
+
     def format_vw_example(
         self, context, actions, chosen_action=None, reward=None, prob=None
     ):
         """
-        Formats the Vowpal Wabbit input example with context and actions.
+        Formats the Vowpal Wabbit input example with context and actions. Only the
+        first line of the chosen action is labelled, cb_adf rejects examples with more.
         """
         example = f"shared |User session_id={context['session_id']} time_of_day={context['time_of_day']} device={context['device']}\n"
+        labelled = False
         for action in actions:
-            if chosen_action and action == chosen_action:
+            if chosen_action and action == chosen_action and not labelled:
                 example += f"0:{reward}:{prob} |Action product={action}\n"
+                labelled = True
             else:
                 example += f"|Action product={action}\n"
         return example.strip()
@@ -0,0 +1,263 @@
+import numpy as np
+
+from engine import snapshots
+
+COOCCURRENCE_DIR = "db/cooccurrence"
+SNAPSHOT_PREFIX = "cooccurrence"
+
+# How strongly an interaction ties a product to the rest of its session
+EVENT_WEIGHTS = {
+    "view_product": 1.0,
+    "add_to_cart": 3.0,
+    "purchase": 5.0,
+}
+
+# Sessions with more distinct products only pair their most recent ones, which
+# bounds the quadratic pair count of crawler-like sessions
+MAX_SESSION_ITEMS = 50
+TOP_K = 50
+# Pending pairs merged into the sorted counts once this many have accumulated
+COMPACT_THRESHOLD = 5_000_000
+
+
+def compact_pairs(keys, weights):
+    """Sums the weights of duplicate pair keys, returning sorted unique keys."""
+    if not len(keys):
+        return keys.astype(np.int64), weights.astype(np.float64)
+    order = np.argsort(keys, kind="stable")
+    keys, weights = keys[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(weights, starts)
+
+
+def encode_pairs(first, second):
+    # Product ids fit in 32 bits, so a pair is one sortable int64
+    return (first.astype(np.int64) << 32) | second.astype(np.int64)
+
+
+def decode_pairs(keys):
+    return keys >> 32, keys & 0xFFFFFFFF
+
+
+class CooccurrenceBuilder:
+    """
+    Accumulates session level co-occurrence counts: every pair of distinct products
+    interacted with in the same session adds the smaller of their event weights.
+    Counts are kept as a sparse upper triangle (pair key -> weight) plus the weight
+    of each product, and can be seeded from a previous snapshot to build incrementally.
+    """
+
+    def __init__(self, max_session_items=MAX_SESSION_ITEMS, compact_threshold=COMPACT_THRESHOLD):
+        self.max_session_items = max_session_items
+        self.compact_threshold = compact_threshold
+        self.pair_keys = np.zeros(0, dtype=np.int64)
+        self.pair_weights = np.zeros(0, dtype=np.float64)
+        self.item_weights = np.zeros(0, dtype=np.float64)
+        self.sessions = 0
+        self._pending = []
+        self._pending_size = 0
+        self._open_sessions = {}  # session_id -> {product_id: weight}, insertion ordered
+
+    @classmethod
+    def from_snapshot(cls, path, decay=1.0, **kwargs):
+        """Starts from a snapshot's counts, scaled by decay so older sessions fade out."""
+        builder = cls(**kwargs)
+        arrays, meta = snapshots.load_snapshot(
+            path, ("pair_keys", "pair_weights", "item_weights"), mmap_mode=None
+        )
+        builder.pair_keys = arrays["pair_keys"]
+        builder.pair_weights = arrays["pair_weights"] * decay
+        builder.item_weights = arrays["item_weights"] * decay
+        builder.sessions = meta["sessions"]
+        return builder
+
+    def add_event(self, session_id, event_type, product_id):
+        weight = EVENT_WEIGHTS.get(event_type)
+        if weight is None or product_id is None:
+            return
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return
+        if not 0 <= product_id < 1 << 31:
+            return
+        items = self._open_sessions.setdefault(session_id, {})
+        # Re-inserting moves the product to the end, the most recent position
+        weight = max(weight, items.pop(product_id, 0))
+        items[product_id] = weight
+
+    def finish_session(self, session_id):
+        """Turns a session's products into pairs, e.g. once grouped input moves past it."""
+        items = self._open_sessions.pop(session_id, None)
+        if not items:
+            return
+        self.sessions += 1
+        products = np.fromiter(items, dtype=np.int64, count=len(items))[-self.max_session_items :]
+        weights = np.fromiter(items.values(), dtype=np.float64, count=len(items))[
+            -self.max_session_items :
+        ]
+
+        if products.max() >= len(self.item_weights):
+            self.item_weights = np.concatenate(
+                [self.item_weights, np.zeros(products.max() + 1 - len(self.item_weights))]
+            )
+        self.item_weights[products] += weights
+        if len(products) < 2:
+            return
+
+        # Upper triangle only, ordered so the smaller id comes first
+        order = np.argsort(products)
+        products, weights = products[order], weights[order]
+        first, second = np.triu_indices(len(products), 1)
+        self._pending.append(
+            (
+                encode_pairs(products[first], products[second]),
+                np.minimum(weights[first], weights[second]),
+            )
+        )
+        self._pending_size += len(first)
+        if self._pending_size >= self.compact_threshold:
+            self.compact()
+
+    def finish_all_sessions(self):
+        for session_id in list(self._open_sessions):
+            self.finish_session(session_id)
+
+    def compact(self):
+        if not self._pending:
+            return
+        keys, weights = zip(*self._pending)
+        self.pair_keys, self.pair_weights = compact_pairs(
+            np.concatenate((self.pair_keys,) + keys),
+            np.concatenate((self.pair_weights,) + weights),
+        )
+        self._pending, self._pending_size = [], 0
+
+    def build_neighbors(self, top_k=TOP_K, min_weight=1.0):
+        """
+        Returns (indptr, neighbors, scores), a CSR matrix by product id: the
+        neighbours of product p are neighbors[indptr[p]:indptr[p + 1]], at most
+        top_k of them, best first. Only products with neighbours take space, where
+        a dense product x top_k matrix would mostly hold padding. Scores are the
+        co-occurrence weight normalized by both products' weights (cosine), so
+        globally popular products don't become everyone's neighbour.
+        """
+        self.finish_all_sessions()
+        self.compact()
+        size = len(self.item_weights)
+
+        keep = self.pair_weights >= min_weight
+        first, second = decode_pairs(self.pair_keys[keep])
+        weights = self.pair_weights[keep]
+        if not len(weights):
+            return (
+                np.zeros(size + 1, dtype=np.int64),
+                np.zeros(0, dtype=np.int32),
+                np.zeros(0, dtype=np.float32),
+            )
+
+        # Both directions of every pair, then the best top_k per product
+        rows = np.concatenate([first, second])
+        columns = np.concatenate([second, first])
+        similarity = np.concatenate([weights, weights]) / np.sqrt(
+            self.item_weights[rows] * self.item_weights[columns]
+        )
+        order = np.lexsort((columns, -similarity, rows))
+        rows, columns, similarity = rows[order], columns[order], similarity[order]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        ranks = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+        top = ranks < top_k
+        # Still sorted by product, so the kept entries are already in CSR order
+        indptr = np.r_[0, np.cumsum(np.bincount(rows[top], minlength=size))]
+        return indptr, columns[top].astype(np.int32), similarity[top].astype(np.float32)
+
+    def save(self, directory=COOCCURRENCE_DIR, top_k=TOP_K, min_weight=1.0, keep=3):
+        """Writes the neighbour index together with the raw counts it was built from."""
+        indptr, neighbors, scores = self.build_neighbors(top_k, min_weight)
+        return snapshots.write_snapshot(
+            directory,
+            SNAPSHOT_PREFIX,
+            {
+                "neighbor_indptr": indptr,
+                "neighbors": neighbors,
+                "scores": scores,
+                "pair_keys": self.pair_keys,
+                "pair_weights": self.pair_weights,
+                "item_weights": self.item_weights,
+            },
+            {"sessions": self.sessions, "pairs": len(self.pair_keys), "top_k": top_k},
+            keep,
+        )
+
+
+class CooccurrenceNeighbors:
+    """Immutable CSR neighbour lists of one snapshot, empty before the first build."""
+
+    def __init__(self, indptr=None, neighbors=None, scores=None):
+        self.indptr = np.zeros(1, dtype=np.int64) if indptr is None else indptr
+        self.neighbors = np.zeros(0, dtype=np.int32) if neighbors is None else neighbors
+        self.scores = np.zeros(0, dtype=np.float32) if scores is None else scores
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def get_neighbors(self, product_id, limit=TOP_K):
+        if not 0 <= product_id < len(self):
+            return []
+        start, end = self.indptr[product_id], self.indptr[product_id + 1]
+        return self.neighbors[start : min(end, start + limit)].tolist()
+
+    def get_candidates(self, product_ids, limit=10, decay=0.9):
+        """
+        Ranks the neighbours of a session's recent products, newest first. Each
+        product's neighbour scores are weighted by decay ** its position, summed
+        across products, and the session's own products are left out.
+        """
+        product_ids = [
+            product_id
+            for product_id in product_ids
+            if product_id is not None and 0 <= product_id < len(self)
+        ]
+        if not product_ids:
+            return []
+        rows = np.asarray(product_ids, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        # Positions of every row's neighbours, concatenated in row order
+        positions = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths) + np.arange(
+            lengths.sum()
+        )
+        neighbors = self.neighbors[positions]
+        scores = self.scores[positions] * np.repeat(decay ** np.arange(len(rows)), lengths)
+
+        valid = ~np.isin(neighbors, rows)
+        neighbors, scores = neighbors[valid], scores[valid]
+        if not len(neighbors):
+            return []
+        unique, inverse = np.unique(neighbors, return_inverse=True)
+        totals = np.bincount(inverse.ravel(), weights=scores)
+        # Best first, ties by id so results are stable across calls
+        best = np.lexsort((unique, -totals))[:limit]
+        return unique[best].tolist()
+
+
+class CooccurrenceIndex(snapshots.SnapshotReader):
+    """
+    Memory maps the newest neighbour index read-only, shared by every process, and
+    switches to newer snapshots as the batch job writes them.
+    """
+
+    def __init__(self, directory=COOCCURRENCE_DIR, refresh_interval=300):
+        super().__init__(directory, SNAPSHOT_PREFIX, refresh_interval, CooccurrenceNeighbors())
+
+    def open_snapshot(self, path):
+        arrays, _ = snapshots.load_snapshot(path, ("neighbor_indptr", "neighbors", "scores"))
+        return CooccurrenceNeighbors(
+            arrays["neighbor_indptr"], arrays["neighbors"], arrays["scores"]
+        )
+
+    def get_neighbors(self, product_id, limit=TOP_K):
+        return self.snapshot.get_neighbors(product_id, limit)
+
+    def get_candidates(self, product_ids, limit=10, decay=0.9):
+        return self.snapshot.get_candidates(product_ids, limit, decay)
@@ -0,0 +1,124 @@
+import numpy as np
+
+from db.catalog import get_catalog_version
+from engine import snapshots
+from utils.db_client import DB_PATH, get_db_connection
+
+FEATURE_DIR = "db/features"
+SNAPSHOT_PREFIX = "features"
+
+# Column -> dtype, each stored as its own .npy file indexed by product id
+FEATURE_COLUMNS = {
+    "present": np.bool_,  # False for ids with no product
+    "stars": np.float32,
+    "reviews": np.int32,
+    "price": np.float32,
+    "category_id": np.int32,
+    "isBestSeller": np.bool_,
+}
+
+MISSING_CATEGORY = -1
+
+
+def list_snapshots(directory=FEATURE_DIR):
+    return snapshots.list_snapshots(directory, SNAPSHOT_PREFIX)
+
+
+def build_feature_columns(rows):
+    """Turns (id, stars, reviews, price, category_id, isBestSeller) rows into id-indexed arrays."""
+    rows = [row for row in rows if row[0] is not None and row[0] >= 0]
+    size = max((row[0] for row in rows), default=-1) + 1
+    columns = {name: np.zeros(size, dtype=dtype) for name, dtype in FEATURE_COLUMNS.items()}
+    columns["category_id"].fill(MISSING_CATEGORY)
+    if not rows:
+        return columns
+
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    columns["present"][ids] = True
+    for position, name in enumerate(("stars", "reviews", "price", "category_id", "isBestSeller"), 1):
+        default = MISSING_CATEGORY if name == "category_id" else 0
+        columns[name][ids] = np.fromiter(
+            (default if row[position] is None else row[position] for row in rows),
+            dtype=FEATURE_COLUMNS[name],
+            count=len(rows),
+        )
+    return columns
+
+
+def export_features(db_path=DB_PATH, directory=FEATURE_DIR, keep=3):
+    """Writes the ranking features of every product to a new snapshot and returns its path."""
+    with get_db_connection(db_path) as conn:
+        version = get_catalog_version(conn)
+        rows = conn.execute(
+            "SELECT id, stars, reviews, price, category_id, isBestSeller FROM products"
+        ).fetchall()
+    columns = build_feature_columns([tuple(row) for row in rows])
+    return snapshots.write_snapshot(
+        directory,
+        SNAPSHOT_PREFIX,
+        columns,
+        {"catalog_version": version, "size": len(columns["present"])},
+        keep,
+    )
+
+
+class FeatureSnapshot:
+    """
+    Read-only memory maps of one exported snapshot. Every process mapping it shares
+    the same page cache pages, and lookups index the arrays without copying them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.columns, meta = snapshots.load_snapshot(path, FEATURE_COLUMNS)
+        self.version = meta["catalog_version"]
+        self.present = self.columns["present"]
+
+    def __len__(self):
+        return len(self.present)
+
+    def __contains__(self, product_id):
+        return 0 <= product_id < len(self.present) and bool(self.present[product_id])
+
+    def column(self, name):
+        return self.columns[name]
+
+    def get(self, product_id):
+        """Returns the features of one product as a dict, or None if it isn't in the snapshot."""
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return None
+        if product_id not in self:
+            return None
+        return {
+            name: values[product_id].item()
+            for name, values in self.columns.items()
+            if name != "present"
+        }
+
+    def take(self, name, product_ids, default=0):
+        """Gathers one column for an array of product ids, default for unknown ids."""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        known = (product_ids >= 0) & (product_ids < len(self.present))
+        known[known] = self.present[product_ids[known]]
+        values = np.full(product_ids.shape, default, dtype=self.columns[name].dtype)
+        values[known] = self.columns[name][product_ids[known]]
+        return values
+
+
+class ProductFeatures(snapshots.SnapshotReader):
+    """
+    Maps the newest feature snapshot and switches to newer ones as the exporter
+    writes them, checking at most once per refresh_interval.
+    """
+
+    def __init__(self, directory=FEATURE_DIR, refresh_interval=60):
+        super().__init__(directory, SNAPSHOT_PREFIX, refresh_interval)
+
+    def open_snapshot(self, path):
+        return FeatureSnapshot(path)
+
+    def get(self, product_id):
+        snapshot = self.snapshot
+        return snapshot.get(product_id) if snapshot is not None else None
@@ -0,0 +1,103 @@
+import glob
+import os
+import tempfile
+import threading
+import time
+
+MODEL_DIR = "models"
+
+
+class ModelStore:
+    """
+    Directory of versioned VW model snapshots. Snapshots are written to a temporary
+    file and renamed into place, so readers never see a partially written model.
+    """
+
+    def __init__(self, directory=MODEL_DIR, prefix="cb_model", keep=5):
+        self.directory = directory
+        self.prefix = prefix
+        self.keep = keep
+
+    def list_snapshots(self):
+        """Returns snapshot paths, oldest first."""
+        return sorted(glob.glob(os.path.join(self.directory, f"{self.prefix}-*.vw")))
+
+    def latest(self):
+        snapshots = self.list_snapshots()
+        return snapshots[-1] if snapshots else None
+
+    def save(self, vw):
+        """Atomically writes a new snapshot of the workspace and returns its path."""
+        os.makedirs(self.directory, exist_ok=True)
+        # Zero padded milliseconds keep lexical and chronological order identical
+        version = f"{int(time.time() * 1000):015d}-{os.getpid()}"
+        path = os.path.join(self.directory, f"{self.prefix}-{version}.vw")
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            vw.save(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self.prune()
+        return path
+
+    def prune(self):
+        for path in self.list_snapshots()[: -self.keep]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # Another process pruned it first
+
+
+class ModelWatcher:
+    """
+    Loads newer snapshots in a background thread. The event loop only picks up a
+    ready workspace with take(), so loading a model never pauses processing.
+    """
+
+    def __init__(self, store, load_workspace, interval=30, current_path=None):
+        self.store = store
+        self.load_workspace = load_workspace
+        self.interval = interval
+        self.current_path = current_path
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def ignore(self, path):
+        """Marks a snapshot as already loaded, e.g. one this process just wrote."""
+        with self._lock:
+            self.current_path = path
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            path = self.store.latest()
+            with self._lock:
+                if path is None or path == self.current_path:
+                    continue
+            try:
+                workspace = self.load_workspace(path)
+            except Exception as error:
+                print(f"Failed to load model snapshot {path}: {error}")
+                continue
+            with self._lock:
+                self._pending = (path, workspace)
+                self.current_path = path
+
+    def take(self):
+        """Returns (path, workspace) for a newly loaded snapshot, or None."""
+        with self._lock:
+            pending, self._pending = self._pending, None
+        return pending
+
+    def stop(self):
+        self._stopped.set()
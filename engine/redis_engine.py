@@ -1,8 +1,53 @@
 import json
+import time
+
+from redis.exceptions import ResponseError, WatchError
+
+from engine.session_store import ColdSessionStore
+from utils.events import Event, as_event
 from utils.redis_client import get_redis_connection
 
 redis_conn = get_redis_connection()
 
+# Idle sessions are spilled to the cold store by spill_idle_sessions. The sliding
+# TTL only backs that up, so it is kept well above the idle threshold.
+SESSION_IDLE_SECONDS = 1800
+SESSION_TTL_SECONDS = 7200
+SESSION_KEY_SUFFIXES = (
+    "last_processed_timestamp",
+    "recent_interactions",
+    "profile",
+    "recommendations",
+    "category_order",
+)
+# Sorted set of session_id -> last write time, used to find idle sessions
+LAST_SEEN_KEY = "sessions:last_seen"
+# Set of the session ids spilled to the cold store, checked before querying it
+SPILLED_KEY = "sessions:spilled"
+# Returned by the record interaction script for sessions that are not in Redis
+COLD_SESSION = "cold"
+
+cold_store = ColdSessionStore()
+
+
+def get_session_keys(session_id):
+    return [f"user:{session_id}:{suffix}" for suffix in SESSION_KEY_SUFFIXES]
+
+
+def _queue_touch(pipe, session_id, *suffixes):
+    """Queues a TTL refresh of the given session keys and marks the session as active."""
+    for suffix in suffixes:
+        pipe.expire(f"user:{session_id}:{suffix}", SESSION_TTL_SECONDS)
+    pipe.zadd(LAST_SEEN_KEY, {str(session_id): time.time()})
+
+
+def _read_session(session_id, read):
+    """Runs read(), and once more after rehydrating the session if nothing was found."""
+    value = read()
+    if not value and rehydrate_sessions([session_id]):
+        value = read()
+    return value
+
 
 def format_score_data_for_profile(score_data):
     """
@@ -18,28 +63,130 @@ def format_score_data_for_profile(score_data):
     return {"affinities": affinities}
 
 
+def get_profile_key(session_id):
+    return f"user:{session_id}:profile"
+
+
+def _queue_profile_write(pipe, profile_key, score_data):
+    """
+    Queues a profile write as a sorted set of product id -> score. The key is
+    deleted first so products that left the session window drop out, which also
+    replaces a legacy JSON blob stored under the same key.
+    """
+    pipe.delete(profile_key)
+    if score_data:
+        pipe.zadd(profile_key, {str(product_id): score for product_id, score in score_data.items()})
+
+
 def cache_user_profile(session_id, score_data):
-    """Caches the structured profile for a user in Redis."""
-    profile_key = f"user:{session_id}:profile"
-    formatted_profile = format_score_data_for_profile(score_data)
-    redis_conn.set(profile_key, json.dumps(formatted_profile))
+    """Caches the profile scores for a user in Redis."""
+    pipe = redis_conn.pipeline()
+    _queue_profile_write(pipe, get_profile_key(session_id), score_data)
+    _queue_touch(pipe, session_id, "profile")
+    pipe.execute()
+
+
+def _parse_product_id(member):
+    return int(member) if member.lstrip("-").isdigit() else member
+
+
+def get_user_profile_scores(session_id, top_k=None):
+    """
+    Retrieves the profile of a user session, highest scores first, as
+    {"affinities": [{"id": ..., "score": ...}, ...]}. With top_k only the best
+    top_k products are read, and a top_k below 1 reads nothing. Profiles still
+    stored as JSON blobs are read as is and converted to a sorted set.
+    """
+    if top_k is not None and top_k < 1:
+        # ZREVRANGE 0 -1 would be the whole profile and negative stops count from the end
+        return {}
+    return _read_session(session_id, lambda: _read_user_profile_scores(session_id, top_k))
+
+
+def _read_user_profile_scores(session_id, top_k=None):
+    profile_key = get_profile_key(session_id)
+    try:
+        members = redis_conn.zrevrange(
+            profile_key, 0, -1 if top_k is None else top_k - 1, withscores=True
+        )
+    except ResponseError:
+        # WRONGTYPE: the profile predates sorted set storage
+        return _migrate_profile_blob(profile_key, top_k)
+    if not members:
+        return {}
+    return format_score_data_for_profile(
+        {_parse_product_id(member): score for member, score in members}
+    )
+
+
+def get_profile_scores_batch(session_ids):
+    """
+    Raw profiles of several sessions in one round trip, as {session_id: {product
+    id as text: score}}, the form RecommendationEngine takes as profile_data.
+    """
+    session_ids = list(session_ids)
+    pipe = redis_conn.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.zrange(get_profile_key(session_id), 0, -1, withscores=True)
+    profiles = {}
+    for session_id, members in zip(session_ids, pipe.execute(raise_on_error=False)):
+        if isinstance(members, ResponseError):
+            # WRONGTYPE: the profile predates sorted set storage
+            affinities = _migrate_profile_blob(get_profile_key(session_id)).get("affinities", [])
+            members = [(str(affinity["id"]), affinity["score"]) for affinity in affinities]
+        profiles[session_id] = dict(members)
+    return profiles
+
+
+def _migrate_profile_blob(profile_key, top_k=None):
+    """Rewrites a JSON profile blob as a sorted set and returns its formatted scores."""
+    profile_data = redis_conn.get(profile_key)
+    if not profile_data:
+        return {}
+    score_data = {
+        affinity["id"]: affinity["score"] for affinity in json.loads(profile_data)["affinities"]
+    }
 
+    # Only replace the blob if no writer changed the key in the meantime
+    with redis_conn.pipeline() as pipe:
+        try:
+            pipe.watch(profile_key)
+            if pipe.type(profile_key) == "string":
+                pipe.multi()
+                _queue_profile_write(pipe, profile_key, score_data)
+                pipe.expire(profile_key, SESSION_TTL_SECONDS)
+                pipe.execute()
+        except WatchError:
+            pass  # Lost the race, the next read sees the new format
 
-def get_user_profile_scores(session_id):
-    """Retrieves and deserializes the cached profile for a user session."""
-    profile_data = redis_conn.get(f"user:{session_id}:profile")
-    return json.loads(profile_data) if profile_data else {}
+    ranked = sorted(score_data.items(), key=lambda item: item[1], reverse=True)
+    return format_score_data_for_profile(dict(ranked[:top_k]))
+
+
+def migrate_profile_blobs(batch_size=1000):
+    """Converts every JSON profile blob to a sorted set. Returns the number converted."""
+    migrated = 0
+    for profile_key in redis_conn.scan_iter(match="user:*:profile", count=batch_size):
+        if redis_conn.type(profile_key) == "string":
+            _migrate_profile_blob(profile_key)
+            migrated += 1
+    return migrated
 
 
 def cache_recommendations(session_id, recommendations):
     """Caches recommended products for a user session."""
     # Serialize list as JSON before storing
-    redis_conn.set(f"user:{session_id}:recommendations", json.dumps(recommendations))
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.set(f"user:{session_id}:recommendations", json.dumps(recommendations))
+    _queue_touch(pipe, session_id, "recommendations")
+    pipe.execute()
 
 
 def get_recommendations(session_id):
     """Retrieves cached recommendations for a user session."""
-    recommendations = redis_conn.get(f"user:{session_id}:recommendations")
+    recommendations = _read_session(
+        session_id, lambda: redis_conn.get(f"user:{session_id}:recommendations")
+    )
     # Deserialize JSON string back to list
     return json.loads(recommendations) if recommendations else []
 
@@ -47,34 +194,332 @@ def get_recommendations(session_id):
 def cache_categories_order(session_id, category_order):
     """Caches the category display order for a user session based on preferences."""
     # Serialize list as JSON before storing
-    redis_conn.set(f"user:{session_id}:category_order", json.dumps(category_order))
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.set(f"user:{session_id}:category_order", json.dumps(category_order))
+    _queue_touch(pipe, session_id, "category_order")
+    pipe.execute()
 
 
 def get_categories_order(session_id):
     """Retrieves the cached category order for a user session."""
-    category_order = redis_conn.get(f"user:{session_id}:category_order")
+    category_order = _read_session(
+        session_id, lambda: redis_conn.get(f"user:{session_id}:category_order")
+    )
     # Deserialize JSON string back to list
     return json.loads(category_order) if category_order else []
 
 
 # In the Redis engine
 def cache_recent_interactions(session_id, event):
-    redis_conn.lpush(f"user:{session_id}:recent_interactions", json.dumps(event))
-    redis_conn.ltrim(
-        f"user:{session_id}:recent_interactions", 0, 9
-    )  # Keep only last 10 interactions
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.lpush(f"user:{session_id}:recent_interactions", as_event(event).to_json())
+    pipe.ltrim(f"user:{session_id}:recent_interactions", 0, 9)  # Keep only last 10 interactions
+    _queue_touch(pipe, session_id, "recent_interactions")
+    pipe.execute()
 
 
 def get_recent_interactions(session_id):
-    interactions = redis_conn.lrange(f"user:{session_id}:recent_interactions", 0, 9)
-    return [json.loads(event) for event in interactions]
+    interactions = _read_session(
+        session_id, lambda: redis_conn.lrange(f"user:{session_id}:recent_interactions", 0, 9)
+    )
+    return [Event.from_json(event) for event in interactions]
 
 
 def cache_last_processed_timestamp(session_id, timestamp):
     """Cache the last processed timestamp for a user's session."""
-    redis_conn.set(f"user:{session_id}:last_processed_timestamp", timestamp)
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.set(f"user:{session_id}:last_processed_timestamp", timestamp)
+    _queue_touch(pipe, session_id, "last_processed_timestamp")
+    pipe.execute()
 
 
 def get_last_processed_timestamp(session_id):
     """Get the last processed timestamp for a user's session."""
-    return redis_conn.get(f"user:{session_id}:last_processed_timestamp")
+    return _read_session(
+        session_id, lambda: redis_conn.get(f"user:{session_id}:last_processed_timestamp")
+    )
+
+
+# Dedup check, interaction push and window fetch done atomically in one round trip.
+# validate_event converts timestamps to UTC, and they are compared as strings padded
+# to microseconds, so values with and without fractional seconds order correctly. With ARGV[4] set, sessions
+# that have no state in Redis are reported as cold instead of being started, so the
+# caller can rehydrate them first.
+RECORD_INTERACTION_SCRIPT = """
+local function sortable(ts)
+    local date, time = string.match(ts, "^(%d+%-%d+%-%d+)T(%d+:%d+:%d+)")
+    if not date then
+        return ts
+    end
+    local fraction = string.match(ts, "^[^.]*%.(%d+)") or ""
+    return date .. "T" .. time .. "." .. string.sub(fraction .. "000000", 1, 6)
+end
+
+local last_processed = redis.call("GET", KEYS[1])
+if not last_processed and ARGV[4] == "1" then
+    return "cold"
+end
+if last_processed and sortable(ARGV[1]) <= sortable(last_processed) then
+    return false
+end
+redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[5])
+redis.call("ZADD", KEYS[3], ARGV[6], ARGV[7])
+if ARGV[2] == "" then
+    return {}
+end
+local window = tonumber(ARGV[3])
+redis.call("LPUSH", KEYS[2], ARGV[2])
+redis.call("LTRIM", KEYS[2], 0, window - 1)
+redis.call("EXPIRE", KEYS[2], ARGV[5])
+return redis.call("LRANGE", KEYS[2], 0, window - 1)
+"""
+
+record_interaction_script = redis_conn.register_script(RECORD_INTERACTION_SCRIPT)
+
+
+def _record_interaction_call(session_id, event, store_event, window, check_cold, client=None):
+    event = as_event(event)
+    return record_interaction_script(
+        keys=[
+            f"user:{session_id}:last_processed_timestamp",
+            f"user:{session_id}:recent_interactions",
+            LAST_SEEN_KEY,
+        ],
+        args=[
+            event.get("timestamp"),
+            event.to_json() if store_event else "",
+            window,
+            "1" if check_cold else "0",
+            SESSION_TTL_SECONDS,
+            time.time(),
+            str(session_id),
+        ],
+        client=client,
+    )
+
+
+def _run_record_batch(events, window, check_cold):
+    pipe = redis_conn.pipeline(transaction=False)
+    for session_id, event, store_event in events:
+        _record_interaction_call(session_id, event, store_event, window, check_cold, client=pipe)
+    return pipe.execute()
+
+
+def record_interaction(session_id, event, store_event=True, window=10):
+    """
+    Replaces get_last_processed_timestamp, cache_recent_interactions,
+    cache_last_processed_timestamp and get_recent_interactions with one script call.
+    Returns None if the event is not newer than the last processed one, otherwise
+    the recent interactions (empty when store_event is False, e.g. for feedback).
+    """
+    return record_interactions_batch([(session_id, event, store_event)], window)[0]
+
+
+def record_interactions_batch(events, window=10):
+    """
+    Pipelined form of record_interaction for many (session_id, event, store_event)
+    tuples, applied in order in a single round trip. Events of sessions missing
+    from Redis take a second round trip, after their state is rehydrated from the
+    cold store if it was spilled there.
+    """
+    results = _run_record_batch(events, window, check_cold=True)
+
+    # A cold session reports every one of its events in the batch as cold, so
+    # rerunning just those keeps each session's events in order
+    cold = [index for index, result in enumerate(results) if result == COLD_SESSION]
+    if cold:
+        rehydrate_sessions({events[index][0] for index in cold})
+        retried = _run_record_batch([events[index] for index in cold], window, check_cold=False)
+        for index, result in zip(cold, retried):
+            results[index] = result
+
+    return [
+        None if interactions is None else [Event.from_json(interaction) for interaction in interactions]
+        for interactions in results
+    ]
+
+
+def cache_user_profiles(profiles, recommendations=None):
+    """
+    Caches several session profiles, and optionally their recommendations,
+    in a single round trip.
+    """
+    # MULTI/EXEC so readers never see a profile between its delete and rewrite
+    pipe = redis_conn.pipeline()
+    for session_id, score_data in profiles.items():
+        _queue_profile_write(pipe, get_profile_key(session_id), score_data)
+        _queue_touch(pipe, session_id, "profile")
+    for session_id, session_recommendations in (recommendations or {}).items():
+        pipe.set(
+            f"user:{session_id}:recommendations", json.dumps(session_recommendations)
+        )
+        _queue_touch(pipe, session_id, "recommendations")
+    pipe.execute()
+
+
+# Drops a session's keys and marks it as spilled, unless it was active after the
+# cutoff, in which case the sweeper lost the race with a new event and the session
+# stays in Redis
+SPILL_SESSION_SCRIPT = """
+local last_seen = redis.call("ZSCORE", KEYS[1], ARGV[1])
+if last_seen and tonumber(last_seen) > tonumber(ARGV[2]) then
+    return 0
+end
+for i = 3, #KEYS do
+    redis.call("DEL", KEYS[i])
+end
+redis.call("ZREM", KEYS[1], ARGV[1])
+redis.call("SADD", KEYS[2], ARGV[1])
+return 1
+"""
+
+spill_session_script = redis_conn.register_script(SPILL_SESSION_SCRIPT)
+
+
+def _read_session_states(session_ids):
+    """Reads the Redis state of the given sessions as JSON-serializable dicts."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for session_id in session_ids:
+        timestamp_key, interactions_key, profile_key, recommendations_key, order_key = (
+            get_session_keys(session_id)
+        )
+        pipe.get(timestamp_key)
+        pipe.lrange(interactions_key, 0, -1)
+        pipe.zrange(profile_key, 0, -1, withscores=True)
+        pipe.get(recommendations_key)
+        pipe.get(order_key)
+    results = pipe.execute(raise_on_error=False)
+
+    states = {}
+    for index, session_id in enumerate(session_ids):
+        timestamp, interactions, profile, recommendations, category_order = results[
+            index * 5 : index * 5 + 5
+        ]
+        if isinstance(profile, ResponseError):
+            # Legacy JSON profile blob
+            affinities = _migrate_profile_blob(get_profile_key(session_id)).get("affinities", [])
+            profile = [(str(affinity["id"]), affinity["score"]) for affinity in affinities]
+        state = {
+            "last_processed_timestamp": timestamp,
+            "recent_interactions": interactions,
+            "profile": profile,
+            "recommendations": recommendations,
+            "category_order": category_order,
+        }
+        if any(state.values()):
+            states[session_id] = state
+    return states
+
+
+def spill_idle_sessions(idle_seconds=SESSION_IDLE_SECONDS, batch_size=500):
+    """
+    Moves sessions without writes for idle_seconds from Redis to the cold store.
+    Returns the number of sessions spilled.
+    """
+    cutoff = time.time() - idle_seconds
+    spilled = 0
+    while True:
+        session_ids = redis_conn.zrangebyscore(LAST_SEEN_KEY, "-inf", cutoff, start=0, num=batch_size)
+        if not session_ids:
+            return spilled
+
+        # Written to the cold store first, so a crash in between loses nothing
+        cold_store.save_many(_read_session_states(session_ids))
+        pipe = redis_conn.pipeline(transaction=False)
+        for session_id in session_ids:
+            spill_session_script(
+                keys=[LAST_SEEN_KEY, SPILLED_KEY, *get_session_keys(session_id)],
+                args=[session_id, cutoff],
+                client=pipe,
+            )
+        results = pipe.execute()
+
+        # Sessions that became active meanwhile keep their Redis state
+        cold_store.delete_many(
+            session_id for session_id, removed in zip(session_ids, results) if not removed
+        )
+        spilled += sum(results)
+
+
+def _queue_session_restore(pipe, session_id, state):
+    timestamp_key, interactions_key, profile_key, recommendations_key, order_key = (
+        get_session_keys(session_id)
+    )
+    if state["last_processed_timestamp"] is not None:
+        pipe.set(timestamp_key, state["last_processed_timestamp"])
+    if state["recent_interactions"]:
+        pipe.rpush(interactions_key, *state["recent_interactions"])
+    if state["profile"]:
+        pipe.zadd(profile_key, dict(state["profile"]))
+    if state["recommendations"] is not None:
+        pipe.set(recommendations_key, state["recommendations"])
+    if state["category_order"] is not None:
+        pipe.set(order_key, state["category_order"])
+    _queue_touch(pipe, session_id, *SESSION_KEY_SUFFIXES)
+
+
+def rehydrate_sessions(session_ids):
+    """
+    Restores spilled sessions from the cold store into Redis, unless they were
+    started again in Redis meanwhile. Returns the ids of the sessions found.
+    Only sessions marked as spilled are looked up, so unknown and brand new
+    sessions cost one Redis round trip rather than a cold store query.
+    """
+    session_ids = list(
+        dict.fromkeys(str(session_id) for session_id in session_ids if session_id is not None)
+    )
+    pipe = redis_conn.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.sismember(SPILLED_KEY, session_id)
+    spilled = [session_id for session_id, marked in zip(session_ids, pipe.execute()) if marked]
+    if not spilled:
+        return set()
+
+    states = cold_store.load_many(spilled)
+    for session_id, state in states.items():
+        session_keys = get_session_keys(session_id)
+        with redis_conn.pipeline() as pipe:
+            try:
+                pipe.watch(*session_keys)
+                if pipe.exists(*session_keys):
+                    continue  # Newer state already in Redis, the cold copy is outdated
+                pipe.multi()
+                _queue_session_restore(pipe, session_id, state)
+                pipe.execute()
+            except WatchError:
+                pass  # A concurrent write or rehydration got there first
+    cold_store.delete_many(states)
+    redis_conn.srem(SPILLED_KEY, *spilled)
+    return set(states)
+
+
+def mark_spilled_sessions(batch_size=10000):
+    """
+    Marks every session in the cold store as spilled, for stores written before
+    the marker existed or after Redis lost its data. Returns the number marked.
+    """
+    marked = 0
+    for session_ids in cold_store.iter_session_ids(batch_size):
+        redis_conn.sadd(SPILLED_KEY, *session_ids)
+        marked += len(session_ids)
+    return marked
+
+
+def get_session_memory_stats(idle_seconds=SESSION_IDLE_SECONDS):
+    """Reports how many sessions are hot, idle and cold, and Redis memory use."""
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.zcard(LAST_SEEN_KEY)
+    pipe.zcount(LAST_SEEN_KEY, "-inf", time.time() - idle_seconds)
+    hot_sessions, idle_sessions = pipe.execute()
+    memory = redis_conn.info("memory")
+    used_memory = memory.get("used_memory", 0)
+    max_memory = memory.get("maxmemory", 0)
+    return {
+        "hot_sessions": hot_sessions,
+        "idle_sessions": idle_sessions,
+        "cold_sessions": cold_store.count(),
+        "used_memory_bytes": used_memory,
+        "maxmemory_bytes": max_memory,
+        "memory_budget_used": used_memory / max_memory if max_memory else None,
+        "bytes_per_hot_session": used_memory // hot_sessions if hot_sessions else 0,
+    }
@@ -0,0 +1,149 @@
+import heapq
+from collections import OrderedDict, deque
+
+# Rebase the stored sums before decay powers underflow
+MAX_REBASE_DISTANCE = 256
+
+
+def get_event_key(event):
+    return (
+        event.get("timestamp"),
+        event.get("event_type"),
+        event.get("product_id"),
+        event.get("category_id"),
+    )
+
+
+class SessionScoreState:
+    """
+    Decayed scores of one session's event window. Event j (counted from the first
+    event ever added) contributes with weight decay ** (j - oldest), so the oldest
+    event in the window weighs 1, as in RecommendationEngine.process_event_batch.
+    Sums are stored relative to a base index so sliding the window is O(actions).
+    """
+
+    __slots__ = ("events", "sums", "counts", "base", "oldest", "next_index")
+
+    def __init__(self):
+        self.events = deque()  # (index, event key, [(action, reward * prob), ...])
+        self.sums = {}  # action -> sum of decay ** (index - base) * reward * prob
+        self.counts = {}  # action -> occurrences in the window's candidate lists
+        self.base = 0
+        self.oldest = 0
+        self.next_index = 0
+
+    def event_keys(self):
+        """Keys of the events in the window, newest first."""
+        return [key for _, key, _ in reversed(self.events)]
+
+    def add(self, event_key, contributions, decay):
+        index = self.next_index
+        weight = decay ** (index - self.base)
+        for action, value in contributions:
+            self.sums[action] = self.sums.get(action, 0) + value * weight
+            self.counts[action] = self.counts.get(action, 0) + 1
+        self.events.append((index, event_key, contributions))
+        self.next_index += 1
+
+    def evict_oldest(self, decay):
+        index, _, contributions = self.events.popleft()
+        weight = decay ** (index - self.base)
+        for action, value in contributions:
+            count = self.counts[action] - 1
+            if count:
+                self.counts[action] = count
+                self.sums[action] -= value * weight
+            else:
+                del self.counts[action]
+                del self.sums[action]
+        self.oldest = self.events[0][0] if self.events else self.next_index
+        if self.oldest - self.base > MAX_REBASE_DISTANCE:
+            self.rebase(decay)
+
+    def rebase(self, decay):
+        scale = decay ** (self.oldest - self.base)
+        self.sums = {action: value / scale for action, value in self.sums.items()}
+        self.base = self.oldest
+
+    def get_scores(self, decay, profile_data=None):
+        """Returns normalized scores, matching process_event_batch for the same window."""
+        total_weight = 0
+        weight = 1.0
+        for _ in self.events:
+            total_weight += weight
+            weight *= decay
+
+        # Emit actions in order of first appearance, oldest event first, so ties
+        # rank exactly as they do in process_event_batch
+        scale = decay ** (self.base - self.oldest)
+        scores = {}
+        for _, _, contributions in self.events:
+            for action, _ in contributions:
+                if action in scores:
+                    continue
+                score = self.sums[action] * scale
+                if profile_data:
+                    score += profile_data.get(str(action), 0) * self.counts[action]
+                scores[action] = score / total_weight
+        return scores
+
+
+class DecayedSessionScorer:
+    """
+    Keeps per-session decayed score state so each new event costs one prediction
+    instead of re-predicting the whole window. The state is checked against the
+    window read from Redis and rebuilt from it whenever they disagree, e.g. after
+    a restart or when another consumer handled some of the session's events.
+    """
+
+    def __init__(self, engine, window=10, decay=0.9, max_sessions=100000):
+        self.engine = engine
+        self.window = window
+        self.decay = decay
+        self.max_sessions = max_sessions
+        self._states = OrderedDict()
+
+    def _get_contributions(self, event, profile_data=None):
+        context = self.engine.get_context(event, profile_data)
+        actions = self.engine.get_possible_actions(event, profile_data)
+        reward = self.engine.get_reward(event["event_type"])
+        pmf = self.engine.predict_actions(context, actions)
+        return [(action, reward * prob) for action, prob in zip(actions, pmf)]
+
+    def _push(self, state, event, profile_data):
+        state.add(get_event_key(event), self._get_contributions(event, profile_data), self.decay)
+        if len(state.events) > self.window:
+            state.evict_oldest(self.decay)
+
+    def score(self, session_id, recent_events, profile_data=None):
+        """
+        Scores a session given its recent events, newest first as returned by
+        get_recent_interactions. Returns (score_data, top 10 recommendations).
+        """
+        recent_events = recent_events[: self.window]
+        state = self._states.get(session_id)
+
+        # Incremental only if the state holds exactly the window minus its newest event
+        previous_keys = [get_event_key(event) for event in recent_events[1:]]
+        if (
+            state is not None
+            and recent_events
+            and len(previous_keys) == min(len(state.events), self.window - 1)
+            and state.event_keys()[: len(previous_keys)] == previous_keys
+        ):
+            self._states.move_to_end(session_id)
+            self._push(state, recent_events[0], profile_data)
+        else:
+            state = SessionScoreState()
+            for event in reversed(recent_events):
+                self._push(state, event, profile_data)
+            self._states[session_id] = state
+            if len(self._states) > self.max_sessions:
+                self._states.popitem(last=False)
+
+        score_data = state.get_scores(self.decay, profile_data)
+        recommendations = heapq.nlargest(10, score_data, key=score_data.get)
+        return score_data, recommendations
+
+    def forget(self, session_id):
+        self._states.pop(session_id, None)
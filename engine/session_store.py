@@ -0,0 +1,84 @@
+import json
+import time
+
+from utils.db_client import get_db_connection
+
+SESSION_STORE_PATH = "db/session_state.db"
+
+
+class ColdSessionStore:
+    """
+    SQLite file holding the state of sessions spilled out of Redis, one JSON row
+    per session. Rows are written when a session goes idle and removed when it
+    is rehydrated into Redis.
+    """
+
+    def __init__(self, db_path=SESSION_STORE_PATH):
+        self.db_path = db_path
+        self._ready = False
+
+    def _ensure_schema(self, conn):
+        if not self._ready:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_state (
+                    session_id TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    spilled_at REAL NOT NULL
+                ) WITHOUT ROWID
+                """
+            )
+            self._ready = True
+
+    def save_many(self, states):
+        """Stores {session_id: state} in one transaction, replacing older copies."""
+        if not states:
+            return
+        spilled_at = time.time()
+        with get_db_connection(self.db_path) as conn, conn:
+            self._ensure_schema(conn)
+            conn.executemany(
+                "INSERT OR REPLACE INTO session_state (session_id, state, spilled_at) VALUES (?, ?, ?)",
+                [(session_id, json.dumps(state), spilled_at) for session_id, state in states.items()],
+            )
+
+    def load_many(self, session_ids):
+        """Returns {session_id: state} for the given sessions that have been spilled."""
+        session_ids = list(session_ids)
+        if not session_ids:
+            return {}
+        placeholders = ", ".join(["?"] * len(session_ids))
+        with get_db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            rows = conn.execute(
+                f"SELECT session_id, state FROM session_state WHERE session_id IN ({placeholders})",
+                session_ids,
+            ).fetchall()
+        return {row["session_id"]: json.loads(row["state"]) for row in rows}
+
+    def delete_many(self, session_ids):
+        session_ids = list(session_ids)
+        if not session_ids:
+            return
+        with get_db_connection(self.db_path) as conn, conn:
+            self._ensure_schema(conn)
+            conn.executemany(
+                "DELETE FROM session_state WHERE session_id = ?",
+                [(session_id,) for session_id in session_ids],
+            )
+
+    def iter_session_ids(self, batch_size=10000):
+        """Yields the ids of the spilled sessions, batch_size at a time."""
+        with get_db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            cursor = conn.execute("SELECT session_id FROM session_state")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield [row["session_id"] for row in rows]
+
+    def count(self):
+        with get_db_connection(self.db_path) as conn:
+            self._ensure_schema(conn)
+            return conn.execute("SELECT COUNT(*) FROM session_state").fetchone()[0]
@@ -0,0 +1,287 @@
+import time
+import zlib
+
+import numpy as np
+
+from db.search_index import TOKEN_PATTERN
+from engine import snapshots
+
+SIMILAR_PRODUCTS_DIR = "db/similar_products"
+SNAPSHOT_PREFIX = "similar"
+
+# Hashed feature space, large enough that unrelated title words rarely collide
+N_FEATURES = 1 << 20
+# The category counts as this many title words
+CATEGORY_WEIGHT = 2
+# Words in more than this share of titles, or more than MAX_POSTINGS titles ("for",
+# "with", ...), carry almost no signal but have the longest posting lists, which
+# bound the cost of a query, so they are left out
+MAX_DOCUMENT_FREQUENCY = 0.1
+MAX_POSTINGS = 20000
+TOP_K = 20
+# Cells of the dense queries x products score block of the blocked search (32MB)
+BLOCK_CELLS = 1 << 22
+
+
+def hash_feature(token):
+    # crc32 rather than hash(), which is salted per process
+    return zlib.crc32(token.encode("utf-8")) % N_FEATURES
+
+
+def tokenize(title, category_id):
+    tokens = TOKEN_PATTERN.findall((title or "").lower())
+    if category_id is not None:
+        tokens.extend([f"__category_{category_id}"] * CATEGORY_WEIGHT)
+    return tokens
+
+
+def build_tfidf(products, max_document_frequency=MAX_DOCUMENT_FREQUENCY, max_postings=MAX_POSTINGS):
+    """
+    Builds L2 normalized hashed TF-IDF vectors from (id, title, category_id) rows.
+    Returns (rows, postings): rows is an id-indexed CSR matrix (indptr, features,
+    weights) and postings the same matrix by feature (indptr, products, weights).
+    """
+    feature_ids = {}
+    row_ids, row_features = [], []
+    category_features = set()
+    for product_id, title, category_id in products:
+        for token in tokenize(title, category_id):
+            feature = feature_ids.get(token)
+            if feature is None:
+                feature = feature_ids[token] = hash_feature(token)
+                if token.startswith("__category_"):
+                    category_features.add(feature)
+            row_ids.append(product_id)
+            row_features.append(feature)
+
+    size = max(row_ids, default=-1) + 1
+    documents = len({product_id for product_id, _, _ in products}) or 1
+    keys, counts = np.unique(
+        (np.asarray(row_ids, dtype=np.int64) << 32) | np.asarray(row_features, dtype=np.int64),
+        return_counts=True,
+    )
+    rows, features = keys >> 32, keys & 0xFFFFFFFF
+
+    # Drop overly common words, but never the category, shared by a whole category
+    document_frequency = np.bincount(features, minlength=N_FEATURES)
+    common = document_frequency > max(min(max_document_frequency * documents, max_postings), 1)
+    if category_features:
+        common[np.fromiter(category_features, dtype=np.int64)] = False
+    keep = ~common[features]
+    rows, features, counts = rows[keep], features[keep], counts[keep]
+
+    idf = np.log((1 + documents) / (1 + document_frequency)) + 1
+    weights = (1 + np.log(counts)) * idf[features]
+    norms = np.sqrt(np.bincount(rows, weights=weights**2, minlength=size))
+    weights = (weights / norms[rows]).astype(np.float32)
+
+    # Keys were sorted by (row, feature), so rows are already in CSR order
+    row_indptr = np.r_[0, np.cumsum(np.bincount(rows, minlength=size))]
+    order = np.argsort(features, kind="stable")
+    posting_indptr = np.r_[0, np.cumsum(np.bincount(features, minlength=N_FEATURES))]
+    return (
+        (row_indptr, features.astype(np.int32), weights),
+        (posting_indptr, rows[order].astype(np.int32), weights[order]),
+    )
+
+
+def gather_ranges(starts, ends):
+    """Positions of the concatenated ranges [start, end), one per element."""
+    lengths = ends - starts
+    offsets = np.repeat(starts - np.r_[0, np.cumsum(lengths)[:-1]], lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class SimilarityMatrix:
+    """Cosine similarity search over the TF-IDF rows, through the postings of each query's features."""
+
+    def __init__(self, row_indptr, row_features, row_weights, posting_indptr, posting_products, posting_weights):
+        self.row_indptr = row_indptr
+        self.row_features = row_features
+        self.row_weights = row_weights
+        self.posting_indptr = posting_indptr
+        self.posting_products = posting_products
+        self.posting_weights = posting_weights
+
+    def __len__(self):
+        return len(self.row_indptr) - 1
+
+    def _query_entries(self, product_ids):
+        """(query index, product, partial dot product) entries for the given query rows."""
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        positions = gather_ranges(self.row_indptr[product_ids], self.row_indptr[product_ids + 1])
+        queries = np.repeat(
+            np.arange(len(product_ids)), np.diff(self.row_indptr)[product_ids]
+        )
+        features = self.row_features[positions]
+        starts, ends = self.posting_indptr[features], self.posting_indptr[features + 1]
+        postings = gather_ranges(starts, ends)
+        lengths = ends - starts
+        return (
+            np.repeat(queries, lengths),
+            self.posting_products[postings],
+            self.posting_weights[postings] * np.repeat(self.row_weights[positions], lengths),
+        )
+
+    def top_k(self, product_id, k=TOP_K):
+        """Returns (product ids, scores) of the k most similar products, best first."""
+        if not 0 <= product_id < len(self):
+            return [], []
+        _, products, partials = self._query_entries([product_id])
+        candidates, inverse = np.unique(products, return_inverse=True)
+        scores = np.bincount(inverse.ravel(), weights=partials)
+        scores[candidates == product_id] = 0
+        if len(scores) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.lexsort((candidates[best], -scores[best]))]
+        best = best[scores[best] > 0]
+        return candidates[best].tolist(), scores[best].tolist()
+
+    def top_k_blocked(self, product_ids, k=TOP_K, block_cells=BLOCK_CELLS):
+        """
+        Top k neighbours of many products. Queries are scored a block at a time
+        into a dense block x products score matrix, sized to stay within block_cells.
+        Returns (neighbors, scores) arrays, padded with -1 and 0.
+        """
+        product_ids = np.asarray(product_ids, dtype=np.int64)
+        neighbors = np.full((len(product_ids), k), -1, dtype=np.int32)
+        scores = np.zeros((len(product_ids), k), dtype=np.float32)
+        size = len(self)
+        block_size = max(1, block_cells // max(size, 1))
+
+        for block_start in range(0, len(product_ids), block_size):
+            block = product_ids[block_start : block_start + block_size]
+            queries, products, partials = self._query_entries(block)
+            block_scores = np.bincount(
+                queries * size + products, weights=partials, minlength=len(block) * size
+            ).reshape(len(block), size)
+            block_scores[np.arange(len(block)), block] = 0  # Not similar to itself
+
+            kth = min(k, size) - 1
+            if kth < 0:
+                continue
+            best = np.argpartition(-block_scores, kth, axis=1)[:, : kth + 1]
+            best_scores = np.take_along_axis(block_scores, best, axis=1)
+            order = np.lexsort((best, -best_scores), axis=1)
+            best = np.take_along_axis(best, order, axis=1)
+            best_scores = np.take_along_axis(best_scores, order, axis=1)
+
+            rows = slice(block_start, block_start + len(block))
+            found = best_scores > 0
+            neighbors[rows, : kth + 1] = np.where(found, best, -1)
+            scores[rows, : kth + 1] = np.where(found, best_scores, 0)
+        return neighbors, scores
+
+
+def build_similar_products(products, popular_ids, directory=SIMILAR_PRODUCTS_DIR, top_k=TOP_K, keep=3):
+    """
+    Builds the TF-IDF index of (id, title, category_id) rows, precomputes the
+    neighbours of popular_ids with the blocked search and writes a snapshot.
+    """
+    started = time.monotonic()
+    (row_indptr, row_features, row_weights), (posting_indptr, posting_products, posting_weights) = (
+        build_tfidf(products)
+    )
+    matrix = SimilarityMatrix(
+        row_indptr, row_features, row_weights, posting_indptr, posting_products, posting_weights
+    )
+    precomputed_ids = np.unique(
+        np.asarray([product_id for product_id in popular_ids if 0 <= product_id < len(matrix)], dtype=np.int64)
+    )
+    neighbors, scores = matrix.top_k_blocked(precomputed_ids, top_k)
+    path = snapshots.write_snapshot(
+        directory,
+        SNAPSHOT_PREFIX,
+        {
+            "row_indptr": row_indptr,
+            "row_features": row_features,
+            "row_weights": row_weights,
+            "posting_indptr": posting_indptr,
+            "posting_products": posting_products,
+            "posting_weights": posting_weights,
+            "precomputed_ids": precomputed_ids,
+            "precomputed_neighbors": neighbors,
+            "precomputed_scores": scores,
+        },
+        {"products": len(products), "precomputed": len(precomputed_ids), "top_k": top_k},
+        keep,
+    )
+    print(
+        f"Indexed {len(products)} products, precomputed {len(precomputed_ids)} "
+        f"in {time.monotonic() - started:.1f}s: {path}"
+    )
+    return path
+
+
+class SimilarProductsSnapshot:
+    """Immutable view of one similar products snapshot, None for its path when empty."""
+
+    def __init__(
+        self,
+        matrix=None,
+        precomputed_ids=None,
+        precomputed_neighbors=None,
+        precomputed_scores=None,
+        path=None,
+    ):
+        self.matrix = matrix
+        self.precomputed_ids = np.zeros(0, dtype=np.int64) if precomputed_ids is None else precomputed_ids
+        self.precomputed_neighbors = precomputed_neighbors
+        self.precomputed_scores = precomputed_scores
+        self.path = path
+
+    def get_similar(self, product_id, limit=10):
+        """Returns ([(product id, score), ...], source) for a product, best first."""
+        if self.matrix is None:
+            return [], None
+        position = np.searchsorted(self.precomputed_ids, product_id)
+        if (
+            position < len(self.precomputed_ids)
+            and self.precomputed_ids[position] == product_id
+            and limit <= self.precomputed_neighbors.shape[1]
+        ):
+            neighbors = self.precomputed_neighbors[position, :limit]
+            scores = self.precomputed_scores[position, :limit]
+            found = neighbors >= 0
+            return list(zip(neighbors[found].tolist(), scores[found].tolist())), "precomputed"
+        neighbors, scores = self.matrix.top_k(product_id, limit)
+        return list(zip(neighbors, scores)), "computed"
+
+
+class SimilarProductsIndex(snapshots.SnapshotReader):
+    """
+    Memory maps the newest similar products snapshot. Precomputed products are a
+    binary search and a row read; any other product is scored on the fly through
+    the postings of its title words.
+    """
+
+    ARRAYS = (
+        "row_indptr",
+        "row_features",
+        "row_weights",
+        "posting_indptr",
+        "posting_products",
+        "posting_weights",
+        "precomputed_ids",
+        "precomputed_neighbors",
+        "precomputed_scores",
+    )
+
+    def __init__(self, directory=SIMILAR_PRODUCTS_DIR, refresh_interval=300):
+        super().__init__(directory, SNAPSHOT_PREFIX, refresh_interval, SimilarProductsSnapshot())
+
+    def open_snapshot(self, path):
+        arrays, _ = snapshots.load_snapshot(path, self.ARRAYS)
+        return SimilarProductsSnapshot(
+            SimilarityMatrix(*(arrays[name] for name in self.ARRAYS[:6])),
+            arrays["precomputed_ids"],
+            arrays["precomputed_neighbors"],
+            arrays["precomputed_scores"],
+            path,
+        )
+
+    def get_similar(self, product_id, limit=10):
+        """Returns ([(product id, score), ...], source) for a product, best first."""
+        return self.snapshot.get_similar(product_id, limit)
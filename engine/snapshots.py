@@ -0,0 +1,94 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+def list_snapshots(directory, prefix):
+    """Returns snapshot directories, oldest first."""
+    return sorted(glob.glob(os.path.join(directory, f"{prefix}-*")))
+
+
+def write_snapshot(directory, prefix, arrays, meta, keep=3):
+    """
+    Writes arrays as .npy files plus a meta.json to a new snapshot directory and
+    returns its path. The snapshot is assembled in a temporary directory and
+    renamed into place, so readers never map a partially written one.
+    """
+    os.makedirs(directory, exist_ok=True)
+    # Zero padded milliseconds keep lexical and chronological order identical
+    path = os.path.join(directory, f"{prefix}-{int(time.time() * 1000):015d}-{os.getpid()}")
+    tmp_path = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    try:
+        for name, values in arrays.items():
+            np.save(os.path.join(tmp_path, f"{name}.npy"), values)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.rename(tmp_path, path)
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+    # Processes still mapping a pruned snapshot keep their pages until they reload
+    for old_path in list_snapshots(directory, prefix)[:-keep]:
+        shutil.rmtree(old_path, ignore_errors=True)
+    return path
+
+
+def load_snapshot(path, names, mmap_mode="r"):
+    """Returns ({name: array}, meta) of a snapshot, memory mapped read-only by default."""
+    with open(os.path.join(path, "meta.json")) as meta_file:
+        meta = json.load(meta_file)
+    arrays = {
+        name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode) for name in names
+    }
+    return arrays, meta
+
+
+class SnapshotReader:
+    """
+    Maps the newest snapshot of a directory and switches to newer ones as they are
+    written, checking at most once per refresh_interval. Subclasses implement
+    open_snapshot(path), returning the object readers use, which is swapped in with
+    a single assignment: readers take .snapshot once per lookup and never mix two
+    snapshots. A lock keeps concurrent refreshes from mapping the same one twice.
+    """
+
+    def __init__(self, directory, prefix, refresh_interval=300, empty=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.refresh_interval = refresh_interval
+        self.snapshot = empty
+        self.path = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def open_snapshot(self, path):
+        raise NotImplementedError
+
+    def latest(self):
+        """Path of the newest snapshot, None before the first one is written."""
+        paths = list_snapshots(self.directory, self.prefix)
+        return paths[-1] if paths else None
+
+    def load(self):
+        with self._lock:
+            path = self.latest()
+            if path is not None and path != self.path:
+                try:
+                    self.snapshot = self.open_snapshot(path)
+                    self.path = path
+                except (OSError, ValueError) as error:
+                    # Pruned between listing and mapping, keep the current one
+                    print(f"Failed to map {self.prefix} snapshot {path}: {error}")
+            self._checked_at = time.monotonic()
+        return self
+
+    def maybe_refresh(self):
+        if time.monotonic() - self._checked_at >= self.refresh_interval:
+            self.load()
+        return self
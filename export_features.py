@@ -0,0 +1,46 @@
+# export_features.py
+import argparse
+import time
+
+from db.catalog import get_catalog_version
+from engine.feature_store import FEATURE_DIR, export_features, list_snapshots
+from utils.db_client import DB_PATH, get_db_connection
+
+
+def export_on_change(db_path=DB_PATH, directory=FEATURE_DIR, interval=None, keep=3):
+    """
+    Exports the product feature snapshot, then with an interval keeps exporting a
+    new one whenever the catalog version changes. Readers pick new snapshots up
+    on their next refresh.
+    """
+    exported_version = None
+    while True:
+        with get_db_connection(db_path) as conn:
+            version = get_catalog_version(conn)
+        if version != exported_version or not list_snapshots(directory):
+            started = time.monotonic()
+            path = export_features(db_path, directory, keep)
+            exported_version = version
+            print(
+                f"Exported features of catalog version {version} to {path} "
+                f"in {time.monotonic() - started:.2f}s"
+            )
+        if interval is None:
+            return
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Export product ranking features to memory mappable arrays."
+    )
+    parser.add_argument("--db", default=DB_PATH, help="Catalog database")
+    parser.add_argument("--output", default=FEATURE_DIR, help="Snapshot directory")
+    parser.add_argument("--keep", type=int, default=3, help="Snapshots kept on disk")
+    parser.add_argument(
+        "--interval",
+        type=int,
+        help="Keep running, checking for catalog changes every this many seconds",
+    )
+    args = parser.parse_args()
+    export_on_change(args.db, args.output, args.interval, args.keep)
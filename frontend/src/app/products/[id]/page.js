@@ -26,8 +26,12 @@ export default function ProductPage({ params }) {
         });
       }
 
-      // Fetch related products from the same category
-      if (productData?.category_id) {
+      // Fetch products with similar titles, falling back to the best rated
+      // products of the same category when the similarity index has none
+      const similar = await fetchFromAPI(`/products/${productId}/similar?limit=4`);
+      if (similar?.products?.length) {
+        setRelatedProducts(similar.products);
+      } else if (productData?.category_id) {
         const related = await fetchFromAPI(
           `/products?category=${productData.category_id}&limit=4&sort_by=stars&order=desc`
         );
@@ -1,71 +1,303 @@
 # kafka_cb_process_events.py
-import json
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+import zlib
+from collections import Counter
 from datetime import datetime
 
 from kafka import KafkaConsumer
 
 from engine.cb_engine import RecommendationEngine
 from engine.redis_engine import (
-    cache_user_profile,
-    cache_recent_interactions,
-    get_recent_interactions,
-    cache_last_processed_timestamp,
-    get_last_processed_timestamp,
+    cache_user_profiles,
+    get_profile_scores_batch,
+    record_interactions_batch,
+)
+from utils.events import decode_event
+from utils.metrics import (
+    CONSUMER_LAG,
+    EVENTS,
+    MULTIPROCESS,
+    PROFILE_FRESHNESS,
+    REDIS_RECORD_LATENCY,
+    REDIS_WRITE_LATENCY,
+    get_event_age,
+    start_metrics_server,
 )
 
+# Outcomes counted per worker
+STATS = ("processed", "skipped", "feedback", "invalid", "errors")
+# Maximum number of events handled per Redis round trip
+BATCH_SIZE = 100
 
-def process_events_with_cb():
-    # Initialize Kafka consumer
-    consumer = KafkaConsumer(
+
+def create_consumer():
+    return KafkaConsumer(
         "user_interactions",
         bootstrap_servers="localhost:9092",
         auto_offset_reset="earliest",
         enable_auto_commit=True,
         group_id="cb_processing_group",
-        value_deserializer=lambda x: json.loads(x.decode("utf-8")),
+        value_deserializer=decode_event,
     )
 
-    # Initialize Recommendation Engine
-    recommendation_engine = RecommendationEngine()
 
-    # Process events from Kafka using Contextual Bandit and cache in Redis
-    for message in consumer:
-        event = message.value
-        session_id = event.get("session_id")
-        event_timestamp = datetime.strptime(
-            event.get("timestamp").replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f"
+def process_events(recommendation_engine, events):
+    """
+    Runs a batch of events through the Contextual Bandit and caches the results.
+    Redis is hit twice per batch: one pipelined script call that dedups every
+    event and updates its session window, and one pipelined profile write.
+    Events are the decoded Events from the consumer, None for malformed messages.
+    """
+    # Batch boundaries are the safe points to change or snapshot the model
+    recommendation_engine.maybe_swap_model()
+
+    valid_events = [event for event in events if event is not None]
+    now = datetime.utcnow()
+    for event in valid_events:
+        CONSUMER_LAG.observe(get_event_age(event, now))
+
+    with REDIS_RECORD_LATENCY.time():
+        recent_windows = iter(
+            record_interactions_batch(
+                [(event.session_id, event, "feedback" not in event) for event in valid_events]
+            )
         )
 
-        # Retrieve the last processed timestamp for this session
-        last_processed_timestamp = get_last_processed_timestamp(session_id)
+    # Feedback is learned against the session's current profile, read up front in
+    # one round trip for the sessions that sent any
+    feedback_sessions = {event.session_id for event in valid_events if "feedback" in event}
+    stored_profiles = get_profile_scores_batch(feedback_sessions) if feedback_sessions else {}
 
-        # Check if the event is new
-        if last_processed_timestamp and event_timestamp <= datetime.strptime(
-            last_processed_timestamp.replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f"
-        ):
-            continue  # Skip this event as it's already processed
+    outcomes, profiles, recommendations_by_session, processed_events = [], {}, {}, []
+    for event in events:
+        if event is None:
+            outcomes.append("invalid")
+            continue
+        session_id = event.session_id
+        recent_events = next(recent_windows)
+
+        # Skip this event as it's already processed
+        if recent_events is None:
+            outcomes.append("skipped")
+            continue
 
         # If event contains feedback, process it immediately
         if "feedback" in event:
-            recommendation_engine.process_feedback(event)
-            cache_last_processed_timestamp(session_id, event.get("timestamp"))
-            continue  # Skip further processing for feedback events
-
-        # Cache the recent interaction and last processed timestamp
-        cache_recent_interactions(session_id, event)
-        cache_last_processed_timestamp(session_id, event.get("timestamp"))
-
-        # Process only new events for recommendations
-        recent_events = get_recent_interactions(session_id)
-        score_data, recommendations = recommendation_engine.process_event_batch(
-            recent_events
+            if session_id in profiles:
+                # Scored earlier in this batch, newer than what Redis holds
+                profile_data = {str(action): score for action, score in profiles[session_id].items()}
+            else:
+                profile_data = stored_profiles.get(session_id)
+            recommendation_engine.process_feedback(event, profile_data)
+            outcomes.append("feedback")
+            continue
+
+        score_data, recommendations = recommendation_engine.process_session_event(
+            session_id, recent_events
         )
+        profiles[session_id] = score_data
+        recommendations_by_session[session_id] = recommendations
+        processed_events.append(event)
+        print(f"Processed new recommendations for session {session_id}.")
+        outcomes.append("processed")
 
-        # Cache the updated profile score in Redis
-        cache_user_profile(session_id, score_data)
+    # Cache the updated profile scores and recommendations in Redis
+    if profiles:
+        with REDIS_WRITE_LATENCY.time():
+            cache_user_profiles(profiles, recommendations_by_session)
+        # End to end freshness: tracked event to updated profile readable in Redis
+        now = datetime.utcnow()
+        for event in processed_events:
+            PROFILE_FRESHNESS.observe(get_event_age(event, now))
+
+    for outcome, count in Counter(outcomes).items():
+        EVENTS.labels("cb", outcome).inc(count)
+
+    recommendation_engine.maybe_checkpoint()
+    return outcomes
+
+
+def process_event(recommendation_engine, event):
+    """Runs one event through the Contextual Bandit and caches the result in Redis."""
+    return process_events(recommendation_engine, [event])[0]
+
+
+def get_worker_index(session_id, workers):
+    """Maps a session to a fixed worker so its events are always handled in order."""
+    return zlib.crc32(str(session_id).encode("utf-8")) % workers
+
+
+def run_worker(events, stats, engine_options):
+    # Each worker owns its engine, VW workspaces are not safe to share
+    recommendation_engine = RecommendationEngine(**engine_options)
+    if threading.current_thread() is threading.main_thread():
+        # Worker processes reload their candidate index on SIGHUP
+        recommendation_engine.candidate_index.install_refresh_signal()
+    stopping = False
+    while not stopping:
+        # Take whatever is already queued so Redis calls are pipelined across events
+        batch = [events.get()]
+        while len(batch) < BATCH_SIZE:
+            try:
+                batch.append(events.get_nowait())
+            except queue.Empty:
+                break
+        if None in batch:
+            stopping = True
+            batch = [event for event in batch if event is not None]
+        if not batch:
+            continue
+
+        try:
+            outcomes = process_events(recommendation_engine, batch)
+        except Exception as error:
+            print(f"Failed to process a batch of {len(batch)} events: {error}")
+            outcomes = ["errors"] * len(batch)
+            EVENTS.labels("cb", "errors").inc(len(batch))
+        with stats.get_lock():
+            for outcome in outcomes:
+                stats[STATS.index(outcome)] += 1
+
+    # Keep what was learned since the last periodic snapshot
+    if recommendation_engine.updates_since_checkpoint:
+        recommendation_engine.checkpoint()
 
-        print(f"Processed new recommendations for session {session_id}.")
+
+def print_worker_stats(worker_stats):
+    for index, stats in enumerate(worker_stats):
+        counts = ", ".join(f"{name}={stats[i]}" for i, name in enumerate(STATS))
+        print(f"Worker {index}: {counts}")
+
+
+def process_events_with_cb(
+    workers=1,
+    mode="process",
+    queue_size=1000,
+    stats_interval=30,
+    checkpoint_interval=300,
+    reload_interval=None,
+    metrics_port=9102,
+):
+    """
+    Consumes events and updates profiles. With more than one worker, events are
+    sharded by session_id across worker processes (or threads), which preserves
+    per-session ordering while different sessions are processed in parallel.
+    """
+    if metrics_port:
+        if workers > 1 and mode == "process" and not MULTIPROCESS:
+            print("Set PROMETHEUS_MULTIPROC_DIR to export metrics from worker processes")
+        start_metrics_server(metrics_port)
+
+    # Initialize Kafka consumer
+    consumer = create_consumer()
+    engine_options = {
+        "checkpoint_interval": checkpoint_interval,
+        "reload_interval": reload_interval,
+    }
+
+    if workers <= 1:
+        # Initialize Recommendation Engine, SIGHUP reloads its candidate index
+        recommendation_engine = RecommendationEngine(**engine_options)
+        recommendation_engine.candidate_index.install_refresh_signal()
+
+        # Process events from Kafka using Contextual Bandit and cache in Redis
+        try:
+            while True:
+                records = consumer.poll(timeout_ms=1000, max_records=BATCH_SIZE)
+                for messages in records.values():
+                    process_events(
+                        recommendation_engine, [message.value for message in messages]
+                    )
+        finally:
+            if recommendation_engine.updates_since_checkpoint:
+                recommendation_engine.checkpoint()
+
+    if mode == "thread":
+        queue_class, worker_class = queue.Queue, threading.Thread
+    else:
+        queue_class, worker_class = multiprocessing.Queue, multiprocessing.Process
+    worker_queues = [queue_class(maxsize=queue_size) for _ in range(workers)]
+    worker_stats = [multiprocessing.Array("q", len(STATS)) for _ in range(workers)]
+
+    worker_pool = [
+        worker_class(
+            target=run_worker,
+            args=(worker_queues[index], worker_stats[index], engine_options),
+            name=f"cb-worker-{index}",
+            daemon=True,
+        )
+        for index in range(workers)
+    ]
+    for worker in worker_pool:
+        worker.start()
+
+    last_report = time.monotonic()
+    try:
+        for message in consumer:
+            event = message.value
+            if event is None:
+                # None stops the workers, malformed messages are dropped here
+                print(f"Skipping malformed event at offset {message.offset}")
+                EVENTS.labels("cb", "invalid").inc()
+                continue
+            # Bounded queues make the consumer wait when a worker falls behind
+            worker_queues[get_worker_index(event.session_id, workers)].put(event)
+
+            if time.monotonic() - last_report >= stats_interval:
+                print_worker_stats(worker_stats)
+                last_report = time.monotonic()
+    finally:
+        for worker_queue in worker_queues:
+            worker_queue.put(None)
+        for worker in worker_pool:
+            worker.join()
+        print_worker_stats(worker_stats)
 
 
 if __name__ == "__main__":
-    process_events_with_cb()
+    parser = argparse.ArgumentParser(description="Process tracking events with the CB engine.")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parallel workers")
+    parser.add_argument(
+        "--mode",
+        choices=("process", "thread"),
+        default="process",
+        help="Run workers as processes or threads",
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=1000, help="Pending events allowed per worker"
+    )
+    parser.add_argument(
+        "--stats-interval", type=int, default=30, help="Seconds between worker stats reports"
+    )
+    parser.add_argument(
+        "--checkpoint-interval",
+        type=int,
+        default=300,
+        help="Seconds between model snapshots, 0 disables them",
+    )
+    parser.add_argument(
+        "--reload-interval",
+        type=int,
+        default=None,
+        help="Seconds between checks for newer model snapshots to hot-swap in",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=9102,
+        help="Port of the Prometheus metrics endpoint, 0 disables it",
+    )
+    args = parser.parse_args()
+    process_events_with_cb(
+        args.workers,
+        args.mode,
+        args.queue_size,
+        args.stats_interval,
+        args.checkpoint_interval,
+        args.reload_interval,
+        args.metrics_port,
+    )
@@ -1,21 +1,141 @@
 # kafka_consumer.py
-import json
+import argparse
+import time
 import uuid
+from collections import defaultdict
 from datetime import datetime
 
+from cassandra import InvalidRequest
 from cassandra.cluster import Cluster
+from cassandra.concurrent import execute_concurrent
+from cassandra.query import BatchStatement, BatchType
 from kafka import KafkaConsumer
+from kafka.structs import OffsetAndMetadata
 
+from utils.events import decode_event
+from utils.metrics import (
+    CASSANDRA_WRITE_LATENCY,
+    CONSUMER_LAG,
+    EVENTS,
+    get_event_age,
+    start_metrics_server,
+)
 
-def consume_events():
-    # Initialize Kafka consumer
+# Maximum number of Cassandra writes in flight at once
+WRITE_CONCURRENCY = 64
+MAX_POLL_RECORDS = 500
+# Rows per unlogged batch, well under Cassandra's batch_size_fail_threshold
+MAX_BATCH_ROWS = 20
+MAX_WRITE_ATTEMPTS = 3
+RETRY_BACKOFF_SECONDS = 0.5
+# user_events columns, in build_event_row order. feedback is what replay trains on;
+# tables created before it was archived need ALTER TABLE user_events ADD feedback text
+EVENT_COLUMNS = (
+    "session_id",
+    "event_type",
+    "product_id",
+    "category_id",
+    "search_query",
+    "timestamp",
+    "additional_context",
+    "feedback",
+)
+
+
+def build_event_row(event):
+    """Converts a tracking event into the parameters of the user_events insert."""
+    return (
+        uuid.UUID(event.get("session_id")),
+        event.get("event_type"),
+        str(event.get("product_id")),
+        str(event.get("category_id")),
+        event.get("search_query"),
+        event.time,
+        event.get("additional_context", {}),
+        event.get("feedback"),
+    )
+
+
+def group_rows_by_session(rows, max_batch_rows=MAX_BATCH_ROWS):
+    """
+    Groups rows sharing a session (the partition key) into lists of at most
+    max_batch_rows, each written as one unlogged batch, which Cassandra applies as
+    a single mutation on one replica set.
+    """
+    rows_by_session = defaultdict(list)
+    for row in rows:
+        rows_by_session[row[0]].append(row)
+
+    return [
+        session_rows[start : start + max_batch_rows]
+        for session_rows in rows_by_session.values()
+        for start in range(0, len(session_rows), max_batch_rows)
+    ]
+
+
+def build_statement(insert_query, rows):
+    """(statement, parameters) writing rows of one session."""
+    if len(rows) == 1:
+        return insert_query, rows[0]
+    batch = BatchStatement(batch_type=BatchType.UNLOGGED)
+    for row in rows:
+        batch.add(insert_query, row)
+    return batch, None
+
+
+def write_rows(session, insert_query, rows, concurrency=WRITE_CONCURRENCY):
+    """
+    Writes rows with bounded concurrent async executes, retrying failed statements.
+    Rows Cassandra rejects as invalid would fail on every redelivery, so they are
+    logged and dropped instead. Returns (written, dropped): written is True only
+    once every other row has been acknowledged by Cassandra.
+    """
+    pending = group_rows_by_session(rows)
+    attempts = dropped = 0
+    while pending:
+        results = execute_concurrent(
+            session,
+            [build_statement(insert_query, group) for group in pending],
+            concurrency=concurrency,
+            raise_on_first_error=False,
+        )
+        retry, failed = [], 0
+        for group, (success, result) in zip(pending, results):
+            if success:
+                continue
+            if not isinstance(result, InvalidRequest):
+                retry.append(group)
+                failed += 1
+            elif len(group) > 1:
+                # Write the rows of a rejected batch one by one to find the bad ones
+                retry.extend([row] for row in group)
+            else:
+                print(f"Dropping event rejected by Cassandra: {result}: {group[0]}")
+                dropped += 1
+        pending = retry
+
+        if failed:
+            attempts += 1
+            if attempts >= MAX_WRITE_ATTEMPTS:
+                return False, dropped
+            print(f"{failed} Cassandra writes failed, retrying (attempt {attempts})")
+            time.sleep(RETRY_BACKOFF_SECONDS * attempts)
+    return True, dropped
+
+
+def consume_events(metrics_port=9101):
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    # Initialize Kafka consumer, offsets are committed only after Cassandra acknowledges
     consumer = KafkaConsumer(
         "user_interactions",
         bootstrap_servers="localhost:9092",
         auto_offset_reset="earliest",
-        enable_auto_commit=True,
+        enable_auto_commit=False,
+        max_poll_records=MAX_POLL_RECORDS,
         group_id="personalization_group",
-        value_deserializer=lambda x: json.loads(x.decode("utf-8")),
+        value_deserializer=decode_event,
     )
 
     # Connect to Cassandra
@@ -23,42 +143,75 @@ def consume_events():
     session = cluster.connect("personalization")
 
     # Prepare the insert statement for Cassandra
+    table = cluster.metadata.keyspaces["personalization"].tables["user_events"]
+    archive_feedback = "feedback" in table.columns
+    if not archive_feedback:
+        print(
+            "user_events has no feedback column, feedback is not archived and replays "
+            "from Cassandra cannot train: ALTER TABLE user_events ADD feedback text"
+        )
+    columns = EVENT_COLUMNS if archive_feedback else EVENT_COLUMNS[:-1]
     insert_query = session.prepare(
-        """
-        INSERT INTO user_events (session_id, event_type, product_id, category_id, search_query, timestamp, additional_context)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """
+        f"INSERT INTO user_events ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
     )
 
-    # Process events from Kafka and store them in Cassandra
-    for message in consumer:
-        event = message.value
-        session_id = event.get("session_id")
-        event_type = event.get("event_type")
-        product_id = str(event.get("product_id"))
-        category_id = str(event.get("category_id"))
-        search_query = event.get("search_query")
-        timestamp = datetime.strptime(
-            event.get("timestamp").replace("Z", ""), "%Y-%m-%dT%H:%M:%S.%f"
-        )
-        additional_context = event.get("additional_context", {})
-
-        # Insert into Cassandra
-        session.execute(
-            insert_query,
-            (
-                uuid.UUID(session_id),
-                event_type,
-                product_id,
-                category_id,
-                search_query,
-                timestamp,
-                additional_context,
-            ),
-        )
+    # Process events from Kafka and store them in Cassandra, one poll batch at a time
+    while True:
+        records = consumer.poll(timeout_ms=1000)
+        if not records:
+            continue
 
-        print(f"Stored event for session {session_id}: {event_type} at {timestamp}")
+        rows = []
+        now = datetime.utcnow()
+        for messages in records.values():
+            for message in messages:
+                if message.value is None:
+                    print(f"Skipping malformed event at offset {message.offset}")
+                    EVENTS.labels("archive", "invalid").inc()
+                    continue
+                try:
+                    rows.append(build_event_row(message.value))
+                except (AttributeError, TypeError, ValueError) as error:
+                    # A malformed event would otherwise block the partition forever
+                    print(f"Skipping malformed event at offset {message.offset}: {error}")
+                    EVENTS.labels("archive", "invalid").inc()
+                    continue
+                CONSUMER_LAG.observe(get_event_age(message.value, now))
+
+        if not archive_feedback:
+            rows = [row[:-1] for row in rows]
+
+        written, dropped = True, 0
+        if rows:
+            with CASSANDRA_WRITE_LATENCY.time():
+                written, dropped = write_rows(session, insert_query, rows)
+        if dropped:
+            EVENTS.labels("archive", "dropped").inc(dropped)
+        if not written:
+            # Rewind so the whole batch is redelivered, keeping at-least-once delivery
+            for partition, messages in records.items():
+                consumer.seek(partition, messages[0].offset)
+            print("Cassandra writes failed, batch will be retried")
+            EVENTS.labels("archive", "errors").inc(len(rows) - dropped)
+            continue
+
+        consumer.commit(
+            {
+                partition: OffsetAndMetadata(messages[-1].offset + 1, None)
+                for partition, messages in records.items()
+            }
+        )
+        EVENTS.labels("archive", "stored").inc(len(rows) - dropped)
+        print(f"Stored {len(rows) - dropped} events from {len(records)} partitions")
 
 
 if __name__ == "__main__":
-    consume_events()
+    parser = argparse.ArgumentParser(description="Archive tracking events to Cassandra.")
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=9101,
+        help="Port of the Prometheus metrics endpoint, 0 disables it",
+    )
+    args = parser.parse_args()
+    consume_events(args.metrics_port)
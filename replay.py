@@ -0,0 +1,308 @@
+# replay.py
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+from collections import Counter, deque
+
+from engine.cb_engine import VW_ARGS, WEIGHT_DECAY, WINDOW_SIZE, RecommendationEngine
+from engine.model_store import MODEL_DIR, ModelStore
+from engine.redis_engine import cache_user_profiles
+from kafka_cb_process_events import get_worker_index
+from utils.event_sources import add_source_arguments, decode, open_source
+from utils.events import EventValidationError
+
+# Events handed to a worker per queue put, amortizes the pickling and IPC overhead
+CHUNK_SIZE = 1000
+# Rebuilt profiles written to Redis per pipelined round trip
+WRITE_BATCH_SIZE = 1000
+PROGRESS_INTERVAL = 5
+
+
+# Workers
+class SessionReplayer:
+    """
+    Replays sessions through a RecommendationEngine the way kafka_cb_process_events
+    does live: events in timestamp order, duplicates and stale events skipped,
+    feedback kept out of the window. Rebuilt profiles are written to Redis in
+    bulk, and feedback becomes labelled examples for the learner process.
+    """
+
+    def __init__(self, engine, examples, window, write_profiles, write_batch_size):
+        self.engine = engine
+        self.examples = examples
+        self.window = window
+        self.write_profiles = write_profiles
+        self.write_batch_size = write_batch_size
+        self.stats = Counter()
+        self._profiles = {}
+        self._recommendations = {}
+        self._pending_examples = []
+
+    def replay_session(self, session_id, events):
+        events.sort(key=lambda event: event.time)
+        window = deque(maxlen=self.window)  # Newest first, like the Redis window
+        last_time = score_data = recommendations = None
+
+        for event in events:
+            if last_time is not None and event.time <= last_time:
+                self.stats["skipped"] += 1
+                continue
+            last_time = event.time
+
+            if "feedback" in event:
+                self.stats["feedback"] += 1
+                profile_data = {str(action): score for action, score in (score_data or {}).items()}
+                example = self.engine.build_feedback_example(event, profile_data)
+                if example is not None:
+                    self._pending_examples.append(example)
+                continue
+
+            window.appendleft(event)
+            score_data, recommendations = self.engine.process_session_event(
+                session_id, list(window)
+            )
+            self.stats["processed"] += 1
+
+        self.engine.session_scorer.forget(session_id)
+        self.stats["sessions"] += 1
+        if score_data is not None:
+            self._profiles[session_id] = score_data
+            self._recommendations[session_id] = recommendations
+        if len(self._profiles) >= self.write_batch_size:
+            self.flush_profiles()
+        if len(self._pending_examples) >= CHUNK_SIZE:
+            self.flush_examples()
+
+    def flush_profiles(self):
+        if self._profiles and self.write_profiles:
+            cache_user_profiles(self._profiles, self._recommendations)
+            self.stats["profiles_written"] += len(self._profiles)
+        self._profiles, self._recommendations = {}, {}
+
+    def flush_examples(self):
+        if self._pending_examples and self.examples is not None:
+            self.examples.put(self._pending_examples)
+            self.stats["examples"] += len(self._pending_examples)
+        self._pending_examples = []
+
+
+def replay_worker(events, examples, results, options):
+    engine = RecommendationEngine(
+        window=options["window"],
+        weight_decay=options["decay"],
+        model_store=ModelStore(options["initial_model_dir"]),
+        checkpoint_interval=0,
+    )
+    replayer = SessionReplayer(
+        engine, examples, options["window"], options["write_profiles"], options["write_batch_size"]
+    )
+    sessions = {}
+
+    while True:
+        chunk = events.get()
+        if chunk is None:
+            break
+        for item in chunk:
+            try:
+                event = decode(item)
+                event.time
+            except (EventValidationError, ValueError):
+                replayer.stats["invalid"] += 1
+                continue
+            # Grouped input finishes a session as soon as the next one starts
+            if options["grouped"] and event.session_id not in sessions:
+                for session_id, session_events in sessions.items():
+                    replayer.replay_session(session_id, session_events)
+                sessions.clear()
+            sessions.setdefault(event.session_id, []).append(event)
+
+    for session_id, session_events in sessions.items():
+        replayer.replay_session(session_id, session_events)
+    replayer.flush_profiles()
+    replayer.flush_examples()
+    if examples is not None:
+        examples.put(None)
+    results.put(dict(replayer.stats))
+
+
+def train_model(examples, workers, initial_model, model_dir, results):
+    """Learns every feedback example the workers produce and saves one model snapshot."""
+    from vowpalwabbit import pyvw
+
+    args = VW_ARGS if initial_model is None else f"{VW_ARGS} --initial_regressor {initial_model}"
+    vw = pyvw.Workspace(args)
+    stats = Counter()
+    finished = 0
+    while finished < workers:
+        batch = examples.get()
+        if batch is None:
+            finished += 1
+            continue
+        for example in batch:
+            try:
+                vw.learn(example)
+                stats["learned"] += 1
+            except RuntimeError as error:
+                stats["learn_errors"] += 1
+                if stats["learn_errors"] == 1:
+                    print(f"Failed to learn from a feedback example: {error}")
+    stats["model"] = ModelStore(model_dir).save(vw) if stats["learned"] else None
+    vw.finish()
+    results.put(dict(stats))
+
+
+def replay(
+    source,
+    workers=None,
+    grouped=False,
+    window=WINDOW_SIZE,
+    decay=WEIGHT_DECAY,
+    write_profiles=True,
+    train=True,
+    model_dir=MODEL_DIR,
+    from_scratch=False,
+    write_batch_size=WRITE_BATCH_SIZE,
+):
+    """
+    Streams events from source into worker processes sharded by session, so
+    each session is replayed in order by one worker while sessions run in
+    parallel. Returns the combined worker stats and the learner's.
+    """
+    workers = workers or os.cpu_count() or 1
+    empty_model_dir = tempfile.mkdtemp(prefix="replay-model-") if from_scratch else None
+    initial_model_dir = empty_model_dir or model_dir
+    initial_model = ModelStore(initial_model_dir).latest()
+    print(f"Replaying with {workers} workers, starting from {initial_model or 'an empty model'}")
+
+    options = {
+        "window": window,
+        "decay": decay,
+        "grouped": grouped,
+        "write_profiles": write_profiles,
+        "write_batch_size": write_batch_size,
+        "initial_model_dir": initial_model_dir,
+    }
+    event_queues = [multiprocessing.Queue(maxsize=64) for _ in range(workers)]
+    examples = multiprocessing.Queue(maxsize=256) if train else None
+    results = multiprocessing.Queue()
+
+    processes = [
+        multiprocessing.Process(
+            target=replay_worker,
+            args=(event_queues[index], examples, results, options),
+            name=f"replay-worker-{index}",
+        )
+        for index in range(workers)
+    ]
+    if train:
+        processes.append(
+            multiprocessing.Process(
+                target=train_model,
+                args=(examples, workers, initial_model, model_dir, results),
+                name="replay-learner",
+            )
+        )
+    for process in processes:
+        process.start()
+
+    started = last_report = time.monotonic()
+    chunks = [[] for _ in range(workers)]
+    read = invalid = 0
+    for item in source:
+        read += 1
+        try:
+            session_id = decode(item).session_id
+        except EventValidationError:
+            invalid += 1
+            continue
+        index = get_worker_index(session_id, workers)
+        chunks[index].append(item)
+        if len(chunks[index]) >= CHUNK_SIZE:
+            event_queues[index].put(chunks[index])
+            chunks[index] = []
+
+        if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+            last_report = time.monotonic()
+            print(f"Read {read} events, {read / (last_report - started):.0f} events/s")
+
+    for index, chunk in enumerate(chunks):
+        if chunk:
+            event_queues[index].put(chunk)
+        event_queues[index].put(None)
+
+    stats = Counter(invalid=invalid)
+    learner_stats = {}
+    for _ in processes:
+        result = results.get()
+        if "learned" in result or "model" in result:
+            learner_stats = result
+        else:
+            stats.update(result)
+    for process in processes:
+        process.join()
+
+    if empty_model_dir is not None:
+        os.rmdir(empty_model_dir)
+    elapsed = time.monotonic() - started
+    print(
+        f"Replayed {read} events in {elapsed:.1f}s ({read / elapsed if elapsed else 0:.0f} events/s): "
+        + ", ".join(f"{name}={count}" for name, count in sorted(stats.items()))
+    )
+    if learner_stats:
+        print(
+            f"Learned {learner_stats.get('learned', 0)} feedback examples, "
+            f"model snapshot: {learner_stats.get('model')}"
+        )
+        if not learner_stats.get("model"):
+            print("No feedback events with a profile to learn from, no model snapshot was written")
+    return dict(stats), learner_stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Rebuild session profiles and retrain the CB model from historical events."
+    )
+    add_source_arguments(parser)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, defaults to CPUs")
+    parser.add_argument(
+        "--grouped",
+        action="store_true",
+        help="Events of a session are contiguous, lets workers finish sessions early "
+        "(implied for Cassandra)",
+    )
+    parser.add_argument("--window", type=int, default=WINDOW_SIZE, help="Events scored per session")
+    parser.add_argument("--decay", type=float, default=WEIGHT_DECAY, help="Weight decay between events")
+    parser.add_argument(
+        "--no-profiles", action="store_true", help="Do not write rebuilt profiles to Redis"
+    )
+    parser.add_argument("--no-train", action="store_true", help="Do not train a model snapshot")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="Where the model snapshot is saved")
+    parser.add_argument(
+        "--from-scratch",
+        action="store_true",
+        help="Start from an empty model instead of the latest snapshot",
+    )
+    parser.add_argument(
+        "--write-batch-size",
+        type=int,
+        default=WRITE_BATCH_SIZE,
+        help="Profiles written to Redis per round trip",
+    )
+    args = parser.parse_args()
+
+    events = open_source(parser, args, require_feedback=not args.no_train)
+
+    replay(
+        events,
+        workers=args.workers,
+        grouped=args.grouped or args.source == "cassandra",
+        window=args.window,
+        decay=args.decay,
+        write_profiles=not args.no_profiles,
+        train=not args.no_train,
+        model_dir=args.model_dir,
+        from_scratch=args.from_scratch,
+        write_batch_size=args.write_batch_size,
+    )
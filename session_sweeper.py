@@ -0,0 +1,52 @@
+# session_sweeper.py
+import argparse
+import time
+
+from engine.redis_engine import (
+    SESSION_IDLE_SECONDS,
+    get_session_memory_stats,
+    mark_spilled_sessions,
+    migrate_profile_blobs,
+    spill_idle_sessions,
+)
+
+
+def sweep_sessions(interval=60, idle_seconds=SESSION_IDLE_SECONDS, batch_size=500):
+    """
+    Periodically spills idle sessions from Redis to the cold store, keeping Redis
+    sized to the active sessions. Returning sessions are rehydrated on their next
+    event or read by engine.redis_engine.
+    """
+    # Sessions are only looked up in the cold store when Redis marks them as spilled
+    print(f"Marked {mark_spilled_sessions()} cold sessions as spilled")
+    # Profiles written before sorted set storage would otherwise convert on first read
+    print(f"Converted {migrate_profile_blobs(batch_size)} JSON profiles to sorted sets")
+    while True:
+        started = time.monotonic()
+        spilled = spill_idle_sessions(idle_seconds, batch_size)
+        stats = get_session_memory_stats(idle_seconds)
+        budget = stats["memory_budget_used"]
+        print(
+            f"Spilled {spilled} idle sessions in {time.monotonic() - started:.2f}s, "
+            f"hot={stats['hot_sessions']} cold={stats['cold_sessions']} "
+            f"used_memory={stats['used_memory_bytes']} "
+            f"budget={'n/a' if budget is None else f'{budget:.1%}'} "
+            f"bytes_per_session={stats['bytes_per_hot_session']}"
+        )
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spill idle sessions from Redis to the cold store.")
+    parser.add_argument("--interval", type=int, default=60, help="Seconds between sweeps")
+    parser.add_argument(
+        "--idle-seconds",
+        type=int,
+        default=SESSION_IDLE_SECONDS,
+        help="Seconds without activity after which a session is spilled",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=500, help="Sessions spilled per Redis round trip"
+    )
+    args = parser.parse_args()
+    sweep_sessions(args.interval, args.idle_seconds, args.batch_size)
@@ -0,0 +1,44 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.catalog import generate_catalog  # noqa: E402
+from benchmarks.fakes import install_fakes  # noqa: E402
+
+_workdir = None
+_previous_cwd = None
+
+
+def pytest_configure(config):
+    """
+    Runs the suite against the benchmark fakes and a small generated catalog. The
+    app and engine use paths relative to the working directory and connect to
+    Redis on import, so this has to happen before any test module imports them.
+    """
+    global _workdir, _previous_cwd
+    install_fakes()
+    _workdir = tempfile.mkdtemp(prefix="tests-")
+    os.makedirs(os.path.join(_workdir, "db"))
+    generate_catalog(os.path.join(_workdir, "db", "ecommerce.db"), products=500, categories=10)
+    _previous_cwd = os.getcwd()
+    os.chdir(_workdir)
+
+
+def pytest_unconfigure(config):
+    if _workdir is not None:
+        os.chdir(_previous_cwd)
+        shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def clean_redis():
+    from engine import redis_engine
+
+    redis_engine.redis_conn.flushall()
+    yield
@@ -0,0 +1,91 @@
+import uuid
+
+import pytest
+from cassandra import InvalidRequest, WriteTimeout
+
+import kafka_consumer
+from benchmarks.fakes import FakeResponseFuture
+from utils.events import validate_event
+
+SESSION = uuid.UUID(int=1)
+
+
+class FailingFuture:
+    def __init__(self, error):
+        self.error = error
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=(), **kwargs):
+        errback(self.error, *errback_args)
+
+    def clear_callbacks(self):
+        pass
+
+
+class RowsSession:
+    """
+    Session for statements built as plain row lists: rejects any containing a
+    poison row, and fails the first timeouts statements it sees.
+    """
+
+    def __init__(self, timeouts=0):
+        self.timeouts = timeouts
+        self.written = []
+
+    def execute_async(self, rows, parameters=None, *args, **kwargs):
+        if any(row[1] == "poison" for row in rows):
+            return FailingFuture(InvalidRequest("Invalid event"))
+        if self.timeouts:
+            self.timeouts -= 1
+            return FailingFuture(WriteTimeout("Timed out"))
+        self.written.extend(rows)
+        return FakeResponseFuture()
+
+
+@pytest.fixture(autouse=True)
+def row_statements(monkeypatch):
+    monkeypatch.setattr(kafka_consumer, "build_statement", lambda insert_query, rows: (rows, None))
+    monkeypatch.setattr(kafka_consumer, "RETRY_BACKOFF_SECONDS", 0)
+
+
+def make_rows(count, session_id=SESSION, event_type="view_product"):
+    return [(session_id, event_type, str(index)) for index in range(count)]
+
+
+def test_batches_are_capped_per_session():
+    other = uuid.UUID(int=2)
+    groups = kafka_consumer.group_rows_by_session(make_rows(45) + make_rows(3, other), 20)
+    assert [len(group) for group in groups] == [20, 20, 5, 3]
+    assert all(len({row[0] for row in group}) == 1 for group in groups)
+
+
+def test_invalid_rows_are_dropped_and_the_rest_written():
+    rows = make_rows(5) + make_rows(1, event_type="poison") + make_rows(5, uuid.UUID(int=2))
+    session = RowsSession()
+    assert kafka_consumer.write_rows(session, None, rows) == (True, 1)
+    assert sorted(session.written) == sorted(row for row in rows if row[1] != "poison")
+
+
+def test_transient_failures_are_retried():
+    session = RowsSession(timeouts=1)
+    assert kafka_consumer.write_rows(session, None, make_rows(5)) == (True, 0)
+    assert len(session.written) == 5
+
+
+def test_gives_up_after_repeated_transient_failures():
+    session = RowsSession(timeouts=kafka_consumer.MAX_WRITE_ATTEMPTS)
+    assert kafka_consumer.write_rows(session, None, make_rows(5)) == (False, 0)
+
+
+def test_rows_archive_feedback():
+    event = validate_event(
+        {
+            "session_id": str(SESSION),
+            "event_type": "view_product",
+            "product_id": 1,
+            "timestamp": "2024-01-01T09:00:00Z",
+            "feedback": "positive",
+        }
+    )
+    row = kafka_consumer.build_event_row(event)
+    assert len(row) == len(kafka_consumer.EVENT_COLUMNS)
+    assert dict(zip(kafka_consumer.EVENT_COLUMNS, row))["feedback"] == "positive"
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+import pytest
+
+from engine.batch_scorer import score_window, top_k
+
+
+def score_window_loop(action_lists, pmfs, rewards, weight_decay, profile_data=None):
+    """The dict loop process_event_batch used before scoring moved to NumPy."""
+    score_data = {}
+    total_weight = 0
+    weight = 1.0
+    for actions, pmf, reward in zip(action_lists, pmfs, rewards):
+        for action, prob in zip(actions, pmf):
+            profile_score = profile_data.get(str(action), 0) if profile_data else 0
+            score_data[action] = score_data.get(action, 0) + (reward * prob * weight) + profile_score
+        total_weight += weight
+        weight *= weight_decay
+    score_data = {k: v / total_weight for k, v in score_data.items()}
+    recommendations = sorted(score_data, key=score_data.get, reverse=True)
+    return score_data, recommendations[:10]
+
+
+def score_window_numpy(action_lists, pmfs, rewards, weight_decay, profile_data=None):
+    """What process_event_batch returns for the same window."""
+    actions, scores = score_window(action_lists, pmfs, rewards, weight_decay, profile_data)
+    return dict(zip(actions.tolist(), scores.tolist())), actions[top_k(scores, 10)].tolist()
+
+
+def make_window(rng, events, candidates, products, values):
+    action_lists = [rng.sample(range(products), candidates) for _ in range(events)]
+    pmfs = [[rng.choice(values) for _ in range(candidates)] for _ in range(events)]
+    rewards = [rng.choice((0.5, 0.25, 0.125)) for _ in range(events)]
+    profile_data = {str(product): rng.choice(values) for product in rng.sample(range(products), products // 4)}
+    return action_lists, pmfs, rewards, profile_data
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_scores_match_dict_loop(seed):
+    rng = random.Random(seed)
+    window = make_window(rng, rng.randint(1, 20), rng.randint(1, 30), 60, [rng.random() for _ in range(50)])
+    action_lists, pmfs, rewards, profile_data = window
+    for profile in (None, profile_data):
+        expected, _ = score_window_loop(action_lists, pmfs, rewards, 0.9, profile)
+        scores, recommendations = score_window_numpy(action_lists, pmfs, rewards, 0.9, profile)
+        assert list(scores) == list(expected)  # Same actions in first appearance order
+        assert scores == pytest.approx(expected, rel=1e-12)
+        assert len(recommendations) == min(10, len(expected))
+        assert sorted(expected.values(), reverse=True)[: len(recommendations)] == pytest.approx(
+            [scores[action] for action in recommendations], rel=1e-12
+        )
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_tie_order_matches_dict_loop(seed):
+    # Powers of two keep every sum exact, so both sides see the same ties
+    rng = random.Random(seed)
+    window = make_window(rng, rng.randint(1, 12), rng.randint(1, 20), 30, (0.0, 0.25, 0.5, 1.0))
+    action_lists, pmfs, rewards, profile_data = window
+    for profile in (None, profile_data):
+        assert score_window_numpy(action_lists, pmfs, rewards, 0.5, profile) == score_window_loop(
+            action_lists, pmfs, rewards, 0.5, profile
+        )
+
+
+def test_empty_window():
+    assert score_window_numpy([], [], [], 0.9) == ({}, [])
+    assert score_window_numpy([[]], [[]], [0.5], 0.9) == ({}, [])
+
+
+@pytest.mark.parametrize("k", [0, 1, 3, 10, 25])
+def test_top_k_matches_stable_sort(k):
+    scores = np.random.default_rng(k).integers(0, 4, size=20).astype(np.float64)
+    expected = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)[:k]
+    assert top_k(scores, k).tolist() == expected
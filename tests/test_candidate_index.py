@@ -0,0 +1,27 @@
+from engine.candidate_index import CandidateIndex
+from engine.feature_store import ProductFeatures, export_features
+from utils.db_client import DB_PATH
+
+
+def test_switches_to_features_exported_after_load(tmp_path):
+    index = CandidateIndex(features=ProductFeatures(str(tmp_path)), refresh_interval=0).load()
+    sqlite_snapshot = index._snapshot
+    assert sqlite_snapshot.features_path is None
+
+    path = export_features(DB_PATH, str(tmp_path))
+    index.maybe_refresh()
+    assert index._snapshot.features_path == path
+    assert index._snapshot.version == sqlite_snapshot.version
+
+    # Same catalog, so the candidates are the same whichever way they were built
+    assert index._snapshot.popular_products == sqlite_snapshot.popular_products
+    assert index._snapshot.category_products == sqlite_snapshot.category_products
+    assert index.get_category_id(1) == sqlite_snapshot.product_categories[1]
+
+
+def test_keeps_its_snapshot_while_nothing_changes(tmp_path):
+    export_features(DB_PATH, str(tmp_path))
+    index = CandidateIndex(features=ProductFeatures(str(tmp_path)), refresh_interval=0).load()
+    snapshot = index._snapshot
+    assert snapshot.features_path is not None
+    assert index.maybe_refresh()._snapshot is snapshot
@@ -0,0 +1,20 @@
+from utils.catalog_cache import CatalogCache
+from utils.db_client import execute_db, query_db
+
+
+def count_products():
+    return query_db("SELECT COUNT(*) AS count FROM products", one=True)["count"]
+
+
+def test_catalog_write_invalidates_without_a_hook():
+    import app  # noqa: F401  # adds the catalog version triggers
+
+    cache = CatalogCache(check_interval=0)
+    before = cache.get("count", count_products)
+    product_id = execute_db(
+        "INSERT INTO products (asin, title, category_id) VALUES ('CACHE-TEST', 'cache test', 1)"
+    )
+    try:
+        assert cache.get("count", count_products) == before + 1
+    finally:
+        execute_db("DELETE FROM products WHERE id = ?", (product_id,))
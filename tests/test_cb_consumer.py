@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from engine import redis_engine
+from engine.model_store import ModelStore
+from utils.events import format_timestamp, validate_event
+
+
+@pytest.fixture
+def engine(tmp_path):
+    from engine.cb_engine import RecommendationEngine
+
+    # Checkpoints after every batch that learned something
+    return RecommendationEngine(model_store=ModelStore(str(tmp_path)), checkpoint_interval=1e-9)
+
+
+def make_events(session_id, count, feedback=None):
+    start = datetime(2024, 1, 1, 9) + timedelta(minutes=1 if feedback else 0)
+    events = []
+    for index in range(count):
+        data = {
+            "session_id": session_id,
+            "event_type": "view_product",
+            "product_id": index + 1,
+            "category_id": 1,
+            "timestamp": format_timestamp(start + timedelta(seconds=index)),
+        }
+        if feedback:
+            data["feedback"] = feedback
+        events.append(validate_event(data))
+    return events
+
+
+def test_feedback_learns_from_profile_scored_in_the_same_batch(engine):
+    import kafka_cb_process_events
+
+    events = make_events("session-1", 3) + make_events("session-1", 1, feedback="positive")
+    outcomes = kafka_cb_process_events.process_events(engine, events)
+    assert outcomes == ["processed"] * 3 + ["feedback"]
+    assert len(engine.model_store.list_snapshots()) == 1
+
+
+def test_feedback_learns_from_profile_stored_in_redis(engine):
+    import kafka_cb_process_events
+
+    kafka_cb_process_events.process_events(engine, make_events("session-1", 3))
+    assert redis_engine.get_profile_scores_batch(["session-1"])["session-1"]
+    assert engine.model_store.list_snapshots() == []
+
+    outcomes = kafka_cb_process_events.process_events(
+        engine, make_events("session-1", 1, feedback="negative")
+    )
+    assert outcomes == ["feedback"]
+    assert len(engine.model_store.list_snapshots()) == 1
+
+
+def test_feedback_without_profile_is_not_learned(engine):
+    import kafka_cb_process_events
+
+    outcomes = kafka_cb_process_events.process_events(
+        engine, make_events("session-2", 1, feedback="positive")
+    )
+    assert outcomes == ["feedback"]
+    assert engine.updates_since_checkpoint == 0
+    assert engine.model_store.list_snapshots() == []
+
+
+def test_duplicate_chosen_product_is_labelled_once(engine):
+    context = {"session_id": "session-1", "time_of_day": 9, "device": "mobile"}
+    example = engine.format_vw_example(context, [1, 2, 1], chosen_action=1, reward=1.0)
+    assert [line.startswith("0:") for line in example.splitlines()[1:]] == [True, False, False]
+    engine.vw.learn(example)
+
+
+def test_feedback_on_a_duplicate_candidate_is_learned(engine, monkeypatch):
+    import kafka_cb_process_events
+
+    monkeypatch.setattr(
+        engine, "get_possible_actions", lambda event, profile_data=None, limit=10: [1, 2, 1, 3]
+    )
+    events = make_events("session-1", 3) + make_events("session-1", 1, feedback="positive")
+    assert kafka_cb_process_events.process_events(engine, events)[-1] == "feedback"
+    assert len(engine.model_store.list_snapshots()) == 1
+
+
+def test_learn_errors_do_not_fail_the_batch(engine, monkeypatch):
+    import kafka_cb_process_events
+
+    def learn(example):
+        raise RuntimeError("badly formatted example")
+
+    monkeypatch.setattr(engine.vw, "learn", learn)
+    events = make_events("session-1", 3) + make_events("session-1", 1, feedback="positive")
+    assert kafka_cb_process_events.process_events(engine, events) == ["processed"] * 3 + ["feedback"]
+    assert engine.model_store.list_snapshots() == []
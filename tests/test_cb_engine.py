@@ -0,0 +1,49 @@
+import pytest
+
+from engine.cooccurrence import CooccurrenceBuilder, CooccurrenceIndex
+
+
+@pytest.fixture(scope="module")
+def engine(tmp_path_factory):
+    from engine.cb_engine import RecommendationEngine
+
+    # Related products shared with the best rated ones, so every source overlaps
+    directory = str(tmp_path_factory.mktemp("cooccurrence"))
+    builder = CooccurrenceBuilder()
+    for session_id in range(50):
+        for product_id in (session_id % 25 + 1, session_id % 25 + 2, session_id % 25 + 3):
+            builder.add_event(session_id, "view_product", product_id)
+    builder.save(directory)
+    return RecommendationEngine(
+        checkpoint_interval=0, cooccurrence_index=CooccurrenceIndex(directory).load()
+    )
+
+
+def make_event(product_id, event_type="view_product", category_id=None):
+    return {
+        "session_id": "session-1",
+        "event_type": event_type,
+        "product_id": product_id,
+        "category_id": category_id,
+        "timestamp": "2024-01-01T09:00:00.000000Z",
+    }
+
+
+@pytest.mark.parametrize("limit", [1, 4, 10, 30])
+def test_candidates_are_distinct_and_fill_the_limit(engine, limit):
+    popular = set(engine.candidate_index.get_popular_products(100))
+    for product_id in range(1, 201):
+        event = make_event(product_id)
+        actions = engine.get_possible_actions(event, limit=limit)
+        assert len(actions) == len(set(actions)) == limit
+
+        category_id = engine.candidate_index.get_category_id(product_id)
+        sources = popular | set(engine.candidate_index.get_category_products(category_id, 100))
+        sources |= set(engine.get_session_candidates([event], limit))
+        assert set(actions) <= sources
+
+
+def test_click_category_candidates_are_distinct(engine):
+    for category_id in range(1, 11):
+        actions = engine.get_possible_actions(make_event(None, "click_category", category_id))
+        assert len(actions) == len(set(actions)) == 10
@@ -0,0 +1,87 @@
+import math
+import random
+from collections import defaultdict
+
+import pytest
+
+from engine.cooccurrence import CooccurrenceBuilder, CooccurrenceIndex
+
+EVENT_TYPES = ("view_product", "view_product", "add_to_cart", "purchase")
+
+
+def make_sessions(seed, count=200, products=60):
+    rng = random.Random(seed)
+    return [
+        [(rng.choice(EVENT_TYPES), rng.randrange(products)) for _ in range(rng.randint(1, 8))]
+        for _ in range(count)
+    ]
+
+
+def build_index(sessions, directory, top_k=5, min_weight=1.0):
+    builder = CooccurrenceBuilder()
+    for session_id, events in enumerate(sessions):
+        for event_type, product_id in events:
+            builder.add_event(session_id, event_type, product_id)
+    builder.save(str(directory), top_k, min_weight)
+    return CooccurrenceIndex(str(directory)).load()
+
+
+def reference_neighbors(sessions, top_k, min_weight=1.0):
+    """Cosine neighbours computed pair by pair from the sessions."""
+    weights = {"view_product": 1.0, "add_to_cart": 3.0, "purchase": 5.0}
+    item_weights, pair_weights = defaultdict(float), defaultdict(float)
+    for events in sessions:
+        items = {}
+        for event_type, product_id in events:
+            items[product_id] = max(items.get(product_id, 0), weights[event_type])
+        for product_id, weight in items.items():
+            item_weights[product_id] += weight
+        for first in items:
+            for second in items:
+                if first < second:
+                    pair_weights[first, second] += min(items[first], items[second])
+
+    neighbors = defaultdict(list)
+    for (first, second), weight in pair_weights.items():
+        if weight < min_weight:
+            continue
+        similarity = weight / math.sqrt(item_weights[first] * item_weights[second])
+        neighbors[first].append((-similarity, second))
+        neighbors[second].append((-similarity, first))
+    return {product_id: sorted(scored)[:top_k] for product_id, scored in neighbors.items()}
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_neighbors_match_pairwise_counts(tmp_path, seed):
+    sessions = make_sessions(seed)
+    index = build_index(sessions, tmp_path, top_k=5, min_weight=2.0)
+    expected = reference_neighbors(sessions, 5, min_weight=2.0)
+    for product_id in range(len(index.snapshot)):
+        scored = expected.get(product_id, [])
+        assert index.get_neighbors(product_id) == [neighbor for _, neighbor in scored]
+        start, end = index.snapshot.indptr[product_id], index.snapshot.indptr[product_id + 1]
+        assert index.snapshot.scores[start:end].tolist() == pytest.approx([-score for score, _ in scored], rel=1e-6)
+    assert index.get_neighbors(product_id, limit=2) == [neighbor for _, neighbor in scored][:2]
+
+
+def test_candidates_rank_decayed_neighbour_scores(tmp_path):
+    sessions = make_sessions(0)
+    index = build_index(sessions, tmp_path, top_k=5)
+    expected = reference_neighbors(sessions, 5)
+
+    recent = [3, 7, 11]
+    totals = defaultdict(float)
+    for position, product_id in enumerate(recent):
+        for score, neighbor in expected.get(product_id, []):
+            if neighbor not in recent:
+                totals[neighbor] += -score * 0.9**position
+    ranked = sorted(totals, key=lambda neighbor: (-totals[neighbor], neighbor))
+    assert index.get_candidates(recent, limit=10, decay=0.9) == ranked[:10]
+
+
+def test_unknown_products_have_no_neighbors(tmp_path):
+    index = build_index([[("view_product", 1), ("view_product", 2)]], tmp_path)
+    assert index.get_neighbors(1) == [2]
+    assert index.get_neighbors(5) == []
+    assert index.get_candidates([5, None]) == []
+    assert CooccurrenceIndex(str(tmp_path / "missing")).load().get_candidates([1]) == []
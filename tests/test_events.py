@@ -0,0 +1,48 @@
+import pytest
+
+from engine import redis_engine
+from utils.events import EventValidationError, validate_event
+
+
+def make_event(timestamp, product_id=1):
+    return {
+        "session_id": "session-1",
+        "event_type": "view_product",
+        "product_id": product_id,
+        "timestamp": timestamp,
+    }
+
+
+@pytest.mark.parametrize(
+    "timestamp, expected",
+    [
+        ("2024-01-01T00:00:01.5Z", "2024-01-01T00:00:01.500000Z"),
+        ("2024-01-01T00:00:01Z", "2024-01-01T00:00:01.000000Z"),
+        ("2024-01-01T00:00:02+01:00", "2023-12-31T23:00:02.000000Z"),
+        ("2024-01-01T00:30:00.25-02:30", "2024-01-01T03:00:00.250000Z"),
+        ("2024-01-01T00:00:01.123456789", "2024-01-01T00:00:01.123456Z"),
+    ],
+)
+def test_validate_event_canonicalizes_timestamps(timestamp, expected):
+    event = validate_event(make_event(timestamp))
+    assert event.timestamp == expected
+    assert event.to_dict()["timestamp"] == expected
+
+
+def test_validate_event_rejects_invalid_timestamps():
+    with pytest.raises(EventValidationError, match="Invalid timestamp"):
+        validate_event(make_event("yesterday"))
+
+
+def test_offset_timestamps_are_ordered_in_utc():
+    first = validate_event(make_event("2024-01-01T00:00:01.5Z", product_id=1))
+    assert redis_engine.record_interaction("session-1", first) is not None
+
+    # 23:00:02 UTC the day before, older than the event already processed
+    stale = validate_event(make_event("2024-01-01T00:00:02+01:00", product_id=2))
+    assert redis_engine.record_interaction("session-1", stale) is None
+
+    # 00:00:01.6 UTC, newer despite sorting before the first event as text
+    newer = validate_event(make_event("2024-01-01T01:00:01.6+01:00", product_id=3))
+    interactions = redis_engine.record_interaction("session-1", newer)
+    assert [event.product_id for event in interactions] == [3, 1]
@@ -0,0 +1,46 @@
+import pytest
+
+from utils.pagination import parse_page_args
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def test_parse_page_args_defaults():
+    assert parse_page_args({}) == (10, 0)
+    assert parse_page_args({"limit": "5", "skip": "20"}) == (5, 20)
+
+
+@pytest.mark.parametrize(
+    "args, message",
+    [
+        ({"limit": "abc"}, "limit must be an integer"),
+        ({"limit": "0"}, "limit must be at least 1"),
+        ({"limit": "-1"}, "limit must be at least 1"),
+        ({"skip": "x"}, "skip must be an integer"),
+        ({"skip": "-5"}, "skip must be at least 0"),
+    ],
+)
+def test_parse_page_args_names_the_bad_parameter(args, message):
+    with pytest.raises(ValueError, match=message):
+        parse_page_args(args)
+
+
+@pytest.mark.parametrize(
+    "path", ["/api/products", "/api/products/search?q=product", "/api/products/category/any"]
+)
+def test_non_integer_limit_is_not_reported_as_a_cursor(client, path):
+    separator = "&" if "?" in path else "?"
+    response = client.get(f"{path}{separator}limit=abc")
+    assert response.status_code == 400
+    assert response.json["error"] == "limit must be an integer"
+
+
+def test_malformed_cursor_is_still_reported(client):
+    response = client.get("/api/products?cursor=not-a-cursor")
+    assert response.status_code == 400
+    assert response.json["error"] == "Invalid cursor"
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def test_limit_trims_popular_fallback(client):
+    response = client.get("/api/recommendations?session_id=new-session&limit=3")
+    assert response.status_code == 200
+    assert response.json["source"] == "popular"
+    assert len(response.json["products"]) == 3
+
+
+@pytest.mark.parametrize("limit", ["0", "-3", "abc", "2.5"])
+def test_invalid_limit_is_rejected(client, limit):
+    response = client.get(f"/api/recommendations?session_id=new-session&limit={limit}")
+    assert response.status_code == 400
+    assert "limit" in response.json["error"]
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils.events import format_timestamp
+
+EVENT_TYPES = ("view_product", "view_product", "click_category", "add_to_cart", "purchase")
+
+
+@pytest.fixture(scope="module")
+def engine():
+    from engine.cb_engine import RecommendationEngine
+
+    engine = RecommendationEngine(checkpoint_interval=0)
+    # Real candidates are shuffled, which would give the two scorers different
+    # candidate lists for the same event
+    engine.get_possible_actions = lambda event, profile_data=None, limit=10: [
+        (event["product_id"] * 7 + offset * 3) % 40 + 1 for offset in range(limit)
+    ]
+    return engine
+
+
+def make_events(count, session_id="session-1"):
+    start = datetime(2024, 1, 1, 9)
+    return [
+        {
+            "session_id": session_id,
+            "event_type": EVENT_TYPES[index % len(EVENT_TYPES)],
+            "product_id": (index * 11) % 40 + 1,
+            "category_id": index % 5 + 1,
+            "timestamp": format_timestamp(start + timedelta(seconds=index)),
+            "additional_context": {"device_type": "mobile"},
+        }
+        for index in range(count)
+    ]
+
+
+def assert_same_scores(incremental, batch):
+    (incremental_scores, incremental_top), (batch_scores, batch_top) = incremental, batch
+    assert list(incremental_scores) == list(batch_scores)
+    assert incremental_scores == pytest.approx(batch_scores, rel=1e-9)
+    # Near ties may swap places, but both must pick equally good recommendations
+    assert [incremental_scores[action] for action in incremental_top] == pytest.approx(
+        [batch_scores[action] for action in batch_top], rel=1e-9
+    )
+
+
+@pytest.mark.parametrize("profile_data", [None, {"3": 0.5, "8": 0.25, "21": 1.0}])
+def test_incremental_scores_match_batch(engine, profile_data):
+    events = make_events(40)
+    window = engine.session_scorer.window
+    engine.session_scorer.forget("session-1")
+    for count in range(1, len(events) + 1):
+        # Newest first, as read back from Redis
+        recent_events = events[max(0, count - window) : count][::-1]
+        assert_same_scores(
+            engine.process_session_event("session-1", recent_events, profile_data),
+            engine.process_event_batch(recent_events, profile_data, engine.session_scorer.decay),
+        )
+
+
+def test_rebuilds_state_when_window_skips_events(engine):
+    events = make_events(30, "session-2")
+    window = engine.session_scorer.window
+    engine.session_scorer.forget("session-2")
+    # Another consumer handled events 10 to 14, so the state no longer matches
+    for count in list(range(1, 10)) + list(range(15, 31)):
+        recent_events = events[max(0, count - window) : count][::-1]
+        assert_same_scores(
+            engine.process_session_event("session-2", recent_events),
+            engine.process_event_batch(recent_events, None, engine.session_scorer.decay),
+        )
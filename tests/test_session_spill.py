@@ -0,0 +1,52 @@
+from utils.events import validate_event
+
+from engine import redis_engine
+
+
+def record_view(session_id, timestamp="2024-01-01T09:00:00Z"):
+    event = validate_event(
+        {"session_id": session_id, "event_type": "view_product", "product_id": 1, "timestamp": timestamp}
+    )
+    return redis_engine.record_interaction(session_id, event)
+
+
+def spill_all():
+    # A cutoff in the future makes every session idle
+    return redis_engine.spill_idle_sessions(idle_seconds=-60)
+
+
+def test_spilled_session_is_rehydrated_on_read():
+    record_view("spill-1")
+    assert spill_all() == 1
+    assert redis_engine.redis_conn.sismember(redis_engine.SPILLED_KEY, "spill-1")
+
+    interactions = redis_engine.get_recent_interactions("spill-1")
+    assert [event.product_id for event in interactions] == [1]
+    assert not redis_engine.redis_conn.sismember(redis_engine.SPILLED_KEY, "spill-1")
+    assert redis_engine.cold_store.load_many(["spill-1"]) == {}
+
+
+def test_spilled_session_keeps_dedup_state():
+    record_view("spill-2", "2024-01-01T09:00:01Z")
+    spill_all()
+    assert record_view("spill-2", "2024-01-01T09:00:00Z") is None
+
+
+def test_unknown_sessions_skip_the_cold_store(monkeypatch):
+    def load_many(session_ids):
+        raise AssertionError(f"Cold store queried for {list(session_ids)}")
+
+    monkeypatch.setattr(redis_engine.cold_store, "load_many", load_many)
+    assert redis_engine.get_recent_interactions("unknown") == []
+    assert redis_engine.get_user_profile_scores("unknown") == {}
+    assert [event.product_id for event in record_view("new-session")] == [1]
+
+
+def test_mark_spilled_sessions_restores_lost_markers():
+    record_view("spill-3")
+    spill_all()
+    redis_engine.redis_conn.delete(redis_engine.SPILLED_KEY)
+    assert redis_engine.get_recent_interactions("spill-3") == []
+
+    assert redis_engine.mark_spilled_sessions() >= 1
+    assert [event.product_id for event in redis_engine.get_recent_interactions("spill-3")] == [1]
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from engine.similar_products import SimilarProductsIndex, build_similar_products
+
+PRODUCTS = [
+    (0, "wireless noise cancelling headphones", 1),
+    (1, "wireless bluetooth headphones", 1),
+    (2, "wired studio headphones", 1),
+    (3, "stainless steel water bottle", 2),
+    (4, "insulated steel water bottle", 2),
+    (5, "glass water bottle", 2),
+]
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+def test_precomputed_and_computed_neighbours_agree(tmp_path):
+    build_similar_products(PRODUCTS, [0, 3], str(tmp_path), top_k=3)
+    index = SimilarProductsIndex(str(tmp_path)).load()
+
+    precomputed, source = index.get_similar(0, 3)
+    assert source == "precomputed"
+    computed, _ = index.snapshot.matrix.top_k(0, 3)
+    assert [product_id for product_id, _ in precomputed] == computed
+    assert {product_id for product_id, _ in precomputed} <= {1, 2}
+
+    similar, source = index.get_similar(4, 2)
+    assert source == "computed"
+    assert {product_id for product_id, _ in similar} == {3, 5}
+
+
+def test_reload_swaps_the_whole_snapshot(tmp_path):
+    build_similar_products(PRODUCTS, [0], str(tmp_path), top_k=3)
+    index = SimilarProductsIndex(str(tmp_path)).load()
+    first = index.snapshot
+
+    time.sleep(0.01)  # Snapshot names have millisecond resolution
+    build_similar_products(PRODUCTS, [0, 3], str(tmp_path), top_k=3)
+    index.load()
+    assert index.snapshot is not first
+    assert index.path == index.snapshot.path != first.path
+    # Readers holding the old snapshot keep a consistent set of arrays
+    assert first.precomputed_ids.tolist() == [0]
+    assert index.snapshot.precomputed_ids.tolist() == [0, 3]
+
+
+def test_without_snapshot_nothing_is_similar(tmp_path):
+    index = SimilarProductsIndex(str(tmp_path / "missing")).load()
+    assert index.path is None
+    assert index.get_similar(0) == ([], None)
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_limit_below_one_is_rejected(client, limit):
+    assert client.get(f"/api/products/1/similar?limit={limit}").status_code == 400
+
+
+def test_similar_endpoint(client):
+    response = client.get("/api/products/1/similar?limit=4")
+    assert response.status_code == 200
+    assert response.json["product_id"] == 1
+    assert client.get("/api/products/999999/similar").status_code == 404
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+from engine import redis_engine
+
+
+@pytest.fixture
+def client():
+    import app
+
+    return app.app.test_client()
+
+
+@pytest.fixture
+def profile():
+    scores = {product_id: float(product_id) for product_id in range(1, 6)}
+    redis_engine.cache_user_profile("session-1", scores)
+    return scores
+
+
+def get_ids(response):
+    return [affinity["id"] for affinity in response.json["affinities"]]
+
+
+def test_limit_returns_best_scores(client, profile):
+    response = client.get("/api/user_profile?session_id=session-1&limit=2")
+    assert response.status_code == 200
+    assert get_ids(response) == [5, 4]
+
+
+def test_without_limit_returns_whole_profile(client, profile):
+    response = client.get("/api/user_profile?session_id=session-1")
+    assert get_ids(response) == [5, 4, 3, 2, 1]
+
+
+@pytest.mark.parametrize("limit", [0, -1, -3])
+def test_limit_below_one_is_rejected(client, profile, limit):
+    response = client.get(f"/api/user_profile?session_id=session-1&limit={limit}")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("top_k", [0, -1, -3])
+def test_top_k_below_one_reads_nothing(profile, top_k):
+    assert redis_engine.get_user_profile_scores("session-1", top_k=top_k) == {}
+
+
+def test_migrate_profile_blobs_converts_json_profiles():
+    scores = {"1": 1.0, "2": 3.0, "3": 2.0}
+    redis_engine.redis_conn.set(
+        redis_engine.get_profile_key("legacy"),
+        json.dumps({"affinities": [{"id": int(product_id), "score": score} for product_id, score in scores.items()]}),
+    )
+    redis_engine.cache_user_profile("current", {1: 1.0})
+
+    assert redis_engine.migrate_profile_blobs() == 1
+    assert redis_engine.redis_conn.type(redis_engine.get_profile_key("legacy")) == "zset"
+    assert redis_engine.get_profile_scores_batch(["legacy"])["legacy"] == scores
+    assert redis_engine.migrate_profile_blobs() == 0
@@ -0,0 +1,70 @@
+import threading
+import time
+from collections import OrderedDict
+
+from db.catalog import get_catalog_version
+from utils.db_client import DB_PATH, get_db_connection
+
+
+class CatalogCache:
+    """
+    In-process cache for values derived from the catalog (counts, listings).
+    Entries are dropped as soon as the catalog version changes, which triggers
+    bump on every write and bulk loads bump once, so writers in other processes
+    need no hook. The version is re-read at most once per check_interval so
+    cache hits don't touch SQLite.
+    An optional ttl additionally bounds how long any entry is served.
+    """
+
+    def __init__(self, db_path=DB_PATH, check_interval=1.0, max_entries=1024, ttl=None):
+        self.db_path = db_path
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def _sync_version(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        with get_db_connection(self.db_path) as conn:
+            version = get_catalog_version(conn)
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            self._checked_at = now
+
+    def get(self, key, loader):
+        """Returns the cached value for key, calling loader() on a miss."""
+        self._sync_version()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(key)
+                return entry[0]
+            version = self._version
+
+        value = loader()
+
+        with self._lock:
+            # Don't store values computed against a catalog that has since changed
+            if version == self._version:
+                expires_at = now + self.ttl if self.ttl is not None else None
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, key=None):
+        """Drops one entry, or the whole cache when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
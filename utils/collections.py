@@ -1,15 +1,176 @@
-import json
+import atexit
+import queue
+import threading
+import time
 
 from kafka import KafkaProducer
 
-# Initialize Kafka producer
+from utils.events import encode_event
+from utils.metrics import KAFKA_ENQUEUE_LATENCY
+
+# What to do with a new event when the pipeline queue is full
+DROP_NEWEST = "drop_newest"  # Reject the incoming event
+DROP_OLDEST = "drop_oldest"  # Shed the oldest queued event to make room
+BLOCK = "block"  # Wait up to block_timeout for room, then reject
+
+# Initialize Kafka producer, batching and compressing in its own sender thread
 producer = KafkaProducer(
     bootstrap_servers="localhost:9092",
-    value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+    value_serializer=encode_event,
+    linger_ms=10,
+    batch_size=64 * 1024,
+    compression_type="gzip",
 )
 
+_STOP = object()
+
+
+class KafkaEventPipeline:
+    """
+    Hands events to Kafka from a background thread so callers never wait on the
+    broker. Events are buffered in a bounded queue, drained in batches and left
+    to the producer to linger, compress and ship. When the queue is full the
+    overflow policy decides whether to drop, shed or block.
+    """
+
+    def __init__(
+        self,
+        producer,
+        max_queue_size=10000,
+        batch_size=500,
+        overflow_policy=DROP_NEWEST,
+        block_timeout=0.05,
+        poll_interval=0.1,
+    ):
+        if overflow_policy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.producer = producer
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stats = {"queued": 0, "sent": 0, "dropped": 0, "failed": 0}
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="kafka-event-pipeline", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def _count(self, stat, amount=1):
+        with self._stats_lock:
+            self._stats[stat] += amount
+
+    def submit(self, topic, value, key=None):
+        """Queues an event for Kafka, returning False if it was dropped."""
+        if self._closed:
+            self._count("dropped")
+            return False
+
+        item = (topic, value, key, time.monotonic())
+        try:
+            if self.overflow_policy == BLOCK:
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            if self.overflow_policy != DROP_OLDEST:
+                self._count("dropped")
+                return False
+            self._shed_oldest(item)
+        self._count("queued")
+        return True
+
+    def submit_many(self, topic, values):
+        """Queues several events for the same topic, returning whether each was accepted."""
+        return [self.submit(topic, value) for value in values]
+
+    def _shed_oldest(self, item):
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.poll_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is _STOP:
+                    self._send_batch([i for i in batch if i is not _STOP])
+                    return
+            self._send_batch(batch)
+
+    def _send_batch(self, batch):
+        for topic, value, key, enqueued_at in batch:
+            try:
+                future = self.producer.send(topic, value=value, key=key)
+            except Exception:
+                self._count("failed")
+                continue
+            future.add_callback(self._on_send_success, enqueued_at)
+            future.add_errback(self._on_send_error)
+
+    def _on_send_success(self, enqueued_at, record_metadata):
+        # Time from the API accepting the event to the broker acknowledging it
+        KAFKA_ENQUEUE_LATENCY.observe(time.monotonic() - enqueued_at)
+        self._count("sent")
+
+    def _on_send_error(self, exception):
+        self._count("failed")
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["pending"] = self._queue.qsize()
+        return stats
+
+    def close(self, timeout=10):
+        """Stops accepting events, ships everything still queued and flushes the producer."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+        self.producer.flush(timeout=timeout)
+
+
+pipeline = KafkaEventPipeline(producer).start()
+atexit.register(pipeline.close)
+
 
 # Utility function to send events to Kafka
 def send_to_kafka(topic, data):
-    producer.send(topic, value=data)
-    producer.flush()
+    """Queues an event for Kafka without waiting on the broker."""
+    return pipeline.submit(topic, data)
+
+
+def send_batch_to_kafka(topic, events):
+    """Queues a batch of events for Kafka, returning whether each one was accepted."""
+    return pipeline.submit_many(topic, events)
+
+
+def get_kafka_stats():
+    return pipeline.get_stats()
@@ -0,0 +1,113 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+DB_PATH = "db/ecommerce.db"
+
+# Pragmas applied once when a pooled connection is opened
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",  # Readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",  # Safe with WAL, avoids an fsync per commit
+    "PRAGMA cache_size=-65536",  # 64MB page cache per connection
+    "PRAGMA mmap_size=268435456",  # Map up to 256MB of the database file
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+class ConnectionPool:
+    """
+    Keeps long-lived SQLite connections around instead of opening one per query.
+    Connections are checked out for the duration of a call and returned afterwards,
+    so the pool works for thread-per-request servers as well as worker threads.
+    """
+
+    def __init__(self, db_path=DB_PATH, max_size=8, cached_statements=256):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.cached_statements = cached_statements
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._pid = os.getpid()
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row  # Enables column access by name
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _reset_after_fork(self):
+        # Connections must never be shared across processes, drop the inherited ones
+        if self._pid != os.getpid():
+            self._idle = queue.LifoQueue(maxsize=self.max_size)
+            self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        """Checks out a connection, returning it to the pool when done."""
+        self._reset_after_fork()
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        """Closes every idle connection held by the pool."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_db_pool(db_path=DB_PATH):
+    """Returns the shared connection pool for a database file."""
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+
+def get_db_connection(db_path=DB_PATH):
+    """Checks out a pooled connection, to be used as a context manager."""
+    return get_db_pool(db_path).connection()
+
+
+def query_db(query, args=(), one=False, db_path=DB_PATH):
+    with get_db_connection(db_path) as conn:
+        result = conn.execute(query, args).fetchall()
+    return (result[0] if result else None) if one else result
+
+
+def execute_db(query, args=(), db_path=DB_PATH):
+    """Runs a write statement in its own transaction and returns the last row id."""
+    with get_db_connection(db_path) as conn:
+        with conn:
+            cur = conn.execute(query, args)
+        return cur.lastrowid
+
+
+def close_db_connections():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
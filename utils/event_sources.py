@@ -0,0 +1,115 @@
+import gzip
+import json
+
+from utils.events import Event, format_timestamp
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, only needed to read Parquet exports
+    pq = None
+
+# Rows decoded per Parquet batch
+PARQUET_BATCH_SIZE = 10000
+
+
+def read_jsonl(paths):
+    """Yields events from JSON lines files, e.g. a Kafka topic dump (gzip allowed)."""
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as events_file:
+            for line in events_file:
+                line = line.strip()
+                if line:
+                    yield line
+
+
+def _normalize_row(row):
+    """Maps a user_events row (archived or exported) back to tracking event fields."""
+    data = dict(row)
+    data["session_id"] = str(data.get("session_id"))
+    for key in ("product_id", "category_id"):
+        # The archive stores ids as text, with "None" for missing ones
+        if data.get(key) in ("None", ""):
+            data[key] = None
+    if hasattr(data.get("timestamp"), "strftime"):
+        data["timestamp"] = format_timestamp(data["timestamp"])
+    additional_context = data.get("additional_context")
+    if isinstance(additional_context, str):
+        data["additional_context"] = json.loads(additional_context)
+    elif additional_context is not None:
+        data["additional_context"] = dict(additional_context)
+    return data
+
+
+def read_parquet(paths, batch_size=PARQUET_BATCH_SIZE):
+    if pq is None:
+        raise SystemExit("Reading Parquet files requires pyarrow")
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size):
+            for row in batch.to_pylist():
+                yield _normalize_row(row)
+
+
+def read_cassandra(hosts, keyspace, fetch_size=5000, require_feedback=False):
+    """
+    Streams the user_events table. Rows arrive partition by partition, i.e. grouped
+    by session. Tables created before kafka_consumer archived feedback have nothing
+    to train on, so with require_feedback they are rejected up front.
+    """
+    from cassandra.cluster import Cluster
+    from cassandra.query import SimpleStatement, dict_factory
+
+    cluster = Cluster(hosts)
+    session = cluster.connect(keyspace)
+    session.row_factory = dict_factory
+    columns = "session_id, event_type, product_id, category_id, search_query, timestamp, additional_context"
+    if "feedback" in cluster.metadata.keyspaces[keyspace].tables["user_events"].columns:
+        columns += ", feedback"
+    elif require_feedback:
+        cluster.shutdown()
+        raise SystemExit(
+            "user_events has no feedback column, so there is nothing to train on. Add it with "
+            "ALTER TABLE user_events ADD feedback text, replay a JSONL dump of the Kafka topic "
+            "instead, or pass --no-train"
+        )
+    statement = SimpleStatement(f"SELECT {columns} FROM user_events", fetch_size=fetch_size)
+    return _stream_rows(cluster, session, statement)
+
+
+def _stream_rows(cluster, session, statement):
+    try:
+        for row in session.execute(statement):
+            yield _normalize_row(row)
+    finally:
+        cluster.shutdown()
+
+
+def decode(item):
+    """Events of every source as Events: JSON lines as read, rows as normalized dicts."""
+    return Event.from_json(item) if isinstance(item, str) else Event.from_dict(item)
+
+
+def add_source_arguments(parser):
+    """Adds the arguments picking the historical events a script reads."""
+    parser.add_argument("paths", nargs="*", help="JSONL (optionally .gz) or Parquet files")
+    parser.add_argument(
+        "--source",
+        choices=("jsonl", "parquet", "cassandra"),
+        default="jsonl",
+        help="Where to read historical events from",
+    )
+    parser.add_argument(
+        "--cassandra-hosts", nargs="+", default=["127.0.0.1"], help="Cassandra contact points"
+    )
+    parser.add_argument("--keyspace", default="personalization", help="Keyspace of user_events")
+
+
+def open_source(parser, args, **cassandra_options):
+    """Opens the source chosen by add_source_arguments, extra options go to read_cassandra."""
+    if args.source == "cassandra":
+        return read_cassandra(args.cassandra_hosts, args.keyspace, **cassandra_options)
+    if not args.paths:
+        parser.error(f"--source {args.source} needs at least one file")
+    if args.source == "parquet":
+        return read_parquet(args.paths)
+    return read_jsonl(args.paths)
@@ -0,0 +1,195 @@
+import json
+import re
+from datetime import datetime, timezone
+
+TRACKED_EVENT_TYPES = {
+    "view_product",
+    "click_category",
+    "search",
+    "add_to_cart",
+    "purchase",
+}
+
+EVENT_FIELDS = (
+    "session_id",
+    "event_type",
+    "timestamp",
+    "product_id",
+    "category_id",
+    "search_query",
+    "additional_context",
+    "feedback",
+)
+
+_FRACTION = re.compile(r"\.(\d+)")
+
+
+class EventValidationError(ValueError):
+    pass
+
+
+def parse_timestamp(value):
+    """
+    Parses an ISO-8601 timestamp into a naive UTC datetime. Accepts a trailing Z,
+    UTC offsets and any number of fractional digits, including none.
+    """
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    text = value[:-1] + "+00:00" if value.endswith("Z") else value
+    try:
+        parsed = datetime.fromisoformat(text)
+    except ValueError:
+        # Before Python 3.11 fromisoformat only takes 3 or 6 fractional digits
+        parsed = datetime.fromisoformat(
+            _FRACTION.sub(lambda match: "." + match.group(1)[:6].ljust(6, "0"), text, count=1)
+        )
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def format_timestamp(moment):
+    """Formats a naive UTC datetime the way tracking events carry it."""
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class Event:
+    """
+    A tracking event, validated once where it enters the system. The timestamp is
+    parsed on first use and kept, and the JSON text an event was read from is
+    reused when it is written again, so Kafka, Redis and the engine share one
+    serialization. Supports get() and [] so code written against event dicts
+    keeps working.
+    """
+
+    __slots__ = EVENT_FIELDS + ("_time", "_json")
+
+    def __init__(
+        self,
+        session_id,
+        event_type,
+        timestamp,
+        product_id=None,
+        category_id=None,
+        search_query=None,
+        additional_context=None,
+        feedback=None,
+    ):
+        self.session_id = session_id
+        self.event_type = event_type
+        self.timestamp = timestamp
+        self.product_id = product_id
+        self.category_id = category_id
+        self.search_query = search_query
+        self.additional_context = additional_context or {}
+        self.feedback = feedback
+        self._time = None
+        self._json = None
+
+    @property
+    def time(self):
+        if self._time is None:
+            self._time = parse_timestamp(self.timestamp)
+        return self._time
+
+    @classmethod
+    def from_dict(cls, data, default_timestamp=None):
+        if not isinstance(data, dict):
+            raise EventValidationError("Invalid event")
+        if not data.get("session_id"):
+            raise EventValidationError("Session ID is required")
+        additional_context = data.get("additional_context")
+        if additional_context is not None and not isinstance(additional_context, dict):
+            raise EventValidationError("additional_context must be an object")
+        return cls(
+            str(data["session_id"]),
+            data.get("event_type"),
+            data.get("timestamp") or default_timestamp,
+            data.get("product_id"),
+            data.get("category_id"),
+            data.get("search_query"),
+            additional_context,
+            data.get("feedback"),
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        try:
+            data = json.loads(text)
+        except ValueError as error:
+            raise EventValidationError(f"Invalid JSON: {error}") from error
+        event = cls.from_dict(data)
+        event._json = text if isinstance(text, str) else text.decode("utf-8")
+        return event
+
+    def to_dict(self):
+        data = {}
+        for field in EVENT_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                data[field] = value
+        return data
+
+    def to_json(self):
+        if self._json is None:
+            self._json = json.dumps(self.to_dict())
+        return self._json
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in EVENT_FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getstate__(self):
+        return self.to_json()
+
+    def __setstate__(self, state):
+        event = Event.from_json(state)
+        for slot in Event.__slots__:
+            setattr(self, slot, getattr(event, slot))
+
+    def __repr__(self):
+        return f"Event({self.to_dict()!r})"
+
+
+def validate_event(data, default_timestamp=None):
+    """
+    Validates an incoming tracking event and returns it as an Event, raising
+    EventValidationError with a client facing message otherwise. The timestamp is
+    rewritten in UTC with microseconds, the form Redis, Kafka and Cassandra
+    compare and order as text.
+    """
+    event = Event.from_dict(data, default_timestamp)
+    if event.event_type not in TRACKED_EVENT_TYPES:
+        raise EventValidationError("Invalid event type")
+    try:
+        event.timestamp = format_timestamp(event.time)
+    except ValueError:
+        raise EventValidationError("Invalid timestamp") from None
+    return event
+
+
+def as_event(event):
+    """Returns event as an Event, wrapping plain dicts without validating them."""
+    return event if isinstance(event, Event) else Event.from_dict(event)
+
+
+def decode_event(raw):
+    """Kafka value deserializer: returns an Event, or None for malformed messages."""
+    try:
+        return Event.from_json(raw.decode("utf-8"))
+    except (EventValidationError, UnicodeDecodeError):
+        return None
+
+
+def encode_event(value):
+    """Kafka value serializer accepting Events as well as plain JSON values."""
+    return (value.to_json() if isinstance(value, Event) else json.dumps(value)).encode("utf-8")
@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Processes sharing a PROMETHEUS_MULTIPROC_DIR (CB worker processes, multi-worker
+# API servers) write their samples there and are aggregated at scrape time
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling API requests",
+    ["method", "endpoint", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_LATENCY = Histogram(
+    "pipeline_stage_duration_seconds",
+    "Time spent in each stage between an event being tracked and its profile update",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+PROFILE_FRESHNESS = Histogram(
+    "profile_freshness_seconds",
+    "Time from an event's timestamp to the profile it updated landing in Redis",
+    buckets=LATENCY_BUCKETS,
+)
+EVENTS = Counter(
+    "consumer_events",
+    "Events handled by the Kafka consumers, by outcome",
+    ["consumer", "outcome"],
+)
+KAFKA_PIPELINE = Gauge(
+    "kafka_pipeline_events",
+    "Events seen by the API's Kafka producer pipeline, by state",
+    ["state"],
+    multiprocess_mode="livesum",
+)
+
+# Pre-bound children, labels are looked up once instead of on every event
+KAFKA_ENQUEUE_LATENCY = STAGE_LATENCY.labels("kafka_enqueue")
+CONSUMER_LAG = STAGE_LATENCY.labels("consumer_lag")
+CANDIDATE_LATENCY = STAGE_LATENCY.labels("candidate_generation")
+PREDICT_LATENCY = STAGE_LATENCY.labels("vw_predict")
+REDIS_RECORD_LATENCY = STAGE_LATENCY.labels("redis_record")
+REDIS_WRITE_LATENCY = STAGE_LATENCY.labels("redis_write")
+CASSANDRA_WRITE_LATENCY = STAGE_LATENCY.labels("cassandra_write")
+
+
+def get_event_age(event, now=None):
+    """Seconds since the event's timestamp, 0 for timestamps in the future or unparsable."""
+    try:
+        age = ((now or datetime.utcnow()) - event.time).total_seconds()
+    except ValueError:
+        return 0.0
+    return max(age, 0.0)
+
+
+def get_registry():
+    if not MULTIPROCESS:
+        return None
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics():
+    """Returns (body, content type) of the Prometheus text exposition."""
+    registry = get_registry()
+    if registry is None:
+        return generate_latest(), CONTENT_TYPE_LATEST
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port):
+    """Serves /metrics on its own port, for processes without an HTTP server."""
+    registry = get_registry()
+    if registry is None:
+        start_http_server(port)
+    else:
+        start_http_server(port, registry=registry)
+    print(f"Serving metrics on port {port}")
@@ -0,0 +1,56 @@
+import base64
+import json
+
+
+def parse_page_args(args, default_limit=10):
+    """
+    Reads limit and skip from request args, raising ValueError with a message
+    naming the bad parameter. A negative LIMIT would make SQLite return every row.
+    """
+    page = {}
+    for name, default, minimum in (("limit", default_limit, 1), ("skip", 0, 0)):
+        try:
+            page[name] = int(args.get(name, default))
+        except ValueError:
+            raise ValueError(f"{name} must be an integer") from None
+        if page[name] < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+    return page["limit"], page["skip"]
+
+
+def encode_cursor(sort_value, row_id):
+    """Encodes the position of the last row of a page as an opaque cursor."""
+    payload = json.dumps([sort_value, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor into (sort_value, id), raising ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        return sort_value, int(row_id)
+    except (TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor") from error
+
+
+def keyset_condition(sort_column, order, cursor, id_column="id"):
+    """
+    Builds the WHERE condition selecting the rows after a cursor, for a query
+    ordered by (sort_column, id_column) in the given direction.
+    """
+    sort_value, row_id = decode_cursor(cursor)
+    operator = "<" if order == "desc" else ">"
+    if sort_column == id_column:
+        return f"{id_column} {operator} ?", [row_id]
+    return f"({sort_column}, {id_column}) {operator} (?, ?)", [sort_value, row_id]
+
+
+def get_next_cursor(rows, limit, sort_key="id", id_key="id"):
+    """Returns the cursor for the page after rows, or None on the last page."""
+    if not rows or len(rows) < limit:
+        return None
+    last_row = rows[-1]
+    if sort_key not in last_row.keys() or id_key not in last_row.keys():
+        return None
+    return encode_cursor(last_row[sort_key], last_row[id_key])
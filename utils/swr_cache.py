@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StaleWhileRevalidateCache:
+    """
+    Bounded in-process LRU in front of a slower loader (e.g. Redis). Entries younger
+    than fresh_ttl are served as is. Entries younger than stale_ttl are still served
+    immediately, while a background thread reloads them. Anything older, or missing,
+    is loaded synchronously.
+    """
+
+    def __init__(self, loader, max_entries=10000, fresh_ttl=5, stale_ttl=300, refresh_workers=2):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.fresh_ttl = fresh_ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()  # key -> (value, loaded_at)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=refresh_workers, thread_name_prefix="swr-refresh"
+        )
+
+    def _store(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _refresh(self, key):
+        try:
+            self._store(key, self.loader(key))
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, loaded_at = entry
+                age = now - loaded_at
+                if age < self.fresh_ttl:
+                    self._entries.move_to_end(key)
+                    return value
+                if age < self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        self._executor.submit(self._refresh, key)
+                    return value
+
+        value = self.loader(key)
+        self._store(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)